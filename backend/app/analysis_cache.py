@@ -0,0 +1,127 @@
+"""アップロードファイルの分析結果キャッシュ（内容アドレス方式）
+
+同じ模試結果のPDF・画像が再アップロードされた場合に、OCRとLLM呼び出しをやり直さず
+保存済みの抽出テキストと分析結果を再利用する。
+- キー: アップロードされたバイト列のSHA-256（一時ファイルへの書き込みと同時に計算）
+- analysis_cache テーブル: ハッシュ・サイズ・最終利用日時などのメタデータ
+- ディスク上のblob: 抽出テキストと構造化された分析結果（JSON）
+blobの合計サイズが ANALYSIS_CACHE_MAX_BYTES を超えたら最終利用日時の古い順に削除する。
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import AnalysisCacheEntry
+
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "zerobasics_analysis_cache"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def save_upload(source: BinaryIO, suffix: str) -> Tuple[str, str, int]:
+    """アップロードを一時ファイルに書き出しながらSHA-256を計算する
+
+    戻り値は (一時ファイルパス, ハッシュ値, バイト数)。
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            temp_file.write(chunk)
+            size += len(chunk)
+    return temp_file.name, hasher.hexdigest(), size
+
+
+class AnalysisCache:
+    def __init__(self, directory: str = ANALYSIS_CACHE_DIR, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}.json")
+
+    def lookup(self, db: Session, content_hash: str) -> Optional[Tuple[int, Dict]]:
+        """キャッシュ済みの分析結果を返す（なければNone）。利用記録の更新は呼び出し側でコミットする"""
+        entry = db.scalars(select(AnalysisCacheEntry).where(AnalysisCacheEntry.content_hash == content_hash)).first()
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            with open(self._blob_path(content_hash), "rb") as blob:
+                payload = json.loads(blob.read())
+        except (OSError, ValueError):
+            # 別のインスタンスで作成された、または削除済みのblob
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.hit_count = (entry.hit_count or 0) + 1
+        entry.last_used_at = func.now()
+        return entry.id, payload
+
+    def store(self, db: Session, content_hash: str, file_ext: str, source_bytes: int, payload: Dict) -> int:
+        """分析結果を保存し、analysis_cache.id を返す"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        path = self._blob_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as blob:
+            blob.write(body)
+        os.replace(temp_path, path)
+
+        entry = db.scalars(select(AnalysisCacheEntry).where(AnalysisCacheEntry.content_hash == content_hash)).first()
+        if entry is None:
+            try:
+                with db.begin_nested():
+                    entry = AnalysisCacheEntry(
+                        content_hash=content_hash,
+                        file_ext=file_ext,
+                        source_bytes=source_bytes,
+                        blob_bytes=len(body),
+                        analysis_method=payload.get("analysis_method"),
+                        hit_count=0
+                    )
+                    db.add(entry)
+            except IntegrityError:
+                # 同じファイルが同時に分析された場合
+                entry = db.scalars(select(AnalysisCacheEntry).where(AnalysisCacheEntry.content_hash == content_hash)).one()
+        else:
+            entry.blob_bytes = len(body)
+            entry.last_used_at = func.now()
+        db.flush()
+
+        self._evict(db)
+        return entry.id
+
+    def _evict(self, db: Session) -> None:
+        """blobの合計サイズが上限を超えていたら最終利用日時の古い順に削除する"""
+        total = db.scalar(select(func.coalesce(func.sum(AnalysisCacheEntry.blob_bytes), 0)))
+        if total <= self.max_bytes:
+            return
+        oldest = db.scalars(select(AnalysisCacheEntry).order_by(AnalysisCacheEntry.last_used_at.asc(), AnalysisCacheEntry.id.asc()))
+        for entry in oldest.all():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(self._blob_path(entry.content_hash))
+            except OSError:
+                pass
+            total -= entry.blob_bytes
+            db.delete(entry)
+        db.flush()
+
+
+analysis_cache = AnalysisCache()
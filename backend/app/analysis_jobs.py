@@ -0,0 +1,267 @@
+"""テスト結果の分析ジョブ
+
+/upload-test-result はファイルを保存して TestResult を pending で作成し、202を返す。
+PDF抽出・OCR・LLM呼び出しはここのワーカーで実行し、イベントループを塞がない。
+- パイプライン全体（主にLLM待ち）はスレッドプールで実行
+- 画像OCRはCPUを使うためプロセスプールで実行
+OCR・PDF・LLMのライブラリは初回のジョブで読み込む。分析専用のワーカーでは
+ANALYSIS_PRELOAD=1 にすると起動時にバックグラウンドで読み込んでおく。
+キューが上限に達している場合は QueueFullError を送出する（APIは429を返す）。
+分析結果は analysis_cache に保存し、同じファイルの再アップロード時に再利用する。
+
+ジョブの状態と総評（overall_analysis 等）は TestResult の行に保存するため、どのワーカーに
+ポーリングしても同じ結果が返る。ジョブはこのプロセス内でのみ実行されるので、再起動・デプロイで
+中断したジョブは起動時（と状態の取得時）に fail_stale_jobs() で failed にする。
+状態が ANALYSIS_JOB_TIMEOUT 秒更新されていない pending / processing の行を中断とみなす。
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from .db import session_scope
+from .models import TestResult, TestResultDetail
+from .analysis_cache import analysis_cache
+from .event_log import log_event
+from .metrics import analysis_jobs_total
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_QUEUE_LIMIT = int(os.getenv("ANALYSIS_QUEUE_LIMIT", "20"))
+OCR_PROCESSES = int(os.getenv("OCR_PROCESSES", str(os.cpu_count() or 1)))
+# この秒数のあいだ状態が更新されていない pending / processing のジョブは中断したとみなす
+ANALYSIS_JOB_TIMEOUT = float(os.getenv("ANALYSIS_JOB_TIMEOUT", "900"))
+INTERRUPTED_ERROR = "分析が中断されました（サーバーの再起動など）。もう一度アップロードしてください"
+ANALYSIS_PRELOAD = os.getenv("ANALYSIS_PRELOAD", "0") == "1"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+_ocr_pool_lock = Lock()
+
+
+def ocr_pool() -> ProcessPoolExecutor:
+    """OCR用のプロセスプール（初回使用時に作成）"""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_PROCESSES, initializer=_init_ocr_process)
+        return _ocr_pool
+
+
+def _init_ocr_process() -> None:
+    """OCR用プロセスの起動時にワーカーの印を付け、OCRのライブラリだけを読み込む"""
+    from .test_analyzer import mark_ocr_worker, preload_ocr_dependencies
+    mark_ocr_worker()
+    preload_ocr_dependencies()
+
+
+def _extract_text_in_process(file_path: str) -> str:
+    """プロセスプールで実行する画像・PDFのテキスト抽出"""
+    from .test_analyzer import TestResultAnalyzer
+    return TestResultAnalyzer().extract_text_from_file(file_path)
+
+
+def analyze_file(file_path: str, file_ext: str, user_id: int) -> Tuple[Dict, bool]:
+    """ファイルを分析し、(キャッシュ可能な分析結果, キャッシュしてよいか) を返す
+
+    AIが使えずダミー分析になった結果はキャッシュしない。
+    """
+    from .test_analyzer import TestResultAnalyzer
+
+    analyzer = TestResultAnalyzer()
+    if file_ext == '.pdf':
+        # PDFファイルの場合は直接AIに送信
+        analysis_result = analyzer.analyze_pdf_directly_with_ai(file_path, user_id)
+        parsed_result = None
+        text = analysis_result.get('extracted_content', '')
+    else:
+        # 画像ファイルの場合はOCR→解析→AI分析
+        text = ocr_pool().submit(_extract_text_in_process, file_path).result()
+        if not text.strip():
+            raise Exception("ファイルからテキストを抽出できませんでした")
+        parsed = analyzer.parse_test_result(text)
+        analysis_result = analyzer.analyze_weaknesses_with_ai(parsed)
+        parsed_result = {key: parsed[key] for key in ('subject', 'test_name', 'total_score', 'max_score', 'score_percentage')}
+
+    payload = {
+        "parsed": parsed_result,
+        "extracted_text": text,
+        "overall_analysis": analysis_result['overall_analysis'],
+        "analysis_method": analysis_result.get('analysis_method'),
+        "topics": analysis_result['topics']
+    }
+    cacheable = analyzer.client is not None and payload["analysis_method"] != 'ダミー分析'
+    return payload, cacheable
+
+
+def apply_analysis(db: Session, test_result: TestResult, payload: Dict,
+                   subject: Optional[str], test_name: Optional[str]) -> None:
+    """分析結果をTestResultに反映し、単元別詳細を追加する"""
+    test_result.overall_analysis = payload.get("overall_analysis")
+    test_result.analysis_method = payload.get("analysis_method")
+    parsed_result = payload.get("parsed")
+    if parsed_result:
+        test_result.subject = subject or parsed_result['subject']
+        test_result.test_name = test_name or parsed_result['test_name']
+        test_result.total_score = parsed_result['total_score'] or 0
+        test_result.max_score = parsed_result['max_score'] or 100
+        test_result.score_percentage = parsed_result['score_percentage']
+
+    # 単元別詳細を保存
+    db.add_all([
+        TestResultDetail(
+            test_result_id=test_result.id,
+            topic=topic_data['topic'],
+            correct_count=topic_data['correct_count'],
+            total_count=topic_data['total_count'],
+            score_percentage=topic_data['score_percentage'],
+            weakness_analysis=topic_data.get('weakness_analysis'),
+            improvement_advice=topic_data.get('improvement_advice')
+        )
+        for topic_data in payload['topics']
+    ])
+
+
+def run_analysis(test_result_id: int, file_path: str, file_ext: str, user_id: int,
+                 subject: Optional[str], test_name: Optional[str],
+                 content_hash: Optional[str], source_bytes: int) -> None:
+    """分析パイプラインを実行し、TestResult（総評を含む）とTestResultDetailを更新する"""
+    with session_scope() as db:
+        try:
+            test_result = db.get(TestResult, test_result_id)
+            test_result.analysis_status = "processing"
+            test_result.analysis_updated_at = datetime.now()
+            db.commit()
+
+            payload, cacheable = analyze_file(file_path, file_ext, user_id)
+            apply_analysis(db, test_result, payload, subject, test_name)
+
+            if cacheable and content_hash:
+                try:
+                    test_result.analysis_cache_id = analysis_cache.store(db, content_hash, file_ext, source_bytes, payload)
+                except Exception as e:
+                    log_event("analysis_cache_store_failed", level="warning", test_result_id=test_result_id, error=str(e))
+
+            test_result.analysis_status = "completed"
+            test_result.analysis_error = None
+            test_result.analysis_updated_at = datetime.now()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            test_result = db.get(TestResult, test_result_id)
+            if test_result:
+                test_result.analysis_status = "failed"
+                test_result.analysis_error = str(e)
+                test_result.analysis_updated_at = datetime.now()
+                db.commit()
+            raise
+
+
+def fail_stale_jobs(db: Session, test_result_ids: Optional[List[int]] = None) -> int:
+    """ANALYSIS_JOB_TIMEOUT 秒以上更新のない pending / processing のジョブを failed にし、件数を返す
+
+    実行中のジョブは状態が変わるたびに analysis_updated_at を更新するため、他のワーカーで
+    実行中のジョブを誤って failed にすることはない（タイムアウトを超えて実行中のものを除く）。
+    """
+    now = datetime.now()
+    stmt = (
+        update(TestResult)
+        .where(
+            TestResult.analysis_status.in_(("pending", "processing")),
+            or_(TestResult.analysis_updated_at.is_(None),
+                TestResult.analysis_updated_at < now - timedelta(seconds=ANALYSIS_JOB_TIMEOUT)),
+        )
+        .values(analysis_status="failed", analysis_error=INTERRUPTED_ERROR, analysis_updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if test_result_ids is not None:
+        stmt = stmt.where(TestResult.id.in_(test_result_ids))
+    count = db.execute(stmt).rowcount
+    db.commit()
+    if count:
+        analysis_jobs_total.inc(count, outcome="interrupted")
+        log_event("analysis_jobs_interrupted", level="warning", count=count)
+    return count
+
+
+def is_stale(test_result: TestResult) -> bool:
+    """pending / processing のまま ANALYSIS_JOB_TIMEOUT 秒以上更新されていないか"""
+    if test_result.analysis_status not in ("pending", "processing"):
+        return False
+    updated_at = test_result.analysis_updated_at
+    return updated_at is None or (datetime.now().timestamp() - updated_at.timestamp()) > ANALYSIS_JOB_TIMEOUT
+
+
+class AnalysisJobQueue:
+    def __init__(self, workers: int = ANALYSIS_WORKERS, limit: int = ANALYSIS_QUEUE_LIMIT):
+        self.workers = workers
+        self.limit = limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self._lock = Lock()
+        self._pending = 0
+
+    @property
+    def depth(self) -> int:
+        """実行中・待機中のジョブ数"""
+        return self._pending
+
+    def reserve(self) -> None:
+        """ジョブ枠を確保する（満杯なら QueueFullError）"""
+        with self._lock:
+            if self._pending >= self.limit:
+                raise QueueFullError(f"Analysis queue is full ({self.limit} jobs)")
+            self._pending += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, test_result_id: int, file_path: str, file_ext: str, user_id: int,
+               subject: Optional[str], test_name: Optional[str],
+               content_hash: Optional[str] = None, source_bytes: int = 0) -> None:
+        """reserve() 済みの枠でジョブを実行する"""
+        self._executor.submit(self._run, test_result_id, file_path, file_ext, user_id, subject, test_name,
+                              content_hash, source_bytes)
+
+    def _run(self, test_result_id: int, file_path: str, *args) -> None:
+        started = time.perf_counter()
+        try:
+            run_analysis(test_result_id, file_path, *args)
+            analysis_jobs_total.inc(outcome="completed")
+            log_event("analysis_job_completed", test_result_id=test_result_id,
+                      elapsed_sec=round(time.perf_counter() - started, 3))
+        except Exception as e:
+            analysis_jobs_total.inc(outcome="failed")
+            log_event("analysis_job_failed", level="error", test_result_id=test_result_id, error=str(e))
+        finally:
+            self.release()
+            try:
+                os.unlink(file_path)
+            except OSError:
+                pass  # 削除に失敗しても無視
+
+    def preload(self) -> None:
+        """分析で使うライブラリをワーカースレッドで読み込んでおく（起動をブロックしない）"""
+        def _preload():
+            from .test_analyzer import preload_dependencies
+            started = time.perf_counter()
+            preload_dependencies()
+            log_event("analysis_dependencies_preloaded", sample_rate=1.0,
+                      elapsed_sec=round(time.perf_counter() - started, 3))
+        self._executor.submit(_preload)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(wait=False, cancel_futures=True)
+
+
+analysis_jobs = AnalysisJobQueue()
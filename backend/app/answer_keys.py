@@ -0,0 +1,163 @@
+"""採点用の解答キーキャッシュ
+
+Question.answer を毎回 json.loads せず、正規化済みの解答キーを question_id をキーとするLRUに保持する。
+- ORMでの問題の更新・削除はこのプロセスのエントリを即座に無効化する（after_update / after_delete）。
+- 他のワーカーでの更新や一括UPDATE（Core・SQL）はイベントが届かないため、エントリは
+  ANSWER_KEY_TTL 秒で期限切れにして読み直す（古い解答キーで採点し続けるのはこの秒数まで）。
+- 読み込み中に無効化があった場合は、読んだ値をキャッシュに入れない（古い値で上書きしない）。
+"""
+import json
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+import time
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .event_log import log_event
+from .models import Question
+
+ANSWER_KEY_CACHE_SIZE = int(os.getenv("ANSWER_KEY_CACHE_SIZE", "4096"))
+ANSWER_KEY_TTL = float(os.getenv("ANSWER_KEY_TTL", "60"))
+
+_COMMA_PATTERN = re.compile(r"[,，、]")
+_SPACE_PATTERN = re.compile(r"\s+")
+# 数字の直後に付く単位（NFKC正規化後の表記）
+_UNIT_PATTERN = re.compile(
+    r"(?<=\d)(?:円|km|cm|mm|m|kg|mg|g|l|ml|dl|個|人|本|枚|冊|台|匹|頭|回|点|歳|才|分|秒|時間|日|週|年|度|°|%|倍|通り|番目|cm2|cm3|m2|m3)$"
+)
+
+
+def normalize_answer(value) -> str:
+    """解答文字列を比較用に正規化（全角→半角、桁区切り・空白を除去。単位は残す）"""
+    text = unicodedata.normalize("NFKC", str(value)).strip().lower()
+    text = _COMMA_PATTERN.sub("", text)
+    return _SPACE_PATTERN.sub("", text)
+
+
+def accepted_forms(value) -> Tuple[str, ...]:
+    """解答キーの1つの表記で正解とする形（単位付きなら、その単位を省いた形も正解にする）
+
+    単位は解答キーにある単位だけを省略できる。別の単位の解答（"2時間" と "2分"、"3m" と "3km"）は不正解。
+    """
+    text = normalize_answer(value)
+    bare = _UNIT_PATTERN.sub("", text)
+    return (text, bare) if bare != text else (text,)
+
+
+def load_answer(raw) -> Dict:
+    """answerカラムの値を辞書に変換（json.dumps済みの文字列も受け付ける）"""
+    if isinstance(raw, str):
+        return json.loads(raw)
+    return raw or {}
+
+
+class AnswerKey(NamedTuple):
+    primary: str
+    accepted: FrozenSet[str]
+    subject: Optional[str] = None  # 採点後に復習キュー（科目別）を更新するため
+    topic: Optional[str] = None  # 採点と同じトランザクションで単元別の集計を更新するため
+    error: Optional[str] = None  # answerカラムが読めない場合の理由（この問題の解答は採点しない）
+
+    @classmethod
+    def compile(cls, raw, subject: Optional[str] = None, topic: Optional[str] = None) -> "AnswerKey":
+        """answerカラムの値から解答キーを作る（読めない値は例外にせず error 付きの解答キーにする）"""
+        try:
+            data = load_answer(raw)
+            primary = str(data["primary"])
+            variants = data.get("variants") or []
+            accepted = frozenset(form for v in [primary, *variants] for form in accepted_forms(v))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return cls(primary="", accepted=frozenset(), subject=subject, topic=topic,
+                       error=f"{type(e).__name__}: {e}")
+        return cls(primary=primary, accepted=accepted, subject=subject, topic=topic)
+
+    def check(self, user_answer: str) -> bool:
+        return normalize_answer(user_answer) in self.accepted
+
+
+class AnswerKeyCache:
+    def __init__(self, maxsize: int = ANSWER_KEY_CACHE_SIZE, ttl: float = ANSWER_KEY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # question_id → (解答キー, 期限（time.monotonic）)
+        self._entries: "OrderedDict[int, Tuple[AnswerKey, float]]" = OrderedDict()
+        # invalidate / clear のたびに上がる番号（読み込み中の無効化の検出用）
+        self._generation = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, question_id: int, now: float) -> Optional[AnswerKey]:
+        entry = self._entries.get(question_id)
+        if entry is not None and entry[1] > now:
+            self._entries.move_to_end(question_id)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            del self._entries[question_id]
+        self.misses += 1
+        return None
+
+    def _store(self, question_id: int, answer_key: AnswerKey, now: float) -> None:
+        self._entries[question_id] = (answer_key, now + self.ttl)
+        self._entries.move_to_end(question_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, db: Session, question_id: int) -> Optional[AnswerKey]:
+        """解答キーを取得（キャッシュにない場合のみDBから読む）。問題がなければNone"""
+        return self.get_many(db, [question_id]).get(question_id)
+
+    def get_many(self, db: Session, question_ids: Iterable[int]) -> Dict[int, AnswerKey]:
+        """複数の解答キーを取得（キャッシュにないものはIN句で1回だけ読む）"""
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            for question_id in set(question_ids):
+                answer_key = self._lookup(question_id, now)
+                if answer_key is None:
+                    missing.append(question_id)
+                else:
+                    found[question_id] = answer_key
+        if not missing:
+            return found
+
+        rows = db.execute(
+            select(Question.id, Question.answer, Question.subject, Question.topic).where(Question.id.in_(missing))
+        ).all()
+        with self._lock:
+            cacheable = self._generation == generation
+            for row in rows:
+                answer_key = AnswerKey.compile(row.answer, row.subject, row.topic)
+                if answer_key.error is not None:
+                    log_event("answer_key_invalid", level="warning", question_id=row.id, error=answer_key.error)
+                if cacheable:
+                    self._store(row.id, answer_key, now)
+                found[row.id] = answer_key
+        return found
+
+    def invalidate(self, question_id: int) -> None:
+        with self._lock:
+            self._entries.pop(question_id, None)
+            self._generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+answer_keys = AnswerKeyCache()
+
+
+@event.listens_for(Question, "after_update")
+@event.listens_for(Question, "after_delete")
+def _invalidate_answer_key(mapper, connection, target):
+    answer_keys.invalidate(target.id)
@@ -1,8 +1,15 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 import urllib.parse
 
+from contextlib import contextmanager
+
+from .engine_config import engine_options, install_sqlite_pragmas
+from .query_stats import install_query_stats, install_row_counter
+
 # Get database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./zerobasics.db")
 
@@ -10,19 +17,48 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./zerobasics.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# Configure engine based on database type
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    # PostgreSQL configuration
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
+# Configure engine based on database type（プール・PRAGMAは engine_config の環境変数で調整）
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+install_sqlite_pragmas(engine)
+install_query_stats(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+install_row_counter(Base)
 
-def get_db():
+def _async_database_url(url: str) -> str:
+    """同じデータベースを非同期ドライバ（aiosqlite / asyncpg）で開くURL"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    # asyncpg は sslmode ではなく ssl を受け付ける
+    query = dict(url.query)
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return url.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+# 高頻度のエンドポイント（出題・採点・テスト結果取得）用の非同期エンジン
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+install_sqlite_pragmas(async_engine.sync_engine)
+install_query_stats(async_engine.sync_engine)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+@contextmanager
+def session_scope():
+    """セッションを開いて終了時に閉じる（起動処理などリクエスト外でも使う）"""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_db():
+    with session_scope() as db:
+        yield db
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,226 @@
+"""単元の前提関係グラフ
+
+math/science/social の単元と前提関係（topic_edges）を科目ごとに1回だけ読み込み、
+単元名を整数IDに変換した隣接リストとして保持する。
+前提単元・後続単元の推移的な探索は O(V+E) で、結果は単元ごとにメモ化する。
+管理画面から依存関係が更新されたら invalidate() で再構築する。
+"""
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict, deque
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .event_log import log_event
+from .models import TopicEdge
+from .topic_edges import dependency_model
+
+# 他のワーカーでの更新を取り込むため、この秒数が経過したグラフは読み直す
+DEPENDENCY_GRAPH_TTL = float(os.getenv("DEPENDENCY_GRAPH_TTL", "300"))
+
+
+class FlowArtifact(NamedTuple):
+    """/dependencies/{subject}/flow のシリアライズ済みレスポンス"""
+    body: bytes
+    etag: str
+
+
+class DependencyGraph:
+    def __init__(self, subject: str, rows: List[Tuple[int, str, List[str], Optional[int], Optional[str]]]):
+        """rows は (依存関係ID, 単元名, 前提単元名のリスト, topic_id, domain) のリスト"""
+        self.subject = subject
+        self.names: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.info: List[Dict] = []
+        raw_prerequisites: List[List[str]] = []
+
+        for dep_id, topic_name, prerequisite_names, topic_id, domain in rows:
+            if topic_name in self.index:
+                continue  # 同名の単元は最初の行を採用（従来の .first() と同じ）
+            self.index[topic_name] = len(self.names)
+            self.names.append(topic_name)
+            self.info.append({"id": dep_id, "topic_id": topic_id, "domain": domain})
+            raw_prerequisites.append(prerequisite_names)
+        self.declared_prerequisites = raw_prerequisites
+
+        # 前提単元（テーブルに存在する単元のみ）と後続単元の隣接リスト
+        self.prerequisites: List[List[int]] = []
+        self.dependents: List[List[int]] = [[] for _ in self.names]
+        for node, prerequisite_names in enumerate(raw_prerequisites):
+            edges = []
+            for name in prerequisite_names:
+                prerequisite = self.index.get(name)
+                if prerequisite is not None and prerequisite not in edges:
+                    edges.append(prerequisite)
+                    self.dependents[prerequisite].append(node)
+            self.prerequisites.append(edges)
+
+        self.topological_order, self.levels, self.cyclic = self._kahn()
+        self._flow: Optional[FlowArtifact] = None
+        self._ancestors: Dict[int, Tuple[int, ...]] = {}
+        self._descendants: Dict[int, Tuple[int, ...]] = {}
+        self.loaded_at = time.monotonic()
+
+    def _kahn(self) -> Tuple[List[int], List[int], Set[int]]:
+        """トポロジカル順序とレベル（根からの最長距離）を求める
+
+        循環に関わる単元は順序に含まれないため、最大レベル+1 のレベルに置く。
+        """
+        in_degree = [len(edges) for edges in self.prerequisites]
+        levels = [0] * len(self.names)
+        queue = deque(node for node, degree in enumerate(in_degree) if degree == 0)
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for dependent in self.dependents[node]:
+                levels[dependent] = max(levels[dependent], levels[node] + 1)
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
+        cyclic = set(range(len(self.names))) - set(order)
+        if cyclic:
+            sample = [self.names[n] for n in sorted(cyclic)[:5]]
+            log_event("dependency_cycle_detected", level="warning", subject=self.subject, topics=len(cyclic),
+                      sample=sample)
+            cyclic_level = max((levels[n] for n in order), default=-1) + 1
+            for node in cyclic:
+                levels[node] = cyclic_level
+        return order, levels, cyclic
+
+    @staticmethod
+    def _closure(start: int, adjacency: List[List[int]], memo: Dict[int, Tuple[int, ...]]) -> Tuple[int, ...]:
+        """幅優先で到達可能な単元を近い順に返す（循環があっても停止する）"""
+        cached = memo.get(start)
+        if cached is not None:
+            return cached
+        seen = {start}
+        order = []
+        queue = deque(adjacency[start])
+        while queue:
+            node = queue.popleft()
+            if node in seen:
+                continue
+            seen.add(node)
+            order.append(node)
+            queue.extend(adjacency[node])
+        result = memo[start] = tuple(order)
+        return result
+
+    def __contains__(self, topic_name: str) -> bool:
+        return topic_name in self.index
+
+    def topic_info(self, topic_name: str) -> Dict:
+        return self.info[self.index[topic_name]]
+
+    def direct_prerequisites(self, topic_name: str) -> List[str]:
+        return [self.names[n] for n in self.prerequisites[self.index[topic_name]]]
+
+    def all_prerequisites(self, topic_name: str) -> List[str]:
+        """推移的な前提単元（近い順）"""
+        nodes = self._closure(self.index[topic_name], self.prerequisites, self._ancestors)
+        return [self.names[n] for n in nodes]
+
+    def all_dependents(self, topic_name: str) -> List[str]:
+        """推移的な後続単元（近い順）"""
+        nodes = self._closure(self.index[topic_name], self.dependents, self._descendants)
+        return [self.names[n] for n in nodes]
+
+    def learning_path(self, topic_name: str) -> List[str]:
+        """前提単元を学習順（トポロジカル順）に並べ、最後に目標単元を置く"""
+        target = self.index[topic_name]
+        closure = self._closure(target, self.prerequisites, self._ancestors)
+        ancestors = set(closure)
+        ordered = [n for n in self.topological_order if n in ancestors]
+        # 循環に含まれる単元はトポロジカル順に現れないので近い順で末尾に追加
+        ordered += [n for n in closure if n in self.cyclic and n != target]
+        return [self.names[n] for n in ordered] + [topic_name]
+
+    def flow_artifact(self) -> FlowArtifact:
+        """フロントエンド用のフローをJSONバイト列とETagにして返す（グラフごとに1回だけ生成）"""
+        if self._flow is not None:
+            return self._flow
+        topics = [
+            {
+                "id": self.info[node]["id"],
+                "name": name,
+                "prerequisites": self.declared_prerequisites[node],
+                "dependencies": [self.names[n] for n in self.dependents[node]],
+                "subject": self.subject,
+                "domain": self.info[node]["domain"]
+            }
+            for node, name in enumerate(self.names)
+        ]
+        level_groups: Dict[int, List[Dict]] = {}
+        for node in sorted(range(len(self.names)), key=lambda n: self.levels[n]):
+            level_groups.setdefault(self.levels[node], []).append(topics[node])
+
+        body = json.dumps(
+            {"subject": self.subject, "levels": level_groups, "topics": topics},
+            ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        self._flow = FlowArtifact(body=body, etag=f'"{hashlib.sha256(body).hexdigest()}"')
+        return self._flow
+
+
+def load_dependency_graph(db: Session, subject: str) -> DependencyGraph:
+    """単元（依存関係テーブル）と前提関係の辺をそれぞれ1クエリで読み込んでグラフを構築"""
+    model = dependency_model(subject)
+    nodes = db.execute(
+        select(model.id, model.topic_name, model.topic_id, model.domain).order_by(model.id)
+    ).all()
+    names = {dep_id: topic_name for dep_id, topic_name, _, _ in nodes}
+
+    prerequisites: Dict[int, List[str]] = defaultdict(list)
+    for from_id, to_id in db.execute(
+        select(TopicEdge.from_id, TopicEdge.to_id)
+        .where(TopicEdge.subject == subject.lower())
+        .order_by(TopicEdge.to_id, TopicEdge.from_id)
+    ):
+        if from_id in names:
+            prerequisites[to_id].append(names[from_id])
+
+    rows = [(dep_id, topic_name, prerequisites.get(dep_id, []), topic_id, domain)
+            for dep_id, topic_name, topic_id, domain in nodes]
+    return DependencyGraph(subject.lower(), rows)
+
+
+class DependencyGraphRegistry:
+    """科目ごとのグラフを保持し、必要に応じて再構築する"""
+
+    def __init__(self, ttl: float = DEPENDENCY_GRAPH_TTL):
+        self.ttl = ttl
+        self._graphs: Dict[str, DependencyGraph] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, subject: str) -> DependencyGraph:
+        subject = subject.lower()
+        graph = self._graphs.get(subject)
+        if graph is not None and time.monotonic() - graph.loaded_at < self.ttl:
+            self.hits += 1
+            return graph
+        with self._lock:
+            graph = self._graphs.get(subject)
+            if graph is None or time.monotonic() - graph.loaded_at >= self.ttl:
+                self.misses += 1
+                graph = self._graphs[subject] = load_dependency_graph(db, subject)
+            else:
+                self.hits += 1
+        return graph
+
+    def invalidate(self, subject: Optional[str] = None) -> None:
+        with self._lock:
+            if subject is None:
+                self._graphs.clear()
+            else:
+                self._graphs.pop(subject.lower(), None)
+
+
+dependency_graphs = DependencyGraphRegistry()
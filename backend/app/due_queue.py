@@ -0,0 +1,269 @@
+"""ユーザーごとの復習キュー（プロセス内キャッシュ）
+
+/next-question のたびに mastery を next_review_at <= now で問い合わせる代わりに、ユーザーの
+Mastery（問題ID・next_review_at・科目）を最初のリクエストで1回読み込み、科目ごとのヒープに保持する。
+期限を迎えた問題の取り出しは O(log n) で、Masteryへのクエリは不要になる。
+
+- 採点（grade_answer / grade_batch）は Mastery を更新したトランザクションで mastery_versions の
+  番号を上げ、コミット後に write_through() でキューにも反映する（ヒープには新しい要素を追加し、
+  古い要素は取り出すときに読み飛ばす）。
+- 他のワーカーでの更新を取りこぼさないよう、出題する問題の取得と同じクエリで mastery_versions を読み、
+  キューを読み込んだときの番号と違えば読み直してから選び直す。古いキューから出題することはない。
+- ユーザー数は DUE_QUEUE_MAX_USERS、保持する問題数の合計は DUE_QUEUE_MAX_ENTRIES までとし、
+  超えたら最近使われていないユーザーから破棄する。1人で上限を超えるユーザーはキャッシュせずSQLで選ぶ。
+"""
+import heapq
+import os
+import random
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .models import Mastery, MasteryVersion, Question
+
+DUE_QUEUE_MAX_USERS = int(os.getenv("DUE_QUEUE_MAX_USERS", "10000"))
+DUE_QUEUE_MAX_ENTRIES = int(os.getenv("DUE_QUEUE_MAX_ENTRIES", "2000000"))
+
+
+def bump_mastery_versions(db: Session, user_ids: Iterable[int]) -> Dict[int, int]:
+    """ユーザーの番号を1つ上げ、上げた後の番号を返す（Masteryを更新するトランザクション内で呼ぶ）"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    table = MasteryVersion.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        versions = {}
+        for user_id in user_ids:
+            row = db.get(MasteryVersion, user_id, with_for_update=True)
+            if row is None:
+                row = MasteryVersion(user_id=user_id, version=0)
+                db.add(row)
+            row.version += 1
+            versions[user_id] = row.version
+        db.flush()
+        return versions
+
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id], set_={"version": table.c.version + 1}
+    ).returning(table.c.user_id, table.c.version)
+    return {
+        user_id: version
+        for user_id, version in db.execute(stmt, [{"user_id": user_id, "version": 1} for user_id in user_ids])
+    }
+
+
+def bump_mastery_version(db: Session, user_id: int) -> int:
+    return bump_mastery_versions(db, [user_id])[user_id]
+
+
+def _version_column(user_id: int):
+    return func.coalesce(
+        select(MasteryVersion.version).where(MasteryVersion.user_id == user_id).scalar_subquery(), 0
+    ).label("mastery_version")
+
+
+def mastery_version(db: Session, user_id: int) -> int:
+    return db.execute(select(_version_column(user_id))).scalar()
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    # DBの値がタイムゾーン付きでもなしでも比較できるようUNIX時刻にする
+    return value.timestamp() if value is not None else None
+
+
+class UserQueue:
+    """1ユーザー分の復習キュー（科目ごとの (next_review_at, question_id) のヒープ）"""
+
+    __slots__ = ("version", "heaps", "entries")
+
+    def __init__(self, version: int):
+        self.version = version
+        self.heaps: Dict[Optional[str], List[Tuple[float, int]]] = {}
+        # 問題ID → (next_review_at, 科目)。ヒープ内でこれと一致しない要素は古い要素として読み飛ばす
+        self.entries: Dict[int, Tuple[float, Optional[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def push(self, question_id: int, due: Optional[float], subject: Optional[str]) -> None:
+        if due is None:
+            self.entries.pop(question_id, None)
+            return
+        self.entries[question_id] = (due, subject)
+        heap = self.heaps.setdefault(subject, [])
+        heapq.heappush(heap, (due, question_id))
+        if len(heap) > 2 * len(self.entries) + 64:
+            self._compact(subject)
+
+    def remove(self, question_id: int) -> None:
+        self.entries.pop(question_id, None)
+
+    def _compact(self, subject: Optional[str]) -> None:
+        heap = [(due, qid) for qid, (due, s) in self.entries.items() if s == subject]
+        heapq.heapify(heap)
+        self.heaps[subject] = heap
+
+    def _is_live(self, item: Tuple[float, int], subject: Optional[str]) -> bool:
+        return self.entries.get(item[1]) == (item[0], subject)
+
+    def due(self, subject: Optional[str], now: float, window: int) -> List[int]:
+        """期限を迎えた問題を古い順に最大 window 件返す（ヒープからは取り除かない）"""
+        subjects = [subject] if subject else list(self.heaps)
+        taken: List[Tuple[Tuple[float, int], Optional[str]]] = []
+        while len(taken) < window:
+            best = None
+            for name in subjects:
+                heap = self.heaps.get(name)
+                while heap and not self._is_live(heap[0], name):
+                    heapq.heappop(heap)
+                if heap and heap[0][0] <= now and (best is None or heap[0] < self.heaps[best][0]):
+                    best = name
+            if best is None:
+                break
+            taken.append((heapq.heappop(self.heaps[best]), best))
+        for item, name in taken:
+            heapq.heappush(self.heaps[name], item)
+        return [item[1] for item, _ in taken]
+
+
+class DueQueueCache:
+    def __init__(self, max_users: int = DUE_QUEUE_MAX_USERS, max_entries: int = DUE_QUEUE_MAX_ENTRIES):
+        self.max_users = max_users
+        self.max_entries = max_entries
+        self._queues: "OrderedDict[int, UserQueue]" = OrderedDict()
+        self._entries = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _store(self, user_id: int, queue: UserQueue) -> None:
+        self._discard(user_id)
+        self._queues[user_id] = queue
+        self._entries += len(queue)
+        while len(self._queues) > self.max_users or self._entries > self.max_entries:
+            _, evicted = self._queues.popitem(last=False)
+            self._entries -= len(evicted)
+
+    def _discard(self, user_id: int) -> None:
+        queue = self._queues.pop(user_id, None)
+        if queue is not None:
+            self._entries -= len(queue)
+
+    def load(self, db: Session, user_id: int) -> Optional[UserQueue]:
+        """ユーザーのMasteryを読み込んでキューを作る（上限を超えるユーザーはNone）"""
+        # 番号を先に読む（読み込み中に更新されても、次の確認で番号が合わず読み直しになる）
+        version = mastery_version(db, user_id)
+        rows = db.execute(
+            select(Mastery.question_id, Mastery.next_review_at, Question.subject)
+            .join(Question, Question.id == Mastery.question_id)
+            .where(Mastery.user_id == user_id, Mastery.next_review_at.isnot(None))
+            .limit(self.max_entries + 1)
+        ).all()
+        if len(rows) > self.max_entries:
+            return None
+        queue = UserQueue(version)
+        for question_id, next_review_at, subject in rows:
+            queue.entries[question_id] = (_timestamp(next_review_at), subject)
+        for subject in {subject for _, subject in queue.entries.values()}:
+            queue._compact(subject)
+        with self._lock:
+            self._store(user_id, queue)
+        return queue
+
+    def get(self, db: Session, user_id: int) -> Optional[UserQueue]:
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is not None:
+                self._queues.move_to_end(user_id)
+                self.hits += 1
+                return queue
+            self.misses += 1
+        return self.load(db, user_id)
+
+    def pick(self, db: Session, user_id: int, subject: Optional[str], window: int,
+             now: Optional[datetime] = None) -> Optional[Question]:
+        """期限を迎えた問題から1問選ぶ（古い順の window 件から抽選）。なければNone
+
+        問題の取得と同じクエリで番号を確認し、キューが古ければ読み直して選び直す。
+        """
+        now_ts = (now or datetime.now()).timestamp()
+        for _ in range(3):
+            queue = self.get(db, user_id)
+            if queue is None:
+                from .scheduler import pick_due_question
+                return pick_due_question(db, user_id, subject, now)
+
+            with self._lock:
+                candidates = queue.due(subject, now_ts, window)
+            if not candidates:
+                if mastery_version(db, user_id) == queue.version:
+                    return None
+                self._reload(user_id)
+                continue
+
+            question_id = random.choice(candidates)
+            row = db.execute(select(Question, _version_column(user_id)).where(Question.id == question_id)).first()
+            if row is None or row.mastery_version != queue.version:
+                self._reload(user_id)
+                continue
+            if subject and row.Question.subject != subject:
+                # 問題の科目が変更された
+                with self._lock:
+                    queue.remove(question_id)
+                continue
+            return row.Question
+
+        from .scheduler import pick_due_question
+        return pick_due_question(db, user_id, subject, now)
+
+    def _reload(self, user_id: int) -> None:
+        self.stale += 1
+        self.invalidate(user_id)
+
+    def write_through(self, user_id: int, version: int,
+                      updates: Iterable[Tuple[int, Optional[datetime], Optional[str]]]) -> None:
+        """コミットしたMasteryの変更をキューに反映する
+
+        version は bump_mastery_versions が返した番号。キューがその1つ前の番号でなければ
+        （他のワーカー・リクエストの更新が間にある）キューを破棄して次回読み直す。
+        updates は (問題ID, next_review_at, 科目) の並び。
+        """
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                return
+            if queue.version != version - 1:
+                self._discard(user_id)
+                return
+            before = len(queue)
+            for question_id, next_review_at, subject in updates:
+                queue.push(question_id, _timestamp(next_review_at), subject)
+            queue.version = version
+            self._entries += len(queue) - before
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._discard(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._queues.clear()
+            self._entries = 0
+
+    @property
+    def size(self) -> int:
+        return self._entries
+
+
+due_queues = DueQueueCache()
@@ -0,0 +1,93 @@
+"""データベースエンジンの設定（環境変数で調整）
+
+db.py の同期・非同期エンジンはここでまとめて設定する。
+- 接続プール: DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE
+- ステートメントタイムアウト: DB_STATEMENT_TIMEOUT_MS（PostgreSQLのみ、0で無効）
+- SQLiteの接続時PRAGMA: WAL・synchronous=NORMAL・busy_timeout・mmap_size・cache_size
+  （同時に採点が書き込んでも "database is locked" にならないよう、書き込み待ちを busy_timeout で吸収する）
+"""
+import os
+from typing import Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# 負の値はKiB単位（-65536 = 64MB）
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+
+
+def engine_options(url: str) -> Dict:
+    """create_engine / create_async_engine に渡す引数"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options = {}
+        if url.drivername == "sqlite":
+            options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # インメモリDBは接続ごとに別のDBになるためプール設定は使わない
+            return options
+        if url.drivername.endswith("+aiosqlite"):
+            # aiosqliteの既定はNullPool（毎回接続し直しPRAGMAも毎回実行される）
+            options["poolclass"] = AsyncAdaptedQueuePool
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        return options
+
+    options = {
+        "pool_pre_ping": True,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        if url.drivername.endswith("+asyncpg"):
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def install_sqlite_pragmas(engine: Engine) -> None:
+    """SQLiteの接続ごとにPRAGMAを設定する（非同期エンジンは sync_engine を渡す）"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if engine.url.database not in (None, "", ":memory:"):
+                cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+                cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        finally:
+            cursor.close()
+
+
+def pool_stats(engine: Engine) -> Dict:
+    """接続プールの利用状況（/health 用）"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+            max_overflow=DB_MAX_OVERFLOW,
+            timeout=pool.timeout()
+        )
+    return stats
@@ -0,0 +1,28 @@
+"""構造化ログ（1行1イベントのJSON）
+
+リクエストの処理経路で毎回出していた print() の代わりに使う。
+info は LOG_SAMPLE_RATE の割合だけ出力し（0〜1、既定0.1）、warning / error は常に出力する。
+"""
+import json
+import os
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+
+def log_event(event: str, level: str = "info", sample_rate: Optional[float] = None, **fields) -> None:
+    """イベントを1行のJSONで標準出力に書く"""
+    if level == "info":
+        rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        if rate < 1.0 and random.random() >= rate:
+            return
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "level": level,
+        "event": event,
+        **fields
+    }
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
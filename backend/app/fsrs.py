@@ -0,0 +1,219 @@
+"""FSRS方式の復習スケジューラ
+
+問題ごとに記憶の安定度（stability: 想起率が90%に下がるまでの日数）と難易度（difficulty: 1〜10）を持ち、
+解答の正誤と前回からの経過日数から次の値を求める（FSRS-4.5 の式。正解を Good、不正解を Again とする）。
+次回の復習は想起率が desired_retention まで下がる日に設定する。
+Mastery.value は最後の解答から VALUE_HORIZON_DAYS 日後の想起率とする。
+
+- Scheduler.review: 1回の解答でMasteryを更新する（採点時。標準ライブラリのみ）
+- Scheduler.replay: 解答履歴の配列から、全 (ユーザー, 問題) の状態をNumPyでまとめて再計算する
+  （1回目の解答、2回目の解答…ごとに全系列を一括で更新するため、ループは最大解答回数だけ回る）
+
+重みは FSRS_PARAMS_PATH のJSON（{"w": [...]}）があればそれを読み、なければ FSRS-4.5 の既定値を使う。
+"""
+import json
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from .lazy_imports import LazyModule
+
+# NumPyは一括再計算でのみ使う（採点の経路では読み込まない）
+np = LazyModule("numpy")
+
+FSRS_PARAMS_PATH = os.getenv(
+    "FSRS_PARAMS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fsrs_params.json")
+)
+# 次回の復習時点で期待する想起率
+FSRS_DESIRED_RETENTION = float(os.getenv("FSRS_DESIRED_RETENTION", "0.9"))
+# 復習間隔の上限（日）
+FSRS_MAXIMUM_INTERVAL = int(os.getenv("FSRS_MAXIMUM_INTERVAL", "30"))
+
+# FSRS-4.5 の既定の重み
+DEFAULT_WEIGHTS = (
+    0.4072, 1.1829, 3.1262, 15.4722, 7.2102, 0.5316, 1.0651, 0.0234, 1.616,
+    0.1544, 1.0824, 1.9813, 0.0953, 0.2975, 2.2042, 0.2407, 2.9466,
+)
+AGAIN, HARD, GOOD, EASY = 1, 2, 3, 4
+# 忘却曲線 R(t, S) = (1 + FACTOR * t / S) ** DECAY（R(S, S) = 0.9 となる）
+DECAY = -0.5
+FACTOR = 0.9 ** (1 / DECAY) - 1
+MIN_STABILITY = 0.01
+MIN_DIFFICULTY, MAX_DIFFICULTY = 1.0, 10.0
+# Mastery.value に使う想起率の評価時点（最後の解答からの日数）
+VALUE_HORIZON_DAYS = 7.0
+SECONDS_PER_DAY = 86400.0
+
+
+class FSRSParameters(NamedTuple):
+    w: Tuple[float, ...] = DEFAULT_WEIGHTS
+    desired_retention: float = FSRS_DESIRED_RETENTION
+    maximum_interval: int = FSRS_MAXIMUM_INTERVAL
+
+
+def load_parameters(path: str = FSRS_PARAMS_PATH) -> FSRSParameters:
+    """重みをJSONから読む（ファイルがなければ既定値）"""
+    if not os.path.exists(path):
+        return FSRSParameters()
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    weights = tuple(float(value) for value in data["w"])
+    if len(weights) != len(DEFAULT_WEIGHTS):
+        raise ValueError(f"{path}: expected {len(DEFAULT_WEIGHTS)} weights, got {len(weights)}")
+    return FSRSParameters(w=weights)
+
+
+# --- FSRSの式（floatでもNumPy配列でも計算できるよう exp を引数で受け取る） ---
+
+def retrievability(elapsed_days, stability):
+    """前回の解答から elapsed_days 日後の想起率"""
+    return (1 + FACTOR * elapsed_days / stability) ** DECAY
+
+
+def interval_days(stability, desired_retention: float):
+    """想起率が desired_retention まで下がるまでの日数"""
+    return stability / FACTOR * (desired_retention ** (1 / DECAY) - 1)
+
+
+def init_difficulty(w: Sequence[float], grade, exp=math.exp):
+    return w[4] - exp(w[5] * (grade - 1)) + 1
+
+
+def next_difficulty(w: Sequence[float], difficulty, grade, exp=math.exp):
+    # Easy の初期難易度へ平均回帰させる
+    return w[7] * init_difficulty(w, EASY, exp) + (1 - w[7]) * (difficulty - w[6] * (grade - GOOD))
+
+
+def recall_stability(w: Sequence[float], difficulty, stability, r, exp=math.exp):
+    """正解したときの新しい安定度（Good）"""
+    return stability * (exp(w[8]) * (11 - difficulty) * stability ** -w[9] * (exp(w[10] * (1 - r)) - 1) + 1)
+
+
+def forget_stability(w: Sequence[float], difficulty, stability, r, exp=math.exp):
+    """不正解だったときの新しい安定度（Again。前の安定度を超えない値に丸めるのは呼び出し側）"""
+    return w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1) * exp(w[14] * (1 - r))
+
+
+def elapsed_days(last: datetime, now: datetime) -> float:
+    # DBから読んだ値がタイムゾーン付きでも比較できるようUNIX時刻で差を取る
+    return max(0.0, (now.timestamp() - last.timestamp()) / SECONDS_PER_DAY)
+
+
+class Scheduler:
+    def __init__(self, params: Optional[FSRSParameters] = None):
+        self.params = params or load_parameters()
+
+    def reload(self, path: str = FSRS_PARAMS_PATH) -> FSRSParameters:
+        """重みのファイルを読み直す（最適化の結果を反映する）"""
+        self.params = load_parameters(path)
+        return self.params
+
+    def review_days(self, stability: float) -> int:
+        """次回の復習までの日数（1日〜maximum_interval日）"""
+        days = round(interval_days(stability, self.params.desired_retention))
+        return min(max(days, 1), self.params.maximum_interval)
+
+    def review(self, mastery, is_correct: bool, now: datetime) -> None:
+        """1回の解答でMasteryを更新する
+
+        mastery はORMオブジェクトでも属性を持つ任意のオブジェクトでもよい。
+        last_review_at が空なら最初の解答として初期値から始める。
+        """
+        w = self.params.w
+        grade = GOOD if is_correct else AGAIN
+        if mastery.last_review_at is None:
+            stability = w[grade - 1]
+            difficulty = init_difficulty(w, grade)
+            streak = 1 if is_correct else 0
+        else:
+            stability = max(mastery.stability or MIN_STABILITY, MIN_STABILITY)
+            # difficulty 列の追加前に作られた行は Good の初期難易度から始める
+            difficulty = getattr(mastery, "difficulty", None)
+            if difficulty is None:
+                difficulty = init_difficulty(w, GOOD)
+            r = retrievability(elapsed_days(mastery.last_review_at, now), stability)
+            if is_correct:
+                stability = recall_stability(w, difficulty, stability, r)
+                streak = (mastery.consecutive_correct or 0) + 1
+            else:
+                stability = min(forget_stability(w, difficulty, stability, r), stability)
+                streak = 0
+            difficulty = next_difficulty(w, difficulty, grade)
+
+        mastery.stability = max(stability, MIN_STABILITY)
+        mastery.difficulty = min(max(difficulty, MIN_DIFFICULTY), MAX_DIFFICULTY)
+        mastery.value = retrievability(VALUE_HORIZON_DAYS, mastery.stability)
+        mastery.consecutive_correct = streak
+        mastery.last_review_at = now
+        mastery.next_review_at = now + timedelta(days=self.review_days(mastery.stability))
+
+    def replay(self, group, correct, timestamps) -> Dict:
+        """解答履歴から系列ごとの最終状態をまとめて求める
+
+        group は系列（ユーザー×問題）の番号で、同じ系列の解答が連続し、系列内は解答順に
+        並んでいること。correct は正誤、timestamps は解答時刻（UNIX秒）。
+        戻り値は系列ごとの配列（stability / difficulty / value / consecutive_correct /
+        last_review / next_review（UNIX秒））と、各系列の先頭の添字 first。
+        """
+        w = self.params.w
+        group = np.asarray(group)
+        correct = np.asarray(correct, dtype=bool)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        n = len(group)
+        if n == 0:
+            empty = np.zeros(0)
+            return {"first": np.zeros(0, dtype=np.int64), "stability": empty, "difficulty": empty, "value": empty,
+                    "consecutive_correct": np.zeros(0, dtype=np.int64), "last_review": empty, "next_review": empty}
+
+        first = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        counts = np.diff(np.r_[first, n])
+        series = np.repeat(np.arange(len(first)), counts)
+        position = np.arange(n) - np.repeat(first, counts)
+        # 解答を「系列内で何回目か」の順に並べ、回数ごとの範囲を求める
+        by_position = np.argsort(position, kind="stable")
+        bounds = np.searchsorted(position[by_position], np.arange(counts.max() + 1))
+
+        stability = np.zeros(len(first))
+        difficulty = np.zeros(len(first))
+        streak = np.zeros(len(first), dtype=np.int64)
+        last = np.zeros(len(first))
+        for k in range(counts.max()):
+            index = by_position[bounds[k]:bounds[k + 1]]
+            s = series[index]
+            c = correct[index]
+            t = timestamps[index]
+            grade = np.where(c, GOOD, AGAIN)
+            if k == 0:
+                new_stability = np.where(c, w[GOOD - 1], w[AGAIN - 1])
+                new_difficulty = init_difficulty(w, grade, np.exp)
+                streak[s] = c
+            else:
+                old_stability = stability[s]
+                old_difficulty = difficulty[s]
+                r = retrievability(np.maximum(t - last[s], 0.0) / SECONDS_PER_DAY, old_stability)
+                new_stability = np.where(
+                    c,
+                    recall_stability(w, old_difficulty, old_stability, r, np.exp),
+                    np.minimum(forget_stability(w, old_difficulty, old_stability, r, np.exp), old_stability)
+                )
+                new_difficulty = next_difficulty(w, old_difficulty, grade, np.exp)
+                streak[s] = np.where(c, streak[s] + 1, 0)
+            stability[s] = np.maximum(new_stability, MIN_STABILITY)
+            difficulty[s] = np.clip(new_difficulty, MIN_DIFFICULTY, MAX_DIFFICULTY)
+            last[s] = t
+
+        days = np.clip(np.round(interval_days(stability, self.params.desired_retention)),
+                       1, self.params.maximum_interval)
+        return {
+            "first": first,
+            "stability": stability,
+            "difficulty": difficulty,
+            "value": retrievability(VALUE_HORIZON_DAYS, stability),
+            "consecutive_correct": streak,
+            "last_review": last,
+            "next_review": last + days * SECONDS_PER_DAY,
+        }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,432 @@
+"""FSRSの重みの最適化（オフライン）
+
+Attemptの履歴から忘却曲線の重みを推定し、FSRS_PARAMS_PATH に書き込む
+（採点時のスケジューラは起動時・/admin/fsrs/reload でこのファイルを読む）。
+
+1. attempts を (ユーザー, 問題, 解答時刻) 順にサーバーサイドカーソルで FSRS_FIT_CHUNK 行ずつ読み、
+   系列（ユーザー×問題）ごとの「正誤・前回からの経過日数」の配列に圧縮して、系列の途中で
+   区切らない約 FSRS_FIT_BATCH 解答のミニバッチにして順に渡す。解答履歴全体は保持せず、
+   メモリ使用量は解答数によらず1チャンク＋シャッフル用の FSRS_FIT_SHUFFLE バッチ分で一定
+   （エポックごとに読み直す）。
+2. ミニバッチごとに、Scheduler.replay と同じ式で全系列を一括で再生しながら
+   重みに対する安定度・難易度の微分も前進型で伝播させ（NumPy）、各解答の想起率の予測と
+   実際の正誤の対数損失の勾配を求めて Adam で更新する。
+
+同じ系列で FSRS_FIT_MIN_ELAPSED_HOURS 時間未満の解き直しは状態の更新には使うが損失には含めない。
+最適化後の損失が元の重みより悪ければ書き込まない。
+
+    cd backend
+    python -m app.fsrs_optimizer                  # 最適化して fsrs_params.json に書き込む
+    python -m app.fsrs_optimizer --dry-run        # 損失の比較だけ表示する
+    python -m app.fsrs_optimizer --reschedule     # 書き込んだ重みで全ユーザーのMasteryを再計算する
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .fsrs import (
+    AGAIN, EASY, FACTOR, FSRS_PARAMS_PATH, GOOD, MAX_DIFFICULTY, MIN_DIFFICULTY, MIN_STABILITY,
+    SECONDS_PER_DAY, load_parameters, np,
+)
+from .models import Attempt
+
+# サーバーサイドカーソルから1回に読む行数
+FSRS_FIT_CHUNK = int(os.getenv("FSRS_FIT_CHUNK", "50000"))
+# 1回の勾配計算に使う解答数（系列の途中では区切らない）
+FSRS_FIT_BATCH = int(os.getenv("FSRS_FIT_BATCH", "65536"))
+# ミニバッチの順序を入れ替える範囲（このバッチ数だけ先読みしてその中で並べ替える）
+FSRS_FIT_SHUFFLE = int(os.getenv("FSRS_FIT_SHUFFLE", "16"))
+FSRS_FIT_EPOCHS = int(os.getenv("FSRS_FIT_EPOCHS", "5"))
+FSRS_FIT_LEARNING_RATE = float(os.getenv("FSRS_FIT_LEARNING_RATE", "0.04"))
+# これより短い間隔の解き直しは損失に含めない
+FSRS_FIT_MIN_ELAPSED_HOURS = float(os.getenv("FSRS_FIT_MIN_ELAPSED_HOURS", "1"))
+
+# 重みの範囲（FSRS-4.5 の最適化と同じ）
+WEIGHT_BOUNDS = (
+    (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (1.0, 10.0), (0.1, 5.0), (0.1, 5.0),
+    (0.0, 0.75), (0.0, 4.0), (0.0, 0.8), (0.01, 3.0), (0.1, 5.0), (0.01, 0.2), (0.01, 0.9),
+    (0.01, 2.0), (0.0, 1.0), (1.0, 6.0),
+)
+EPSILON = 1e-6
+
+
+class ReviewLog(NamedTuple):
+    """系列順・解答順に並べた解答履歴"""
+    first: "np.ndarray"     # 系列の最初の解答か
+    correct: "np.ndarray"   # 正誤
+    elapsed: "np.ndarray"   # 同じ系列の前回の解答からの日数（最初の解答は0）
+
+    def __len__(self) -> int:
+        return len(self.first)
+
+    @property
+    def reviews(self) -> int:
+        """損失に含める解答（2回目以降で間隔が十分あるもの）の数"""
+        return int(np.count_nonzero(_scored(self)))
+
+
+def _scored(log: ReviewLog):
+    return ~log.first & (log.elapsed * 24 >= FSRS_FIT_MIN_ELAPSED_HOURS)
+
+
+def iter_attempt_chunks(db: Session, chunk_size: int = FSRS_FIT_CHUNK,
+                        user_ids: Optional[Sequence[int]] = None) -> Iterator[List[Tuple]]:
+    """attempts を (ユーザー, 問題, 解答時刻, id) 順にサーバーサイドカーソルでチャンクごとに返す"""
+    stmt = (
+        select(Attempt.user_id, Attempt.question_id, Attempt.correct, Attempt.created_at)
+        .where(Attempt.correct.isnot(None), Attempt.created_at.isnot(None))
+        .order_by(Attempt.user_id, Attempt.question_id, Attempt.created_at, Attempt.id)
+    )
+    if user_ids is not None:
+        stmt = stmt.where(Attempt.user_id.in_(user_ids))
+    result = db.execute(stmt, execution_options={"stream_results": True, "yield_per": chunk_size})
+    yield from result.partitions()
+
+
+def _compress_chunk(rows: List[Tuple], previous: Optional[Tuple]) -> Tuple[ReviewLog, Tuple]:
+    """1チャンクの行を ReviewLog に圧縮する（previous は直前のチャンクの最後の解答の (ユーザー, 問題, UNIX秒)）"""
+    users, questions, correct, created = zip(*rows)
+    users = np.array(users, dtype=np.int64)
+    questions = np.array(questions, dtype=np.int64)
+    timestamps = np.fromiter((value.timestamp() for value in created), dtype=np.float64, count=len(created))
+
+    prev_users = np.r_[previous[0] if previous else -1, users[:-1]]
+    prev_questions = np.r_[previous[1] if previous else -1, questions[:-1]]
+    prev_timestamps = np.r_[previous[2] if previous else 0.0, timestamps[:-1]]
+    first = (users != prev_users) | (questions != prev_questions)
+    elapsed = np.where(first, 0.0, np.maximum(timestamps - prev_timestamps, 0.0) / SECONDS_PER_DAY)
+    log = ReviewLog(first, np.array(correct, dtype=bool), elapsed.astype(np.float32))
+    return log, (users[-1], questions[-1], timestamps[-1])
+
+
+def _concat(logs: List[ReviewLog]) -> ReviewLog:
+    if len(logs) == 1:
+        return logs[0]
+    return ReviewLog(*(np.concatenate(arrays) for arrays in zip(*logs)))
+
+
+def _slice(log: ReviewLog, start: int, stop: Optional[int] = None) -> ReviewLog:
+    return ReviewLog(log.first[start:stop], log.correct[start:stop], log.elapsed[start:stop])
+
+
+def iter_review_batches(db: Session, chunk_size: int = FSRS_FIT_CHUNK, batch_size: int = FSRS_FIT_BATCH,
+                        user_ids: Optional[Sequence[int]] = None) -> Iterator[ReviewLog]:
+    """解答履歴をチャンクごとに読みながら、系列の途中で区切らない約 batch_size 解答の ReviewLog を順に返す
+
+    保持するのは読み込み中のチャンクと、まだ返していない解答（最後の系列は次のチャンクに続くことがあるため
+    残す）だけ。
+    """
+    pending: List[ReviewLog] = []
+    pending_size = 0
+    previous = None
+    for rows in iter_attempt_chunks(db, chunk_size, user_ids):
+        chunk, previous = _compress_chunk(rows, previous)
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < batch_size:
+            continue
+        log = _concat(pending)
+        bounds = batch_bounds(log, batch_size)
+        for start, stop in bounds[:-1]:
+            yield _slice(log, start, stop)
+        rest = _slice(log, bounds[-1][0])
+        pending, pending_size = [rest], len(rest)
+
+    if pending_size:
+        log = _concat(pending)
+        for start, stop in batch_bounds(log, batch_size):
+            yield _slice(log, start, stop)
+
+
+def batch_bounds(log: ReviewLog, batch_size: int = FSRS_FIT_BATCH) -> List[Tuple[int, int]]:
+    """系列の途中で区切らないように、約 batch_size 解答ずつの範囲に分ける"""
+    starts = np.flatnonzero(log.first)
+    if len(starts) == 0:
+        return []
+    # batch_size の倍数の位置以降で最初の系列の先頭で区切る（以降に系列の先頭がなければ区切らない）
+    index = np.searchsorted(starts, np.arange(0, len(log), batch_size))
+    cuts = np.unique(starts[index[index < len(starts)]])
+    edges = np.r_[cuts, len(log)].tolist()
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def loss_and_gradient(w, log: ReviewLog, start: int = 0, stop: Optional[int] = None) -> Tuple[float, "np.ndarray", int]:
+    """log[start:stop] の対数損失の合計・重みに対する勾配・損失に含めた解答数
+
+    Scheduler.replay と同様に「系列内で何回目か」ごとに全系列をまとめて進め、
+    安定度と難易度の重みに対する微分（系列数×重み数）を一緒に更新する。
+    """
+    w = np.asarray(w, dtype=np.float64)
+    first = log.first[start:stop]
+    correct = log.correct[start:stop]
+    elapsed = log.elapsed[start:stop].astype(np.float64)
+    scored = _scored(ReviewLog(first, correct, log.elapsed[start:stop]))
+    n = len(first)
+    gradient = np.zeros(len(w))
+    if n == 0:
+        return 0.0, gradient, 0
+
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.r_[starts, n])
+    series = np.repeat(np.arange(len(starts)), counts)
+    position = np.arange(n) - np.repeat(starts, counts)
+    by_position = np.argsort(position, kind="stable")
+    bounds = np.searchsorted(position[by_position], np.arange(counts.max() + 1))
+
+    size = len(starts)
+    stability = np.zeros(size)
+    difficulty = np.zeros(size)
+    d_stability = np.zeros((size, len(w)))
+    d_difficulty = np.zeros((size, len(w)))
+    loss = 0.0
+    scored_count = 0
+
+    easy_difficulty = w[4] - np.exp(w[5] * (EASY - 1)) + 1
+    for k in range(counts.max()):
+        index = by_position[bounds[k]:bounds[k + 1]]
+        s = series[index]
+        c = correct[index]
+        grade = np.where(c, GOOD, AGAIN)
+        rows = np.arange(len(index))
+
+        if k == 0:
+            stability[s] = np.where(c, w[GOOD - 1], w[AGAIN - 1])
+            ds = np.zeros((len(index), len(w)))
+            ds[rows, grade - 1] = 1.0
+            d_stability[s] = ds
+
+            exp_term = np.exp(w[5] * (grade - 1))
+            init = w[4] - exp_term + 1
+            dd = np.zeros((len(index), len(w)))
+            dd[:, 4] = 1.0
+            dd[:, 5] = -(grade - 1) * exp_term
+            clipped = (init < MIN_DIFFICULTY) | (init > MAX_DIFFICULTY)
+            dd[clipped] = 0.0
+            difficulty[s] = np.clip(init, MIN_DIFFICULTY, MAX_DIFFICULTY)
+            d_difficulty[s] = dd
+            continue
+
+        S = stability[s]
+        D = difficulty[s]
+        dS = d_stability[s]
+        dD = d_difficulty[s]
+        t = elapsed[index]
+
+        base = 1 + FACTOR * t / S
+        R = base ** -0.5
+        dR_dS = 0.5 * FACTOR * t / S ** 2 * base ** -1.5
+
+        # 予測した想起率と実際の正誤の対数損失
+        use = scored[index]
+        if use.any():
+            y = c[use].astype(np.float64)
+            r = np.clip(R[use], EPSILON, 1 - EPSILON)
+            loss -= float(np.sum(y * np.log(r) + (1 - y) * np.log(1 - r)))
+            dL_dR = (r - y) / (r * (1 - r))
+            gradient += (dL_dR * dR_dS[use]) @ dS[use]
+            scored_count += int(use.sum())
+
+        # 正解（Good）のときの安定度とその微分
+        A = np.exp(w[8])
+        B = 11 - D
+        C = S ** -w[9]
+        recall_exp = np.exp(w[10] * (1 - R))
+        E = recall_exp - 1
+        recall = S + A * B * C * E * S
+        recall_dS = 1 + A * B * E * (1 - w[9]) * C - A * B * C * S * w[10] * recall_exp * dR_dS
+        recall_dD = -A * C * E * S
+        recall_dw = np.zeros((len(index), len(w)))
+        recall_dw[:, 8] = A * B * C * E * S
+        recall_dw[:, 9] = -A * B * C * E * S * np.log(S)
+        recall_dw[:, 10] = A * B * C * S * recall_exp * (1 - R)
+
+        # 不正解（Again）のときの安定度とその微分（前の安定度を超えない）
+        P = D ** -w[12]
+        Q = (S + 1) ** w[13] - 1
+        X = np.exp(w[14] * (1 - R))
+        forget = w[11] * P * Q * X
+        forget_dS = w[11] * P * X * w[13] * (S + 1) ** (w[13] - 1) - forget * w[14] * dR_dS
+        forget_dD = -w[12] * forget / D
+        forget_dw = np.zeros((len(index), len(w)))
+        forget_dw[:, 11] = P * Q * X
+        forget_dw[:, 12] = -forget * np.log(D)
+        forget_dw[:, 13] = w[11] * P * X * (S + 1) ** w[13] * np.log(S + 1)
+        forget_dw[:, 14] = forget * (1 - R)
+        keep = forget >= S
+
+        new_stability = np.where(c, recall, np.where(keep, S, forget))
+        dS_dS = np.where(c, recall_dS, np.where(keep, 1.0, forget_dS))
+        dS_dD = np.where(c, recall_dD, np.where(keep, 0.0, forget_dD))
+        direct = np.where(c[:, None], recall_dw, np.where(keep[:, None], 0.0, forget_dw))
+        new_dS = dS_dS[:, None] * dS + dS_dD[:, None] * dD + direct
+        new_dS[new_stability < MIN_STABILITY] = 0.0
+
+        # 難易度（Easy の初期難易度への平均回帰）とその微分
+        shifted = D - w[6] * (grade - GOOD)
+        new_difficulty = w[7] * easy_difficulty + (1 - w[7]) * shifted
+        new_dD = (1 - w[7]) * dD
+        new_dD[:, 4] += w[7]
+        new_dD[:, 5] -= w[7] * (EASY - 1) * np.exp(w[5] * (EASY - 1))
+        new_dD[:, 6] -= (1 - w[7]) * (grade - GOOD)
+        new_dD[:, 7] += easy_difficulty - shifted
+        new_dD[(new_difficulty < MIN_DIFFICULTY) | (new_difficulty > MAX_DIFFICULTY)] = 0.0
+
+        stability[s] = np.maximum(new_stability, MIN_STABILITY)
+        d_stability[s] = new_dS
+        difficulty[s] = np.clip(new_difficulty, MIN_DIFFICULTY, MAX_DIFFICULTY)
+        d_difficulty[s] = new_dD
+
+    return loss, gradient, scored_count
+
+
+def evaluate(w, batches: Iterable[ReviewLog]) -> float:
+    """ミニバッチ全体の平均対数損失"""
+    total, count = 0.0, 0
+    for log in batches:
+        loss, _, scored = loss_and_gradient(w, log)
+        total += loss
+        count += scored
+    return total / count if count else float("nan")
+
+
+def _shuffled(batches: Iterable[ReviewLog], rng, window: int = FSRS_FIT_SHUFFLE) -> Iterator[ReviewLog]:
+    """先読みした window バッチの中から順に1つずつ無作為に選んで返す"""
+    buffer: List[ReviewLog] = []
+    for log in batches:
+        buffer.append(log)
+        if len(buffer) >= window:
+            index = int(rng.integers(len(buffer)))
+            buffer[index], buffer[-1] = buffer[-1], buffer[index]
+            yield buffer.pop()
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def fit(open_batches: Callable[[], Iterable[ReviewLog]], initial: Sequence[float], epochs: int = FSRS_FIT_EPOCHS,
+        learning_rate: float = FSRS_FIT_LEARNING_RATE, seed: int = 0,
+        shuffle: int = FSRS_FIT_SHUFFLE) -> Tuple[List[float], List[float]]:
+    """ミニバッチの勾配降下（Adam）で重みを求め、(重み, エポックごとの平均損失) を返す
+
+    open_batches はエポックごとに呼び、ミニバッチを最初から順に返すイテレータを受け取る。
+    """
+    w = np.array(initial, dtype=np.float64)
+    lower, upper = np.array(WEIGHT_BOUNDS).T
+    m = np.zeros_like(w)
+    v = np.zeros_like(w)
+    beta1, beta2 = 0.9, 0.999
+    step = 0
+    rng = np.random.default_rng(seed)
+    history = []
+    for _ in range(epochs):
+        total, count = 0.0, 0
+        for log in _shuffled(open_batches(), rng, shuffle):
+            loss, gradient, scored = loss_and_gradient(w, log)
+            if not scored:
+                continue
+            total += loss
+            count += scored
+            gradient /= scored
+            step += 1
+            m = beta1 * m + (1 - beta1) * gradient
+            v = beta2 * v + (1 - beta2) * gradient ** 2
+            w -= learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + 1e-8)
+            w = np.clip(w, lower, upper)
+        history.append(total / count if count else float("nan"))
+    return w.tolist(), history
+
+
+def write_parameters(weights: Sequence[float], metadata: Dict, path: str = FSRS_PARAMS_PATH) -> None:
+    """重みをJSONに書き込む（一時ファイルから置き換えるので読み込み途中の壊れたファイルは見えない）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8") as f:
+        json.dump({"w": [round(value, 6) for value in weights], **metadata}, f, ensure_ascii=False, indent=2)
+        temp_path = f.name
+    os.replace(temp_path, path)
+
+
+def optimize(db: Session, epochs: int = FSRS_FIT_EPOCHS, learning_rate: float = FSRS_FIT_LEARNING_RATE,
+             chunk_size: int = FSRS_FIT_CHUNK, batch_size: int = FSRS_FIT_BATCH,
+             path: Optional[str] = FSRS_PARAMS_PATH) -> Dict:
+    """解答履歴から重みを求め、元の重みより損失が小さければ path に書き込む（None なら書き込まない）"""
+    initial = list(load_parameters(path or FSRS_PARAMS_PATH).w)
+
+    def open_batches() -> Iterator[ReviewLog]:
+        return iter_review_batches(db, chunk_size, batch_size)
+
+    totals = {"attempts": 0, "reviews": 0}
+
+    def counted(batches: Iterable[ReviewLog]) -> Iterator[ReviewLog]:
+        for log in batches:
+            totals["attempts"] += len(log)
+            totals["reviews"] += log.reviews
+            yield log
+
+    # 解答履歴は保持せず、損失の評価・エポックのたびにカーソルから読み直す
+    started = time.perf_counter()
+    initial_loss = evaluate(initial, counted(open_batches()))
+    weights, history = fit(open_batches, initial, epochs, learning_rate)
+    fitted_loss = evaluate(weights, open_batches())
+    fit_seconds = time.perf_counter() - started
+
+    result = {
+        **totals,
+        "initial_log_loss": initial_loss,
+        "fitted_log_loss": fitted_loss,
+        "epoch_log_loss": history,
+        "passes": epochs + 2,
+        "fit_seconds": round(fit_seconds, 3),
+        "weights": weights,
+        "written": False,
+    }
+    if path and totals["reviews"] and fitted_loss < initial_loss:
+        write_parameters(weights, {
+            "fitted_at": datetime.now().isoformat(timespec="seconds"),
+            **totals,
+            "log_loss": round(fitted_loss, 6),
+        }, path)
+        result["written"] = True
+    return result
+
+
+def main() -> None:
+    from .db import session_scope
+    from .fsrs import scheduler
+    from .reschedule import recompute_mastery
+
+    parser = argparse.ArgumentParser(description="解答履歴からFSRSの重みを最適化する")
+    parser.add_argument("--epochs", type=int, default=FSRS_FIT_EPOCHS)
+    parser.add_argument("--learning-rate", type=float, default=FSRS_FIT_LEARNING_RATE)
+    parser.add_argument("--chunk-size", type=int, default=FSRS_FIT_CHUNK, help="カーソルから1回に読む行数")
+    parser.add_argument("--batch-size", type=int, default=FSRS_FIT_BATCH, help="1回の勾配計算に使う解答数")
+    parser.add_argument("--output", default=FSRS_PARAMS_PATH, help="重みの書き込み先")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに損失だけ表示する")
+    parser.add_argument("--reschedule", action="store_true", help="書き込んだ重みで全ユーザーのMasteryを再計算する")
+    args = parser.parse_args()
+
+    with session_scope() as db:
+        result = optimize(db, args.epochs, args.learning_rate, args.chunk_size, args.batch_size,
+                          None if args.dry_run else args.output)
+        print(f"{result['attempts']} attempts / {result['reviews']} reviews "
+              f"({result['passes']} passes, {result['fit_seconds']}s)")
+        print(f"log loss: {result['initial_log_loss']:.4f} → {result['fitted_log_loss']:.4f}")
+        print("w = [" + ", ".join(f"{value:.4f}" for value in result["weights"]) + "]")
+        if result["written"]:
+            print(f"✅ Wrote {args.output}")
+        elif not args.dry_run:
+            print("⚠️ 損失が改善しなかったため重みは書き込んでいません")
+
+        if args.reschedule and result["written"]:
+            scheduler.reload(args.output)
+            rescheduled = recompute_mastery(db)
+            print(f"✅ Rescheduled {rescheduled['mastery_rows']} mastery rows ({rescheduled['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
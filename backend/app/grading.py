@@ -0,0 +1,189 @@
+"""解答の採点とMastery更新
+
+単問の /questions/{id}/answer と一括の /answers/batch で同じ採点・更新ロジックを使う。
+単元別の集計（user_topic_stats）も同じトランザクションで差分を加算する。
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from .models import Attempt, Mastery
+from .answer_keys import answer_keys
+from .due_queue import bump_mastery_version, due_queues
+from .fsrs import scheduler
+from .topic_stats import TopicStatsDelta, apply_topic_stats
+
+
+def new_mastery_state(question_id: int, user_id: int, now: datetime) -> Dict:
+    return {
+        "user_id": user_id,
+        "question_id": question_id,
+        "value": 0.5,
+        "consecutive_correct": 0,
+        "stability": 1.0,
+        "difficulty": None,
+        "last_review_at": None,
+        "next_review_at": now,
+    }
+
+
+def update_mastery(mastery, is_correct: bool, now: datetime) -> None:
+    """Masteryを更新（FSRSスケジューラの1問ずつの経路）
+
+    mastery はORMオブジェクトでも属性を持つ任意のオブジェクトでもよい。
+    """
+    scheduler.review(mastery, is_correct, now)
+
+
+class _MasteryState:
+    """一括採点中のMastery行（辞書を属性アクセスで扱う）"""
+
+    def __init__(self, row: Dict):
+        self.__dict__.update(row)
+
+    def as_row(self) -> Dict:
+        return dict(self.__dict__)
+
+
+def upsert_mastery_rows(db: Session, rows: List[Dict]) -> None:
+    """Mastery行をまとめてupsert（PostgreSQL/SQLiteはON CONFLICT、それ以外はmerge）"""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        for row in rows:
+            db.merge(Mastery(**row))
+        return
+
+    # 行の値はexecutemanyで渡す（文は1回だけコンパイルされ、行数によらずキャッシュされる）
+    stmt = dialect_insert(Mastery.__table__)
+    update_columns = ["value", "consecutive_correct", "stability", "difficulty", "last_review_at", "next_review_at"]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Mastery.user_id, Mastery.question_id],
+        set_={name: stmt.excluded[name] for name in update_columns}
+    )
+    db.execute(stmt, rows)
+
+
+def _timestamp(value: datetime) -> float:
+    # タイムゾーン付き・なしの解答時刻を並べ替えられるようUNIX時刻にする
+    return value.timestamp()
+
+
+def replay_history(db: Session, user_id: int, question_id: int, new_attempts: List[Dict], now: datetime) -> _MasteryState:
+    """保存済みの解答履歴と新しい解答を時刻順に並べ、初期状態から再生したMasteryを返す
+
+    reschedule.recompute_mastery と同じく (解答時刻, id) の順に再生する。新しい解答は
+    保存済みの解答より後に INSERT されるため、同じ時刻なら保存済みの解答を先にする。
+    """
+    stored = db.execute(
+        select(Attempt.id, Attempt.correct, Attempt.created_at)
+        .where(Attempt.user_id == user_id, Attempt.question_id == question_id,
+               Attempt.correct.isnot(None), Attempt.created_at.isnot(None))
+    ).all()
+    history = [(_timestamp(created_at), 0, attempt_id, correct, created_at) for attempt_id, correct, created_at in stored]
+    history.extend(
+        (_timestamp(attempt["created_at"]), 1, order, attempt["correct"], attempt["created_at"])
+        for order, attempt in enumerate(new_attempts)
+    )
+    state = _MasteryState(new_mastery_state(question_id, user_id, now))
+    for _, _, _, correct, answered_at in sorted(history, key=lambda entry: entry[:3]):
+        update_mastery(state, correct, answered_at)
+    return state
+
+
+def grade_batch(db: Session, user_id: int, items: List) -> List[Dict]:
+    """複数の解答を1トランザクションで採点する
+
+    解答キーはキャッシュから引き（未キャッシュ分のみIN句で取得）、MasteryはIN句で1回取得し、
+    Attemptは一括INSERT、Masteryは一括upsertする。
+    items は question_id / user_answer / time_sec / mistake_type / answered_at を持つこと。
+
+    オフライン端末の解答は順不同で届くため、Masteryは解答時刻の順（同時刻なら送信順）に更新する。
+    保存済みの最終解答より前の解答を含む問題は、その問題の解答履歴を初期状態から再生し直す。
+    どちらも履歴からの再計算（reschedule.recompute_mastery）と同じ結果になる。
+    """
+    now = datetime.now()
+    question_ids = {item.question_id for item in items}
+
+    answers = answer_keys.get_many(db, question_ids)
+    states = {
+        row.question_id: _MasteryState(dict(row._mapping))
+        for row in db.execute(
+            select(
+                Mastery.user_id, Mastery.question_id, Mastery.value, Mastery.consecutive_correct,
+                Mastery.stability, Mastery.difficulty, Mastery.last_review_at, Mastery.next_review_at
+            ).where(Mastery.user_id == user_id, Mastery.question_id.in_(answers.keys()))
+        )
+    }
+    # 集計の差分用に、更新前の Mastery.value を控えておく
+    previous_values = {question_id: state.value for question_id, state in states.items()}
+    delta = TopicStatsDelta()
+
+    # 結果は送信順に返し、Attempt・Masteryは解答時刻の順に処理する
+    results = []
+    graded = []
+    for item in items:
+        answer_key = answers.get(item.question_id)
+        if answer_key is None:
+            results.append({"question_id": item.question_id, "error": "Question not found"})
+            continue
+        if answer_key.error is not None:
+            results.append({"question_id": item.question_id, "error": "Invalid answer key"})
+            continue
+
+        is_correct = answer_key.check(item.user_answer)
+        graded.append({
+            "user_id": user_id,
+            "question_id": item.question_id,
+            "correct": is_correct,
+            "seconds": item.time_sec,
+            "cause": item.mistake_type,
+            "created_at": item.answered_at or now,
+        })
+        delta.add_attempt(answer_key.subject, answer_key.topic, is_correct, item.time_sec)
+        results.append({
+            "question_id": item.question_id,
+            "is_correct": is_correct,
+            "correct_answer": answer_key.primary,
+        })
+
+    if not graded:
+        db.commit()
+        return results
+
+    attempts = sorted(graded, key=lambda attempt: _timestamp(attempt["created_at"]))
+    by_question: Dict[int, List[Dict]] = {}
+    for attempt in attempts:
+        by_question.setdefault(attempt["question_id"], []).append(attempt)
+
+    for question_id, question_attempts in by_question.items():
+        state = states.get(question_id)
+        last_review_at = state.last_review_at if state is not None else None
+        if last_review_at is not None and _timestamp(question_attempts[0]["created_at"]) < _timestamp(last_review_at):
+            states[question_id] = replay_history(db, user_id, question_id, question_attempts, now)
+            continue
+        if state is None:
+            state = states[question_id] = _MasteryState(new_mastery_state(question_id, user_id, now))
+        for attempt in question_attempts:
+            update_mastery(state, attempt["correct"], attempt["created_at"])
+
+    rows = [states[qid].as_row() for qid in by_question]
+    for row in rows:
+        answer_key = answers[row["question_id"]]
+        delta.add_mastery(answer_key.subject, answer_key.topic, previous_values.get(row["question_id"]), row["value"])
+    db.execute(insert(Attempt), attempts)
+    upsert_mastery_rows(db, rows)
+    apply_topic_stats(db, user_id, delta, now)
+    version = bump_mastery_version(db, user_id)
+    db.commit()
+    due_queues.write_through(user_id, version, [
+        (row["question_id"], row["next_review_at"], answers[row["question_id"]].subject) for row in rows
+    ])
+    return results
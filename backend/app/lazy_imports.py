@@ -0,0 +1,61 @@
+"""重い依存ライブラリの遅延インポート
+
+PIL・PyPDF2・pdfplumber・pytesseract・openai は読み込みに時間がかかるが、
+出題・解答だけを処理するワーカーでは使わない。LazyModule は属性に初めて
+アクセスしたときにモジュールを読み込み、その所要時間を import_seconds に記録する。
+インストールされているかどうかは is_available（find_spec）で確認し、読み込みはしない。
+"""
+import importlib
+import importlib.util
+import sys
+import time
+from threading import Lock
+from typing import Dict, List
+
+# 分析でのみ使う重いライブラリ（起動時に読み込まれていないことを確認する）
+HEAVY_MODULES = ("PIL", "PyPDF2", "pdfplumber", "pytesseract", "pdf2image", "openai")
+
+# 遅延インポートしたモジュール名と読み込みにかかった秒数
+import_seconds: Dict[str, float] = {}
+_import_lock = Lock()
+
+
+def is_available(name: str) -> bool:
+    """モジュールがインストールされているか（読み込まずに確認）"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def loaded_heavy_modules() -> List[str]:
+    """すでに読み込まれている重いライブラリ"""
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+class LazyModule:
+    """属性に初めてアクセスしたときに読み込まれるモジュール"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self):
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    import_seconds[self._name] = time.perf_counter() - started
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<LazyModule {self._name} ({'loaded' if self.loaded else 'not loaded'})>"
@@ -1,20 +1,45 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
+import time
+# 起動時のレポート用（このモジュールと依存モジュールの読み込み時間）
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 import os
 import tempfile
 import shutil
-from .db import SessionLocal, engine, Base
+from .db import engine, async_engine, get_db, get_async_db, session_scope
+from .engine_config import pool_stats
+from .query_stats import QueryStatsMiddleware
+from .metrics import metrics, MetricsMiddleware
+from .event_log import log_event
+from .lazy_imports import import_seconds, loaded_heavy_modules
 from .models import Question, Attempt, Mastery, MathTopic, ScienceTopic, SocialTopic, MathDependency, ScienceDependency, SocialDependency, TestResult, TestResultDetail, DomainMaster
-from .seed import seed_basic, seed_math_topics, seed_science_topics, seed_social_topics, seed_math_dependencies, seed_science_dependencies, seed_social_dependencies, seed_domain_master
-from .test_analyzer import TestResultAnalyzer
+from .seed import seed_all
+from .scheduler import sample_question, select_next_question
+from .due_queue import bump_mastery_version, due_queues
+from .weakness import weakness_engine
+from .topic_stats import TopicStatsDelta, apply_topic_stats, topic_stats
+from .migrations import LATEST_VERSION, SchemaOutdatedError, applied_versions, check_schema, pending_migrations
+from .grading import update_mastery, grade_batch
+from .reschedule import recompute_mastery
+from .fsrs import scheduler as fsrs_scheduler
+from .answer_keys import answer_keys
+from .dependency_graph import dependency_graphs
+from .topic_edges import add_prerequisite, prerequisite_closure, remove_prerequisite, set_prerequisites
+from .analysis_jobs import analysis_jobs, apply_analysis, fail_stale_jobs, is_stale, QueueFullError, ANALYSIS_PRELOAD
+from .analysis_cache import analysis_cache, save_upload
+from .result_listing import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, list_test_results, parse_cursor, serialize_detail
 import json
 import random
 from datetime import datetime, timedelta
 
 app = FastAPI(title="ZeroBasics API")
+app_import_seconds = time.perf_counter() - _import_started
 
 @app.get("/")
 def root():
@@ -64,59 +89,67 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
-
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# リクエストごとのクエリ数・DB時間を Server-Timing ヘッダーで返す
+app.add_middleware(QueryStatsMiddleware)
+# ルート別のレイテンシ・処理中リクエスト数を /metrics に記録
+app.add_middleware(MetricsMiddleware)
 
 @app.on_event("startup")
 async def startup_event():
+    startup_started = time.perf_counter()
     print("🚀 Starting ZeroBasics API...")
     print(f"Environment: {os.getenv('ENVIRONMENT', 'development')}")
     print(f"Database URL: {os.getenv('DATABASE_URL', 'Not set')[:20]}...")
     
-    # Create all tables first (including test result tables)
+    # スキーマはバージョンを1回確認するだけ（未適用があればロックを取って適用する）
     try:
-        print("📊 Creating database tables...")
-        Base.metadata.create_all(bind=engine)
-        print("✅ Tables created successfully")
-        
-        # Verify test result tables specifically
-        from sqlalchemy import text
-        db = SessionLocal()
-        try:
-            db.execute(text("SELECT 1 FROM test_results LIMIT 1"))
-            print("✅ test_results table exists")
-        except Exception:
-            print("⚠️  test_results table not found, will be created")
-        
-        try:
-            db.execute(text("SELECT 1 FROM test_result_details LIMIT 1"))
-            print("✅ test_result_details table exists")
-        except Exception:
-            print("⚠️  test_result_details table not found, will be created")
-        
-        db.close()
-        
+        version = check_schema(engine)
+        print(f"✅ Database schema version {version}")
+    except Exception as e:
+        print(f"❌ Schema check failed: {e}")
+        print("⚠️  Continuing startup despite schema check error")
+    
+    # 再起動・デプロイで中断した分析ジョブ（pending / processing のまま残った行）を failed にする
+    try:
+        with session_scope() as db:
+            fail_stale_jobs(db)
     except Exception as e:
-        print(f"❌ Error creating tables: {e}")
-        print("⚠️  Continuing startup despite table creation error")
+        log_event("analysis_jobs_recovery_failed", level="warning", error=str(e))
     
     # Skip seeding during startup for faster deployment
     # Seeding can be done manually via /init-db-simple endpoint
     print("✅ Startup completed - seeding can be done manually")
     print("🌐 API is ready to serve requests")
+    
+    # 起動コストのレポート（OCR・PDF・LLMのライブラリは最初のアップロードまで読み込まない）
+    heavy_modules = loaded_heavy_modules()
+    log_event("startup_completed", level="warning" if heavy_modules else "info", sample_rate=1.0,
+              import_sec=round(app_import_seconds, 3),
+              startup_sec=round(time.perf_counter() - startup_started, 3),
+              heavy_modules_loaded=heavy_modules)
+    if ANALYSIS_PRELOAD:
+        analysis_jobs.preload()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    analysis_jobs.shutdown()
+    await async_engine.dispose()
 
 class AnswerIn(BaseModel):
     user_answer: str
     time_sec: Optional[int] = None
     mistake_type: Optional[str] = None # calc_mistake | concept_gap | memory_lapse
 
+class BatchAnswerItem(AnswerIn):
+    question_id: int
+    answered_at: Optional[datetime] = None # オフライン端末で解答した時刻
+
+class BatchAnswerReq(BaseModel):
+    user_id: int = 1 # Dummy user_id for now
+    answers: List[BatchAnswerItem]
+
 class NextQuestionReq(BaseModel):
     user_id: int = 1 # Dummy user_id for now
     subject: Optional[str] = None
@@ -167,17 +200,51 @@ def update_topic_domain(subject: str, topic_id: int, domain_update: DomainUpdate
             raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
         
         db.commit()
+        dependency_graphs.invalidate(subject)
         return {"message": "Domain updated successfully", "topic_id": topic_id, "domain": domain_update.domain}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+@metrics.collector
+def _collect_runtime_metrics():
+    """DB接続プール・分析ジョブキュー・キャッシュの状態"""
+    pools = {"sync": pool_stats(engine), "async": pool_stats(async_engine.sync_engine)}
+    for name, key, documentation in (
+        ("db_pool_size", "size", "Configured connection pool size"),
+        ("db_pool_checked_out", "checked_out", "Connections currently checked out"),
+        ("db_pool_overflow", "overflow", "Connections opened beyond pool_size")
+    ):
+        yield name, "gauge", documentation, [({"engine": engine_name}, stats[key]) for engine_name, stats in pools.items() if key in stats]
+
+    yield "analysis_queue_depth", "gauge", "Analysis jobs running or waiting", [({}, analysis_jobs.depth)]
+    yield "analysis_queue_limit", "gauge", "Maximum analysis jobs accepted", [({}, analysis_jobs.limit)]
+
+    yield "app_import_seconds", "gauge", "Seconds spent importing the application at startup", [({}, app_import_seconds)]
+    yield "lazy_import_seconds", "gauge", "Seconds spent importing each lazily loaded dependency", [
+        ({"module": name}, seconds) for name, seconds in import_seconds.items()
+    ]
+
+    caches = {"answer_keys": answer_keys, "analysis": analysis_cache, "dependency_graph": dependency_graphs, "due_queue": due_queues, "weakness": weakness_engine}
+    yield "cache_hits_total", "counter", "Cache hits", [({"cache": name}, cache.hits) for name, cache in caches.items()]
+    yield "cache_misses_total", "counter", "Cache misses", [({"cache": name}, cache.misses) for name, cache in caches.items()]
+    yield "due_queue_entries", "gauge", "Mastery rows held in the in-process due queues", [({}, due_queues.size)]
+    yield "due_queue_stale_total", "counter", "Due queues reloaded because another writer bumped the mastery version", [({}, due_queues.stale)]
+    yield "cache_hit_ratio", "gauge", "Cache hit ratio since process start", [
+        ({"cache": name}, cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0)
+        for name, cache in caches.items()
+    ]
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheusのテキスト形式でメトリクスを返す"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
-def health():
+def health(db: Session = Depends(get_db)):
     """ヘルスチェックエンドポイント - データベース接続も確認"""
     try:
         # 基本的な接続確認
-        db = SessionLocal()
         try:
             # データベース接続をテスト
             from sqlalchemy import text
@@ -186,13 +253,15 @@ def health():
             db_status = "connected"
         except Exception as e:
             db_status = f"error: {str(e)}"
-        finally:
-            db.close()
         
         return {
             "ok": True,
             "timestamp": datetime.now().isoformat(),
-            "database": db_status
+            "database": db_status,
+            "pools": {
+                "sync": pool_stats(engine),
+                "async": pool_stats(async_engine.sync_engine)
+            }
         }
     except Exception as e:
         return {
@@ -202,35 +271,17 @@ def health():
         }
 
 @app.post("/init-db")
-def init_database(db: Session = Depends(get_db)):
-    """手動でデータベースを初期化するエンドポイント"""
-    try:
-        print("Starting manual database initialization...")
-        
-        # Import the migration script
-        import subprocess
-        import sys
-        
-        # Run the migration script
-        result = subprocess.run([
-            sys.executable, "migrate.py"
-        ], capture_output=True, text=True, cwd="backend")
-        
-        if result.returncode == 0:
-            return {
-                "message": "Database initialized successfully",
-                "output": result.stdout
-            }
-        else:
-            return {
-                "error": "Database initialization failed",
-                "output": result.stdout,
-                "error_output": result.stderr
-            }
-            
-    except Exception as e:
-        print(f"General initialization error: {e}")
-        return {"error": f"Database initialization failed: {str(e)}"}
+def init_database():
+    """廃止: スキーマの変更はリクエスト内では行わない
+
+    マイグレーションとシードはデプロイ手順で `cd backend && python migrate.py` を実行する
+    （シードのみなら /init-db-simple）。
+    """
+    raise HTTPException(
+        status_code=410,
+        detail="/init-db is no longer supported. Run `cd backend && python migrate.py` to apply migrations "
+               "and seed data, or POST /init-db-simple to seed an up-to-date schema."
+    )
 
 @app.post("/init-db-simple")
 def init_database_simple(db: Session = Depends(get_db)):
@@ -238,59 +289,16 @@ def init_database_simple(db: Session = Depends(get_db)):
     try:
         print("Starting simple database initialization...")
         
-        # Create tables with retry logic
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                print(f"Creating tables (attempt {attempt + 1}/{max_retries})...")
-                Base.metadata.create_all(bind=engine)
-                print("Tables created successfully")
-                break
-            except Exception as e:
-                print(f"Attempt {attempt + 1} failed: {e}")
-                if attempt == max_retries - 1:
-                    return {"error": f"Failed to create tables after {max_retries} attempts: {str(e)}"}
-                import time
-                time.sleep(2)  # Wait before retry
-        
-        # Wait a moment for tables to be created (PostgreSQL needs more time)
-        import time
-        time.sleep(5)
-        
-        # Verify tables exist before seeding (with retry)
-        max_verify_retries = 3
-        for verify_attempt in range(max_verify_retries):
-            try:
-                from sqlalchemy import text
-                db.execute(text("SELECT 1 FROM questions LIMIT 1"))
-                db.commit()
-                print("Questions table verified")
-                break
-            except Exception as e:
-                print(f"Questions table verification attempt {verify_attempt + 1} failed: {e}")
-                if verify_attempt == max_verify_retries - 1:
-                    return {"error": f"Questions table not accessible after {max_verify_retries} attempts: {str(e)}"}
-                time.sleep(3)  # Wait before retry
-                db.rollback()
+        # スキーマの変更はリクエスト内では行わない（起動時または python -m app.migrations で適用済みであること）
+        try:
+            check_schema(engine, apply=False)
+        except SchemaOutdatedError as e:
+            return {"error": str(e)}
         
-        # Seed the database
+        # 各seed関数は既存行を無視するので、何度呼んでもよい
         try:
-            seed_basic(db)
-            print("Basic seeding completed")
-            seed_domain_master(db)
-            print("Domain master seeded")
-            seed_math_topics(db)
-            print("Math topics seeded")
-            seed_science_topics(db)
-            print("Science topics seeded")
-            seed_social_topics(db)
-            print("Social topics seeded")
-            seed_math_dependencies(db)
-            print("Math dependencies seeded")
-            seed_science_dependencies(db)
-            print("Science dependencies seeded")
-            seed_social_dependencies(db)
-            print("Social dependencies seeded")
+            seed_all(db)
+            print("Seeding completed")
             
             return {"message": "Database initialized successfully"}
         except Exception as e:
@@ -399,87 +407,6 @@ def check_tables(db: Session = Depends(get_db)):
     
     return {"tables": tables}
 
-@app.post("/create-tables-only")
-def create_tables_only():
-    """テーブルのみを作成するエンドポイント"""
-    try:
-        print("Creating tables only...")
-        Base.metadata.create_all(bind=engine)
-        
-        # Wait and verify
-        import time
-        time.sleep(3)
-        
-        # Check if tables were created
-        from sqlalchemy import text
-        db = SessionLocal()
-        try:
-            db.execute(text("SELECT 1 FROM questions LIMIT 1"))
-            db.commit()
-            db.close()
-            return {"message": "Tables created and verified successfully"}
-        except Exception as e:
-            db.close()
-            return {"error": f"Tables created but verification failed: {str(e)}"}
-            
-    except Exception as e:
-        return {"error": f"Failed to create tables: {str(e)}"}
-
-@app.post("/recreate-tables")
-def recreate_tables():
-    """テーブルを削除して再作成するエンドポイント"""
-    try:
-        print("Recreating tables...")
-        from sqlalchemy import text
-        
-        # Drop existing tables
-        db = SessionLocal()
-        try:
-            # Drop tables in reverse order of dependencies
-            tables_to_drop = [
-                'test_result_details',
-                'test_results', 
-                'mastery',
-                'attempts',
-                'questions',
-                'users'
-            ]
-            
-            for table in tables_to_drop:
-                try:
-                    db.execute(text(f"DROP TABLE IF EXISTS {table} CASCADE"))
-                    print(f"Dropped table: {table}")
-                except Exception as e:
-                    print(f"Error dropping {table}: {e}")
-            
-            db.commit()
-            db.close()
-            
-        except Exception as e:
-            db.close()
-            return {"error": f"Failed to drop tables: {str(e)}"}
-        
-        # Create tables with new schema
-        Base.metadata.create_all(bind=engine)
-        
-        # Wait and verify
-        import time
-        time.sleep(3)
-        
-        # Verify tables were created
-        db = SessionLocal()
-        try:
-            db.execute(text("SELECT 1 FROM test_results LIMIT 1"))
-            db.commit()
-            db.close()
-            return {"message": "Tables recreated successfully"}
-        except Exception as e:
-            db.close()
-            return {"error": f"Tables recreated but verification failed: {str(e)}"}
-            
-    except Exception as e:
-        return {"error": f"Failed to recreate tables: {str(e)}"}
-
 @app.get("/test-connection")
 def test_connection():
     """基本的な接続テスト"""
@@ -514,242 +441,160 @@ def test_connection():
 
 
 
-@app.post("/upload-test-result")
-async def upload_test_result(
+@app.post("/upload-test-result", status_code=202)
+def upload_test_result(
+    response: Response,
     file: UploadFile = File(...),
     user_id: int = Form(1),
     subject: Optional[str] = Form(None),
     test_name: Optional[str] = Form(None),
     db: Session = Depends(get_db)
 ):
-    """テスト結果ファイルをアップロードしてAI分析を実行（簡易版）"""
+    """テスト結果ファイルをアップロードしてAI分析ジョブを登録（分析はバックグラウンドで実行）
+
+    同じ内容のファイルが分析済みの場合はジョブを登録せず、保存済みの分析結果で即座に完了する。
+    """
+    # ファイル形式の確認
+    allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.bmp', '.tiff']
+    file_ext = os.path.splitext(file.filename)[1].lower()
+    
+    if file_ext not in allowed_extensions:
+        raise HTTPException(status_code=400, detail="サポートされていないファイル形式です")
+    
+    # ファイルサイズの確認（10MB制限）
+    if file.size and file.size > 10 * 1024 * 1024:
+        raise HTTPException(status_code=400, detail="ファイルサイズが大きすぎます（10MB以下にしてください）")
+    
+    temp_file_path = None
+    reserved = False
     try:
-        # ファイル形式の確認
-        allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.bmp', '.tiff']
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail="サポートされていないファイル形式です")
+        # 一時ファイルに保存しながらハッシュを計算（削除は分析ジョブ側で行う）
+        temp_file_path, content_hash, source_bytes = save_upload(file.file, file_ext)
         
-        # ファイルサイズの確認（10MB制限）
-        if file.size and file.size > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="ファイルサイズが大きすぎます（10MB以下にしてください）")
+        test_result = TestResult(
+            user_id=user_id,
+            subject=subject or ("PDF分析結果" if file_ext == '.pdf' else "不明"),
+            test_name=test_name or ("PDFテスト結果" if file_ext == '.pdf' else "テスト結果"),
+            total_score=0,
+            max_score=100,
+            score_percentage=0.0,
+            file_path=file.filename,
+            analysis_status="pending",
+            analysis_updated_at=datetime.now()
+        )
         
-        # 一時ファイルに保存
-        temp_file_path = None
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-                # ファイルストリームを最初から読み取り
-                file.file.seek(0)
-                shutil.copyfileobj(file.file, temp_file)
-                temp_file_path = temp_file.name
-            
-            print(f"アップロードされたファイル: {file.filename}")
-            print(f"ファイルサイズ: {file.size} bytes")
-            print(f"ファイルタイプ: {file.content_type}")
-            print(f"一時ファイルパス: {temp_file_path}")
-            print(f"一時ファイルサイズ: {os.path.getsize(temp_file_path)} bytes")
-            
-            # テスト結果分析器を初期化
-            analyzer = TestResultAnalyzer()
-            
-            # PDFファイルの場合は直接AIに送信
-            if file_ext == '.pdf':
-                try:
-                    print(f"PDFファイル分析開始: {file.filename}")
-                    print(f"処理対象ファイルパス: {temp_file_path}")
-                    print(f"処理対象ファイルサイズ: {os.path.getsize(temp_file_path)} bytes")
-                    
-                    # ファイルの内容を確認（最初の数バイト）
-                    with open(temp_file_path, 'rb') as f:
-                        first_bytes = f.read(100)
-                        print(f"ファイルの最初の100バイト: {first_bytes[:50]}...")
-                        
-                        # PDFファイルの場合はヘッダーを確認
-                        if file_ext == '.pdf':
-                            f.seek(0)
-                            header = f.read(10)
-                            print(f"PDFヘッダー: {header}")
-                            if header.startswith(b'%PDF'):
-                                print("有効なPDFファイルです")
-                            else:
-                                print("警告: PDFヘッダーが見つかりません")
-                    
-                    # ファイルの内容を再度確認
-                    print(f"分析前のファイル確認:")
-                    print(f"  ファイルパス: {temp_file_path}")
-                    print(f"  ファイル存在: {os.path.exists(temp_file_path)}")
-                    print(f"  ファイルサイズ: {os.path.getsize(temp_file_path)} bytes")
-                    
-                    # ファイルの内容をサンプル表示
-                    with open(temp_file_path, 'rb') as f:
-                        sample_content = f.read(200)
-                        print(f"  ファイル内容サンプル: {sample_content[:100]}...")
-                    
-                    analysis_result = analyzer.analyze_pdf_directly_with_ai(temp_file_path, user_id)
-                    
-                    print(f"PDF分析完了: {analysis_result.get('analysis_method', 'unknown')}")
-                    print(f"分析結果のソースファイル: {analysis_result.get('source_file', 'unknown')}")
-                    
-                except Exception as analysis_error:
-                    print(f"PDF分析エラー詳細: {analysis_error}")
-                    raise HTTPException(status_code=500, detail=f"PDF直接分析エラー: {str(analysis_error)}")
-                
-                # データベースに保存
-                try:
-                    test_result = TestResult(
-                        user_id=user_id,
-                        subject=subject or "PDF分析結果",
-                        test_name=test_name or "PDFテスト結果",
-                        total_score=0,  # PDFから抽出できない場合は0
-                        max_score=100,
-                        score_percentage=0.0,
-                        file_path=file.filename,
-                        analysis_status="completed"
-                    )
-                    
-                    db.add(test_result)
-                    db.flush()
-                    
-                    # 分析結果を保存
-                    for topic_data in analysis_result['topics']:
-                        detail = TestResultDetail(
-                            test_result_id=test_result.id,
-                            topic=topic_data['topic'],
-                            correct_count=topic_data['correct_count'],
-                            total_count=topic_data['total_count'],
-                            score_percentage=topic_data['score_percentage'],
-                            weakness_analysis=topic_data.get('weakness_analysis'),
-                            improvement_advice=topic_data.get('improvement_advice')
-                        )
-                        db.add(detail)
-                    
-                    db.commit()
-                    
-                    return {
-                        "message": "PDFファイルの直接AI分析が完了しました",
-                        "test_result_id": test_result.id,
-                        "subject": test_result.subject,
-                        "test_name": test_result.test_name,
-                        "total_score": test_result.total_score,
-                        "max_score": test_result.max_score,
-                        "score_percentage": test_result.score_percentage,
-                        "analysis_status": test_result.analysis_status,
-                        "overall_analysis": analysis_result['overall_analysis'],
-                        "topics": analysis_result['topics'],
-                        "analysis_method": analysis_result.get('analysis_method', 'PDF直接分析')
-                    }
-                    
-                except Exception as db_error:
-                    db.rollback()
-                    raise HTTPException(status_code=500, detail=f"データベース保存エラー: {str(db_error)}")
-            
-            else:
-                # 画像ファイルの場合は従来の方法
-                try:
-                    text = analyzer.extract_text_from_file(temp_file_path)
-                    if not text.strip():
-                        raise HTTPException(status_code=400, detail="ファイルからテキストを抽出できませんでした")
-                except Exception as extract_error:
-                    raise HTTPException(status_code=400, detail=f"ファイルの読み込みエラー: {str(extract_error)}")
-                
-                # テスト結果を解析
-                try:
-                    parsed_result = analyzer.parse_test_result(text)
-                except Exception as parse_error:
-                    raise HTTPException(status_code=400, detail=f"テスト結果の解析エラー: {str(parse_error)}")
-                
-                # AI分析を実行（GPT-4o使用）
-                try:
-                    analysis_result = analyzer.analyze_weaknesses_with_ai(parsed_result)
-                except Exception as analysis_error:
-                    raise HTTPException(status_code=500, detail=f"AI分析エラー: {str(analysis_error)}")
-                
-                # データベースに保存
-                try:
-                    test_result = TestResult(
-                        user_id=user_id,
-                        subject=subject or parsed_result['subject'],
-                        test_name=test_name or parsed_result['test_name'],
-                        total_score=parsed_result['total_score'] or 0,
-                        max_score=parsed_result['max_score'] or 100,
-                        score_percentage=parsed_result['score_percentage'],
-                        file_path=file.filename,
-                        analysis_status="completed"
-                    )
-                    
-                    db.add(test_result)
-                    db.flush()
-                    
-                    # 単元別詳細を保存
-                    for topic_data in analysis_result['topics']:
-                        detail = TestResultDetail(
-                            test_result_id=test_result.id,
-                            topic=topic_data['topic'],
-                            correct_count=topic_data['correct_count'],
-                            total_count=topic_data['total_count'],
-                            score_percentage=topic_data['score_percentage'],
-                            weakness_analysis=topic_data.get('weakness_analysis'),
-                            improvement_advice=topic_data.get('improvement_advice')
-                        )
-                        db.add(detail)
-                    
-                    db.commit()
-                    
-                    return {
-                        "message": "テスト結果のアップロードとAI分析が完了しました",
-                        "test_result_id": test_result.id,
-                        "subject": test_result.subject,
-                        "test_name": test_result.test_name,
-                        "total_score": test_result.total_score,
-                        "max_score": test_result.max_score,
-                        "score_percentage": test_result.score_percentage,
-                        "analysis_status": test_result.analysis_status,
-                        "overall_analysis": analysis_result['overall_analysis'],
-                        "topics": analysis_result['topics']
-                    }
-                    
-                except Exception as db_error:
-                    db.rollback()
-                    raise HTTPException(status_code=500, detail=f"データベース保存エラー: {str(db_error)}")
+        # 同じファイルの分析結果があれば再利用
+        cached = analysis_cache.lookup(db, content_hash)
+        if cached:
+            cache_id, payload = cached
+            test_result.analysis_status = "completed"
+            test_result.analysis_cache_id = cache_id
+            db.add(test_result)
+            db.flush()
+            apply_analysis(db, test_result, payload, subject, test_name)
+            db.commit()
+            os.unlink(temp_file_path)
             
-        finally:
-            # 一時ファイルを削除
-            if temp_file_path:
-                try:
-                    print(f"一時ファイル削除: {temp_file_path}")
-                    os.unlink(temp_file_path)
-                    print("一時ファイル削除完了")
-                except Exception as e:
-                    print(f"一時ファイル削除エラー: {e}")
-                    pass  # 削除に失敗しても無視
-                
-    except HTTPException:
-        raise
+            response.status_code = 200
+            return {
+                "message": "同じファイルの分析結果を再利用しました",
+                "test_result_id": test_result.id,
+                "subject": test_result.subject,
+                "test_name": test_result.test_name,
+                "total_score": test_result.total_score,
+                "max_score": test_result.max_score,
+                "score_percentage": test_result.score_percentage,
+                "analysis_status": test_result.analysis_status,
+                "overall_analysis": payload['overall_analysis'],
+                "topics": payload['topics'],
+                "analysis_method": payload['analysis_method'],
+                "cached": True
+            }
+        
+        # 分析キューの空きを確保（満杯なら429）
+        analysis_jobs.reserve()
+        reserved = True
+        
+        db.add(test_result)
+        db.commit()
+        
+        analysis_jobs.submit(test_result.id, temp_file_path, file_ext, user_id, subject, test_name,
+                             content_hash, source_bytes)
     except Exception as e:
-        print(f"Unexpected error in upload_test_result: {e}")
+        if reserved:
+            analysis_jobs.release()
+        db.rollback()
+        if temp_file_path and os.path.exists(temp_file_path):
+            try:
+                os.unlink(temp_file_path)
+            except OSError:
+                pass
+        if isinstance(e, QueueFullError):
+            raise HTTPException(status_code=429, detail="分析待ちのファイルが多すぎます。しばらくしてから再度お試しください", headers={"Retry-After": "30"})
+        log_event("upload_failed", level="error", filename=file.filename, error=str(e))
         raise HTTPException(status_code=500, detail=f"予期しないエラーが発生しました: {str(e)}")
+    
+    log_event("analysis_job_submitted", test_result_id=test_result.id, file_ext=file_ext,
+              source_bytes=source_bytes, queue_depth=analysis_jobs.depth)
+    return {
+        "message": "テスト結果を受け付けました。分析完了までお待ちください",
+        "test_result_id": test_result.id,
+        "analysis_status": test_result.analysis_status,
+        "job_url": f"/test-results/jobs/{test_result.id}"
+    }
+
+@app.get("/test-results/jobs/{test_result_id}")
+async def get_test_result_job(test_result_id: int, db: AsyncSession = Depends(get_async_db)):
+    """分析ジョブの状態を取得（完了時は分析結果を含む）"""
+    test_result = await db.get(TestResult, test_result_id, options=[selectinload(TestResult.details)])
+    if not test_result:
+        raise HTTPException(status_code=404, detail="テスト結果が見つかりません")
+    
+    response = {
+        "id": test_result.id,
+        "subject": test_result.subject,
+        "test_name": test_result.test_name,
+        "total_score": test_result.total_score,
+        "max_score": test_result.max_score,
+        "score_percentage": test_result.score_percentage,
+        "analysis_status": test_result.analysis_status,
+        "created_at": test_result.created_at,
+        "queue_depth": analysis_jobs.depth
+    }
+    
+    if is_stale(test_result):
+        # 実行していたワーカーが再起動などで止まった
+        await db.run_sync(fail_stale_jobs, [test_result.id])
+        await db.refresh(test_result)
+        response["analysis_status"] = test_result.analysis_status
+    
+    if test_result.analysis_status in ("completed", "failed"):
+        response["topics"] = [serialize_detail(detail) for detail in test_result.details]
+        response["overall_analysis"] = test_result.overall_analysis
+        response["analysis_method"] = test_result.analysis_method
+    if test_result.analysis_status == "failed":
+        response["error"] = test_result.analysis_error
+    
+    return response
 
 @app.get("/test-results/{user_id}")
-def get_test_results(user_id: int, db: Session = Depends(get_db)):
-    """ユーザーのテスト結果一覧を取得"""
-    test_results = db.query(TestResult).filter(TestResult.user_id == user_id).order_by(TestResult.created_at.desc()).all()
+async def get_test_results(user_id: int, before: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                           fields: str = "full", db: AsyncSession = Depends(get_async_db)):
+    """ユーザーのテスト結果一覧を取得（新しい順、before=<created_at,id> で続きを取得）"""
+    if fields not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {fields}")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    try:
+        cursor = parse_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid before: {before}")
     
-    result_list = []
-    for test_result in test_results:
-        details = db.query(TestResultDetail).filter(TestResultDetail.test_result_id == test_result.id).all()
-        detail_list = []
-        for detail in details:
-            detail_list.append({
-                "topic": detail.topic,
-                "correct_count": detail.correct_count,
-                "total_count": detail.total_count,
-                "score_percentage": detail.score_percentage,
-                "weakness_analysis": detail.weakness_analysis,
-                "improvement_advice": detail.improvement_advice
-            })
-        
-        result_list.append({
+    summary = fields == "summary"
+    test_results, has_more = await db.run_sync(list_test_results, user_id, cursor, limit, summary)
+    
+    result_list = [
+        {
             "id": test_result.id,
             "subject": test_result.subject,
             "test_name": test_result.test_name,
@@ -758,33 +603,29 @@ def get_test_results(user_id: int, db: Session = Depends(get_db)):
             "score_percentage": test_result.score_percentage,
             "analysis_status": test_result.analysis_status,
             "created_at": test_result.created_at,
-            "details": detail_list
-        })
+            "details": [serialize_detail(detail, summary) for detail in test_result.details]
+        }
+        for test_result in test_results
+    ]
     
-    return {"test_results": result_list}
+    return {
+        "test_results": result_list,
+        "next_before": encode_cursor(test_results[-1]) if has_more else None
+    }
 
 @app.get("/test-results/{user_id}/{test_result_id}")
-def get_test_result_detail(user_id: int, test_result_id: int, db: Session = Depends(get_db)):
+async def get_test_result_detail(user_id: int, test_result_id: int, db: AsyncSession = Depends(get_async_db)):
     """特定のテスト結果の詳細を取得"""
-    test_result = db.query(TestResult).filter(
-        TestResult.id == test_result_id,
-        TestResult.user_id == user_id
-    ).first()
+    test_result = (await db.scalars(
+        select(TestResult)
+        .where(TestResult.id == test_result_id, TestResult.user_id == user_id)
+        .options(selectinload(TestResult.details))
+    )).first()
     
     if not test_result:
         raise HTTPException(status_code=404, detail="テスト結果が見つかりません")
     
-    details = db.query(TestResultDetail).filter(TestResultDetail.test_result_id == test_result.id).all()
-    detail_list = []
-    for detail in details:
-        detail_list.append({
-            "topic": detail.topic,
-            "correct_count": detail.correct_count,
-            "total_count": detail.total_count,
-            "score_percentage": detail.score_percentage,
-            "weakness_analysis": detail.weakness_analysis,
-            "improvement_advice": detail.improvement_advice
-        })
+    detail_list = [serialize_detail(detail) for detail in test_result.details]
     
     return {
         "id": test_result.id,
@@ -800,50 +641,104 @@ def get_test_result_detail(user_id: int, test_result_id: int, db: Session = Depe
     }
 
 @app.post("/questions/{question_id}/answer")
-def grade_answer(question_id: int, answer_in: AnswerIn, db: Session = Depends(get_db)):
-    question = db.query(Question).filter(Question.id == question_id).first()
-    if not question:
+async def grade_answer(question_id: int, answer_in: AnswerIn, db: AsyncSession = Depends(get_async_db)):
+    answer_key = await db.run_sync(answer_keys.get, question_id)
+    if not answer_key:
         raise HTTPException(status_code=404, detail="Question not found")
+    if answer_key.error is not None:
+        raise HTTPException(status_code=422, detail="Invalid answer key")
 
-    correct_answer_data = json.loads(question.answer)
-    is_correct = str(answer_in.user_answer).strip() == str(correct_answer_data["primary"]).strip()
+    is_correct = answer_key.check(answer_in.user_answer)
+    # 解答時刻とMasteryの更新時刻を揃える（履歴からの再計算と同じ結果にするため）
+    now = datetime.now()
 
     # Save attempt
     attempt = Attempt(
         user_id=1, # Dummy user_id
-        question_id=question.id,
+        question_id=question_id,
         correct=is_correct,
         seconds=answer_in.time_sec,
         cause=answer_in.mistake_type,
-        created_at=datetime.now()
+        created_at=now
     )
     db.add(attempt)
 
-    # Update mastery (simplified FSRS-like logic)
-    mastery = db.query(Mastery).filter(Mastery.user_id == 1, Mastery.question_id == question.id).first()
+    # Update mastery (FSRS)
+    mastery = await db.get(Mastery, (1, question_id))
+    previous_value = mastery.value if mastery else None
     if not mastery:
-        mastery = Mastery(user_id=1, question_id=question.id, value=0.5, consecutive_correct=0, stability=1.0, next_review_at=datetime.now())
+        mastery = Mastery(user_id=1, question_id=question_id, value=0.5, consecutive_correct=0, stability=1.0, next_review_at=now)
         db.add(mastery)
 
-    if is_correct:
-        mastery.value = min(1.0, mastery.value + 0.1) # Simple EMA-like update
-        mastery.consecutive_correct += 1
-        if mastery.consecutive_correct >= 2: # 2 consecutive correct answers for "understood"
-            mastery.stability = max(1.0, mastery.stability * 1.5 + 0.3) # Increase stability
-            interval_days = min(14, round(mastery.stability * 3)) # Max 14 days
-            mastery.next_review_at = datetime.now() + timedelta(days=interval_days)
-        else:
-            mastery.next_review_at = datetime.now() + timedelta(days=1) # Next day for first correct
-    else:
-        mastery.value = max(0.0, mastery.value - 0.2)
-        mastery.consecutive_correct = 0
-        mastery.stability = 0.7 # Reset stability
-        mastery.next_review_at = datetime.now() + timedelta(days=1) # Next day for incorrect
+    update_mastery(mastery, is_correct, now)
+    # 単元別の集計に差分を加算
+    delta = TopicStatsDelta()
+    delta.add_attempt(answer_key.subject, answer_key.topic, is_correct, answer_in.time_sec)
+    delta.add_mastery(answer_key.subject, answer_key.topic, previous_value, mastery.value)
+    await db.run_sync(apply_topic_stats, 1, delta)
+    version = await db.run_sync(bump_mastery_version, 1)
 
-    db.commit()
-    db.refresh(mastery)
+    await db.commit()
+    due_queues.write_through(1, version, [(question_id, mastery.next_review_at, answer_key.subject)])
+
+    return {"is_correct": is_correct, "correct_answer": answer_key.primary, "ai_explain": None}
+
+@app.post("/answers/batch")
+def grade_answers_batch(req: BatchAnswerReq, db: Session = Depends(get_db)):
+    """複数の解答をまとめて採点（オフライン端末のキュー送信用）"""
+    if not req.answers:
+        return {"results": []}
+    try:
+        results = grade_batch(db, req.user_id, req.answers)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": results}
+
+@app.post("/users/{user_id}/mastery/recompute")
+def recompute_user_mastery(user_id: int, db: Session = Depends(get_db)):
+    """ユーザーのMasteryを解答履歴から再計算（重みを更新したとき用。全ユーザーは python -m app.reschedule --all）"""
+    try:
+        return recompute_mastery(db, [user_id])
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/users/{user_id}/weak-topics")
+def get_weak_topics(user_id: int, subject: Optional[str] = None, limit: int = 20, db: Session = Depends(get_db)):
+    """弱点単元を優先度の高い順に返す（priority は前提単元への伝播後、weakness は単元自身の弱点度）"""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be a positive integer")
+    priorities = weakness_engine.priorities(db, user_id, subject)[:limit]
+    return {
+        "user_id": user_id,
+        "topics": [
+            {"subject": item.subject, "topic": item.topic,
+             "weakness": round(item.weakness, 4), "priority": round(item.priority, 4)}
+            for item in priorities
+        ],
+    }
 
-    return {"is_correct": is_correct, "correct_answer": correct_answer_data["primary"], "ai_explain": None}
+@app.get("/users/{user_id}/topic-stats")
+def get_topic_stats(user_id: int, subject: Optional[str] = None, db: Session = Depends(get_db)):
+    """単元別の正答率・平均解答時間・習熟度（user_topic_stats のみを読む）"""
+    return {
+        "user_id": user_id,
+        "topics": [
+            {
+                "subject": stat.subject,
+                "topic": stat.topic,
+                "attempts": stat.attempts,
+                "correct": stat.correct,
+                "accuracy": round(stat.correct / stat.attempts, 4) if stat.attempts else None,
+                "mean_seconds": round(stat.seconds_total / stat.seconds_count, 1) if stat.seconds_count else None,
+                "mastery": round(stat.mastery_sum / stat.mastery_count, 4) if stat.mastery_count else None,
+                "questions": stat.mastery_count,
+                "updated_at": stat.updated_at,
+            }
+            for stat in topic_stats(db, user_id, subject)
+        ],
+    }
 
 @app.post("/ai/explain")
 def ai_explain(question_id: int, user_answer: str):
@@ -858,7 +753,7 @@ def generate_variant(topic_id: int, difficulty: int = 1, db: Session = Depends(g
         topic="割合（類題）",
         stem=f"みかんを原価の{random.randint(20,30)}%の利益で売ったところ、販売価格は{random.randint(1200,1500)}円でした。原価はいくらですか？ (ID: {random.randint(2000, 9999)})",
         choices=None,
-        answer=json.dumps({"primary": "1000", "variants": ["1000"]}),
+        answer={"primary": "1000", "variants": ["1000", "1000円"]},
         explanation="原価をXとすると、X * (1 + 利益率/100) = 販売価格",
         difficulty=difficulty,
         source="AI生成",
@@ -868,90 +763,83 @@ def generate_variant(topic_id: int, difficulty: int = 1, db: Session = Depends(g
     db.add(new_question)
     db.commit()
     db.refresh(new_question)
+    answer_keys.invalidate(new_question.id)
     return {"created": True, "question": new_question}
 
 @app.get("/questions/{question_id}")
-def get_question(question_id: int, db: Session = Depends(get_db)):
-    question = db.query(Question).filter(Question.id == question_id).first()
+async def get_question(question_id: int, db: AsyncSession = Depends(get_async_db)):
+    question = await db.get(Question, question_id)
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
     return question
 
 @app.post("/next-question")
-def next_question(req: NextQuestionReq, db: Session = Depends(get_db)):
+async def next_question(req: NextQuestionReq, db: AsyncSession = Depends(get_async_db)):
     try:
-        # First check if mastery table exists
-        try:
-            from sqlalchemy import text
-            db.execute(text("SELECT 1 FROM mastery LIMIT 1"))
-            db.commit()
-        except Exception:
-            # Mastery table doesn't exist, skip mastery-based logic
-            print("Mastery table not found, skipping mastery-based question selection")
-            db.rollback()
-            
-            # Just return a random question
-            questions = db.query(Question).all()
-            if questions:
-                return {"question": random.choice(questions)}
-            else:
-                return {"question": None, "message": "No questions available"}
-        
-        # Prioritize questions due for review
-        due_masteries = db.query(Mastery).filter(
-            Mastery.user_id == req.user_id,
-            Mastery.next_review_at <= datetime.now()
-        ).order_by(Mastery.next_review_at.asc()).all()
-
-        if due_masteries:
-            # Pick a random question from the due ones
-            mastery = random.choice(due_masteries)
-            question = db.query(Question).filter(Question.id == mastery.question_id).first()
-            if question:
-                return {"question": question}
-
-        # If no due questions, pick a random question not yet mastered or with low mastery
-        # For simplicity, just pick a random one from the seed data
-        questions = db.query(Question).all()
-        if questions:
-            return {"question": random.choice(questions)}
-        
-        return {"question": None}
+        # 復習期限の問題を優先し、なければ科目内からランダムに選ぶ
+        question = await db.run_sync(select_next_question, req.user_id, req.subject)
+        if question:
+            return {"question": question}
+        return {"question": None, "message": "No questions available"}
         
     except Exception as e:
-        print(f"Error in next_question: {e}")
+        log_event("next_question_failed", level="error", user_id=req.user_id, subject=req.subject, error=str(e))
+        await db.rollback()
         # Fallback: try to get any question
         try:
-            questions = db.query(Question).all()
-            if questions:
-                return {"question": random.choice(questions)}
+            question = await db.run_sync(sample_question, req.subject)
+            if question:
+                return {"question": question}
         except Exception as e2:
-            print(f"Fallback error: {e2}")
+            log_event("next_question_fallback_failed", level="error", subject=req.subject, error=str(e2))
         
         return {"question": None, "error": "Database error occurred"}
 
 # 算数の学習依存関係を活用したAPI
+def parse_depth(depth: str) -> Optional[int]:
+    """depth クエリ（"all" または1以上の整数）を最大段数に変換（"all" はNone）"""
+    if depth == "all":
+        return None
+    try:
+        value = int(depth)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise HTTPException(status_code=400, detail="depth must be 'all' or a positive integer")
+    return value
+
+def subject_prerequisites(subject: str, topic_name: str, depth: str, db: Session) -> Dict:
+    """前提単元を depth 段まで1回の再帰クエリで取得し、各単元の深さとともに返す"""
+    if subject.lower() not in ("math", "science", "social"):
+        raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
+    prerequisites = prerequisite_closure(db, subject, topic_name, parse_depth(depth))
+    if prerequisites is None:
+        return {"prerequisites": [], "message": "単元が見つかりません"}
+    return {
+        "subject": subject.lower(),
+        "target_topic": topic_name,
+        "depth": depth,
+        "max_depth": max((p["depth"] for p in prerequisites), default=0),
+        "prerequisites": prerequisites
+    }
+
 @app.get("/math/prerequisites/{topic_name}")
-def get_prerequisites(topic_name: str, db: Session = Depends(get_db)):
-    """指定された単元の前提単元を取得"""
-    dependency = db.query(MathDependency).filter(MathDependency.topic_name == topic_name).first()
-    if not dependency:
+def get_prerequisites(topic_name: str, depth: Optional[str] = None, db: Session = Depends(get_db)):
+    """指定された単元の前提単元を取得（depth 指定時は段数付き）"""
+    if depth is not None:
+        return subject_prerequisites("math", topic_name, depth, db)
+    graph = dependency_graphs.get(db, "math")
+    if topic_name not in graph:
         return {"prerequisites": [], "message": "単元が見つかりません"}
     
-    prerequisites = []
-    current_topic = dependency.prerequisite_topic
-    
-    # 前提単元を遡って取得
-    while current_topic:
-        prereq_dep = db.query(MathDependency).filter(MathDependency.topic_name == current_topic).first()
-        if prereq_dep:
-            prerequisites.append({
-                "topic_name": current_topic,
-                "topic_id": prereq_dep.topic_id
-            })
-            current_topic = prereq_dep.prerequisite_topic
-        else:
-            break
+    # 前提単元を遡って取得（近い順）
+    prerequisites = [
+        {
+            "topic_name": prereq_topic,
+            "topic_id": graph.topic_info(prereq_topic)["topic_id"]
+        }
+        for prereq_topic in graph.all_prerequisites(topic_name)
+    ]
     
     return {
         "target_topic": topic_name,
@@ -962,278 +850,113 @@ def get_prerequisites(topic_name: str, db: Session = Depends(get_db)):
 @app.get("/math/learning-path/{topic_name}")
 def get_learning_path(topic_name: str, db: Session = Depends(get_db)):
     """指定された単元の学習パス（前提→目標→次）を取得"""
-    dependency = db.query(MathDependency).filter(MathDependency.topic_name == topic_name).first()
-    if not dependency:
+    graph = dependency_graphs.get(db, "math")
+    if topic_name not in graph:
         return {"message": "単元が見つかりません"}
     
-    # 前提単元を取得
-    prerequisites = []
-    current_topic = dependency.prerequisite_topic
-    while current_topic:
-        prereq_dep = db.query(MathDependency).filter(MathDependency.topic_name == current_topic).first()
-        if prereq_dep:
-            prerequisites.append(current_topic)
-            current_topic = prereq_dep.prerequisite_topic
-        else:
-            break
+    # 前提単元を学習順に並べる
+    learning_path = graph.learning_path(topic_name)
     
     return {
-        "prerequisites": prerequisites,
+        "prerequisites": learning_path[:-1],
         "target_topic": topic_name,
-        "learning_path": prerequisites + [topic_name]
+        "learning_path": learning_path
     }
 
 # 理科の学習依存関係を活用したAPI
 @app.get("/science/prerequisites/{topic_name}")
-def get_science_prerequisites(topic_name: str, db: Session = Depends(get_db)):
-    """指定された理科単元の前提単元を取得（複数前提対応）"""
-    dependency = db.query(ScienceDependency).filter(ScienceDependency.topic_name == topic_name).first()
-    if not dependency:
+def get_science_prerequisites(topic_name: str, depth: Optional[str] = None, db: Session = Depends(get_db)):
+    """指定された理科単元の前提単元を取得（複数前提対応、depth 指定時は推移的に段数付き）"""
+    if depth is not None:
+        return subject_prerequisites("science", topic_name, depth, db)
+    graph = dependency_graphs.get(db, "science")
+    if topic_name not in graph:
         return {"prerequisites": [], "message": "単元が見つかりません"}
     
-    # セミコロン区切りの前提単元を分割
-    prerequisite_list = []
-    if dependency.prerequisite_topics:
-        prerequisite_topics = [t.strip() for t in dependency.prerequisite_topics.split(";") if t.strip()]
-        
-        for prereq_topic in prerequisite_topics:
-            prereq_dep = db.query(ScienceDependency).filter(ScienceDependency.topic_name == prereq_topic).first()
-            if prereq_dep:
-                prerequisite_list.append({
-                    "topic_name": prereq_topic,
-                    "domain": prereq_dep.domain,
-                    "topic_id": prereq_dep.topic_id
-                })
+    prerequisite_list = [
+        {
+            "topic_name": prereq_topic,
+            "domain": graph.topic_info(prereq_topic)["domain"],
+            "topic_id": graph.topic_info(prereq_topic)["topic_id"]
+        }
+        for prereq_topic in graph.direct_prerequisites(topic_name)
+    ]
     
     return {
         "target_topic": topic_name,
-        "domain": dependency.domain,
+        "domain": graph.topic_info(topic_name)["domain"],
         "prerequisites": prerequisite_list,
         "prerequisite_topics": [p["topic_name"] for p in prerequisite_list]
     }
 
+@app.get("/{subject}/prerequisites/{topic_name}")
+def get_subject_prerequisites(subject: str, topic_name: str, depth: str = "1", db: Session = Depends(get_db)):
+    """指定された単元の前提単元を段数付きで取得（depth=all で全段、循環があっても停止）"""
+    return subject_prerequisites(subject, topic_name, depth, db)
+
 @app.get("/science/learning-path/{topic_name}")
 def get_science_learning_path(topic_name: str, db: Session = Depends(get_db)):
     """指定された理科単元の学習パス（前提→目標→次）を取得（複数対応）"""
-    dependency = db.query(ScienceDependency).filter(ScienceDependency.topic_name == topic_name).first()
-    if not dependency:
+    graph = dependency_graphs.get(db, "science")
+    if topic_name not in graph:
         return {"message": "単元が見つかりません"}
     
-    # 前提単元を取得（複数対応）
-    all_prerequisites = []
-    if dependency.prerequisite_topics:
-        prerequisite_topics = [t.strip() for t in dependency.prerequisite_topics.split(";") if t.strip()]
-        
-        for prereq_topic in prerequisite_topics:
-            prereq_dep = db.query(ScienceDependency).filter(ScienceDependency.topic_name == prereq_topic).first()
-            if prereq_dep:
-                all_prerequisites.append(prereq_topic)
+    all_prerequisites = graph.direct_prerequisites(topic_name)
     
     return {
         "prerequisites": all_prerequisites,
         "target_topic": topic_name,
-        "domain": dependency.domain,
+        "domain": graph.topic_info(topic_name)["domain"],
         "learning_path": all_prerequisites + [topic_name]
     }
 
 @app.get("/dependencies/{subject}")
 def get_dependencies(subject: str, db: Session = Depends(get_db)):
     """指定された科目の依存関係データを取得"""
+    if subject.lower() not in ("math", "science", "social"):
+        raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
     try:
-        if subject.lower() == "math":
-            try:
-                print("Querying math dependencies with direct SQL...")
-                from sqlalchemy import text
-                
-                # 直接SQLでデータを取得（ドメインも含める）
-                result_sql = db.execute(text('SELECT id, topic_name, prerequisite_topics, topic_id, "Domain" FROM math_dependencies'))
-                dependencies_data = result_sql.fetchall()
-                print(f"Found {len(dependencies_data)} math dependencies with direct SQL")
-                
-                result = []
-                for row in dependencies_data:
-                    id_val, topic_name, prerequisite_topics, topic_id, domain = row
-                    
-                    result.append({
-                        "id": id_val,
-                        "name": topic_name,
-                        "prerequisites": prerequisite_topics.split(';') if prerequisite_topics else [],
-                        "subject": "math",
-                        "domain": domain or '未分類'
-                    })
-                
-                print(f"Returning {len(result)} math topics")
-                return result
-            except Exception as e:
-                print(f"Error querying math dependencies: {e}")
-                import traceback
-                traceback.print_exc()
-                return []
-        elif subject.lower() == "science":
-            try:
-                dependencies = db.query(ScienceDependency).all()
-                result = []
-                for dep in dependencies:
-                    # 本番環境のデータベース構造に合わせてドメインを取得
-                    domain = '未分類'
-                    try:
-                        # 小文字のdomainを試す
-                        domain = getattr(dep, 'domain', '未分類')
-                    except:
-                        try:
-                            # 大文字のDomainを試す
-                            domain = getattr(dep, 'Domain', '未分類')
-                        except:
-                            domain = '未分類'
-                    
-                    result.append({
-                        "id": dep.id,
-                        "name": dep.topic_name,
-                        "prerequisites": dep.prerequisite_topics.split(';') if dep.prerequisite_topics else [],
-                        "subject": "science",
-                        "domain": domain
-                    })
-                return result
-            except Exception as e:
-                print(f"Error querying science dependencies: {e}")
-                return []
-        elif subject.lower() == "social":
-            try:
-                dependencies = db.query(SocialDependency).all()
-                result = []
-                for dep in dependencies:
-                    # 本番環境のデータベース構造に合わせてドメインを取得
-                    domain = '未分類'
-                    try:
-                        # 小文字のdomainを試す
-                        domain = getattr(dep, 'domain', '未分類')
-                    except:
-                        try:
-                            # 大文字のDomainを試す
-                            domain = getattr(dep, 'Domain', '未分類')
-                        except:
-                            domain = '未分類'
-                    
-                    result.append({
-                        "id": dep.id,
-                        "name": dep.topic_name,
-                        "prerequisites": dep.prerequisite_topics.split(';') if dep.prerequisite_topics else [],
-                        "subject": "social",
-                        "domain": domain
-                    })
-                return result
-            except Exception as e:
-                print(f"Error querying social dependencies: {e}")
-                return []
-        else:
-            raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
+        graph = dependency_graphs.get(db, subject)
     except Exception as e:
-        print(f"Error in get_dependencies: {e}")
+        log_event("dependencies_query_failed", level="error", subject=subject.lower(), error=str(e))
         return []
+    
+    result = [
+        {
+            "id": graph.info[node]["id"],
+            "name": name,
+            "prerequisites": graph.declared_prerequisites[node],
+            "subject": graph.subject,
+            "domain": graph.info[node]["domain"] or '未分類'
+        }
+        for node, name in enumerate(graph.names)
+    ]
+    log_event("dependencies_listed", subject=graph.subject, topics=len(result))
+    return result
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match ヘッダーが ETag に一致するか"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
 
 @app.get("/dependencies/{subject}/flow")
-def get_dependency_flow(subject: str, db: Session = Depends(get_db)):
+def get_dependency_flow(subject: str, request: Request, db: Session = Depends(get_db)):
     """指定された科目の依存関係フローを取得（フロントエンド用）"""
+    if subject.lower() not in ("math", "science", "social"):
+        raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
     try:
-        if subject.lower() == "math":
-            dependencies = db.query(MathDependency).all()
-            # 依存関係を構築
-            dependency_map = {}
-            for dep in dependencies:
-                dependency_map[dep.topic_name] = {
-                    "id": dep.id,
-                    "name": dep.topic_name,
-                    "prerequisites": [dep.prerequisite_topic] if dep.prerequisite_topic else [],
-                    "dependencies": [],
-                    "subject": "math",
-                    "domain": dep.domain
-                }
-            
-            # 依存関係を構築（前提→後続の関係）
-            for dep in dependencies:
-                if dep.prerequisite_topic and dep.prerequisite_topic in dependency_map:
-                    dependency_map[dep.prerequisite_topic]["dependencies"].append(dep.topic_name)
-            
-            return {
-                "subject": "math",
-                "levels": level_groups,
-                "topics": list(dependency_map.values())
-            }
-            
-        elif subject.lower() == "science":
-            dependencies = db.query(ScienceDependency).all()
-            # 依存関係を構築
-            dependency_map = {}
-            for dep in dependencies:
-                prereqs = dep.prerequisite_topics.split(';') if dep.prerequisite_topics else []
-                dependency_map[dep.topic_name] = {
-                    "id": dep.id,
-                    "name": dep.topic_name,
-                    "prerequisites": prereqs,
-                    "dependencies": [],
-                    "subject": "science",
-                    "domain": dep.domain
-                }
-            
-            # 依存関係を構築（前提→後続の関係）
-            for dep in dependencies:
-                if dep.prerequisite_topics:
-                    prereqs = [p.strip() for p in dep.prerequisite_topics.split(';') if p.strip()]
-                    for prereq in prereqs:
-                        if prereq in dependency_map:
-                            dependency_map[prereq]["dependencies"].append(dep.topic_name)
-            
-            return {
-                "subject": "science",
-                "levels": level_groups,
-                "topics": list(dependency_map.values())
-            }
-            
-        elif subject.lower() == "social":
-            dependencies = db.query(SocialDependency).all()
-            # 依存関係を構築
-            dependency_map = {}
-            for dep in dependencies:
-                prereqs = dep.prerequisite_topics.split(';') if dep.prerequisite_topics else []
-                dependency_map[dep.topic_name] = {
-                    "id": dep.id,
-                    "name": dep.topic_name,
-                    "prerequisites": prereqs,
-                    "dependencies": [],
-                    "subject": "social",
-                    "domain": dep.domain
-                }
-            
-            # レベルを計算
-            levels = {}
-            for dep in dependencies:
-                if not dep.prerequisite_topics:
-                    levels[dep.topic_name] = 0
-                else:
-                    prereqs = dep.prerequisite_topics.split(';')
-                    max_level = 0
-                    for prereq in prereqs:
-                        if prereq.strip() in levels:
-                            max_level = max(max_level, levels[prereq.strip()])
-                    levels[dep.topic_name] = max_level + 1
-            
-            # レベル別にグループ化
-            level_groups = {}
-            for topic_name, level in levels.items():
-                if level not in level_groups:
-                    level_groups[level] = []
-                level_groups[level].append(dependency_map[topic_name])
-            
-            return {
-                "subject": "social",
-                "levels": level_groups,
-                "topics": list(dependency_map.values())
-            }
-        else:
-            raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
+        # 依存関係テーブルが変わるまでは生成済みのJSONをそのまま返す
+        flow = dependency_graphs.get(db, subject).flow_artifact()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    headers = {"ETag": flow.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), flow.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=flow.body, media_type="application/json", headers=headers)
+
 @app.get("/domains/{subject}")
 def get_domains(subject: str, db: Session = Depends(get_db)):
     """指定された科目のドメイン一覧を取得（ドメインマスターテーブルから）"""
@@ -1250,44 +973,19 @@ def get_domains(subject: str, db: Session = Depends(get_db)):
         return {"subject": subject, "domains": []}
 
 @app.get("/migrate")
-def run_migration(db: Session = Depends(get_db)):
-    """本番環境でマイグレーションを実行するエンドポイント"""
-    try:
-        from migrate import remove_next_topics_columns, create_tables, seed_database
-        
-        print("🚀 Starting production migration...")
-        
-        # Step 1: Remove next_topics columns
-        if remove_next_topics_columns():
-            print("✅ next_topics columns removed successfully")
-        else:
-            print("⚠️  Failed to remove next_topics columns, but continuing...")
-        
-        # Step 2: Create tables
-        if create_tables():
-            print("✅ Tables created successfully")
-        else:
-            print("❌ Failed to create tables")
-            return {"status": "error", "message": "Failed to create tables"}
-        
-        # Step 3: Seed database
-        try:
-            seed_database()
-            print("✅ Database seeded successfully")
-        except Exception as e:
-            print(f"⚠️  Seeding failed: {e}")
-            return {"status": "warning", "message": f"Migration completed but seeding failed: {str(e)}"}
-        
-        print("🎉 Production migration completed successfully!")
-        return {
-            "status": "success", 
-            "message": "Migration completed successfully",
-            "timestamp": datetime.now().isoformat()
-        }
-        
-    except Exception as e:
-        print(f"❌ Migration failed: {e}")
-        return {"status": "error", "message": str(e)}
+def migration_status():
+    """スキーママイグレーションの適用状況（適用は起動時または python -m app.migrations で行う）"""
+    applied = applied_versions(engine)
+    pending = pending_migrations(engine)
+    return {
+        "current_version": applied[-1]["version"] if applied else 0,
+        "latest_version": LATEST_VERSION,
+        "applied": [
+            {"version": row["version"], "name": row["name"], "applied_at": row["applied_at"], "duration_ms": row["duration_ms"]}
+            for row in applied
+        ],
+        "pending": [{"version": migration.version, "name": migration.name} for migration in pending]
+    }
 
 @app.get("/list-all-tables")
 def list_all_tables(db: Session = Depends(get_db)):
@@ -1408,6 +1106,15 @@ def debug_math_dependencies(db: Session = Depends(get_db)):
     except Exception as e:
         return {"error": f"Failed to debug math_dependencies: {str(e)}"}
 
+@app.post("/admin/fsrs/reload")
+def reload_fsrs_parameters():
+    """最適化した重み（python -m app.fsrs_optimizer の出力）を読み直す（管理者用）"""
+    try:
+        params = fsrs_scheduler.reload()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Failed to load FSRS parameters: {e}")
+    return {"w": list(params.w), "desired_retention": params.desired_retention, "maximum_interval": params.maximum_interval}
+
 @app.get("/admin/domains")
 def get_all_domains(db: Session = Depends(get_db)):
     """すべてのドメイン一覧を取得（管理者用）"""
@@ -1442,6 +1149,7 @@ def create_domain(domain_data: dict, db: Session = Depends(get_db)):
         db.add(new_domain)
         db.commit()
         db.refresh(new_domain)
+        dependency_graphs.invalidate(new_domain.subject)
         return {"message": "Domain created successfully", "domain": new_domain}
     except Exception as e:
         db.rollback()
@@ -1461,6 +1169,7 @@ def update_domain(domain_id: int, domain_data: dict, db: Session = Depends(get_d
         domain.display_order = domain_data.get("display_order", domain.display_order)
         
         db.commit()
+        dependency_graphs.invalidate()
         return {"message": "Domain updated successfully", "domain": domain}
     except Exception as e:
         db.rollback()
@@ -1477,6 +1186,7 @@ def delete_domain(domain_id: int, db: Session = Depends(get_db)):
         
         db.delete(domain)
         db.commit()
+        dependency_graphs.invalidate(domain.subject)
         return {"message": "Domain deleted successfully"}
     except Exception as e:
         db.rollback()
@@ -1514,32 +1224,51 @@ class PrerequisitesUpdateRequest(BaseModel):
 
 @app.put("/dependencies/{subject}/{topic_id}/prerequisites")
 def update_topic_prerequisites(subject: str, topic_id: int, prerequisites_update: PrerequisitesUpdateRequest, db: Session = Depends(get_db)):
-    """指定された単元の前提条件を更新"""
-    from sqlalchemy import text
+    """指定された単元の前提条件を更新（前提関係の辺を置き換える）"""
     try:
-        if subject.lower() == "math":
-            # math_dependenciesテーブルの前提条件を更新
-            prerequisites_str = ';'.join(prerequisites_update.prerequisites) if prerequisites_update.prerequisites else None
-            db.execute(text('UPDATE math_dependencies SET prerequisite_topics = :prerequisites WHERE id = :topic_id'), 
-                      {"prerequisites": prerequisites_str, "topic_id": topic_id})
-        elif subject.lower() == "science":
-            # science_dependenciesテーブルの前提条件を更新
-            prerequisites_str = ';'.join(prerequisites_update.prerequisites) if prerequisites_update.prerequisites else None
-            db.execute(text('UPDATE science_dependencies SET prerequisite_topics = :prerequisites WHERE id = :topic_id'), 
-                      {"prerequisites": prerequisites_str, "topic_id": topic_id})
-        elif subject.lower() == "social":
-            # social_dependenciesテーブルの前提条件を更新
-            prerequisites_str = ';'.join(prerequisites_update.prerequisites) if prerequisites_update.prerequisites else None
-            db.execute(text('UPDATE social_dependencies SET prerequisite_topics = :prerequisites WHERE id = :topic_id'), 
-                      {"prerequisites": prerequisites_str, "topic_id": topic_id})
-        else:
-            raise HTTPException(status_code=400, detail=f"Invalid subject: {subject}")
+        try:
+            set_prerequisites(db, subject, topic_id, prerequisites_update.prerequisites)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
         
         db.commit()
+        dependency_graphs.invalidate(subject)
         return {"message": "Prerequisites updated successfully"}
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         print(f"Error updating prerequisites: {e}")
         return {"error": f"Failed to update prerequisites: {str(e)}"}
 
+@app.post("/dependencies/{subject}/{topic_id}/prerequisites/{prerequisite_id}")
+def add_topic_prerequisite(subject: str, topic_id: int, prerequisite_id: int, response: Response, db: Session = Depends(get_db)):
+    """前提関係を1件追加（prerequisite_id の単元を topic_id の単元の前提にする）"""
+    try:
+        created = add_prerequisite(db, subject, topic_id, prerequisite_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    db.commit()
+    dependency_graphs.invalidate(subject)
+    response.status_code = 201 if created else 200
+    return {"subject": subject.lower(), "topic_id": topic_id, "prerequisite_id": prerequisite_id, "created": created}
+
+@app.delete("/dependencies/{subject}/{topic_id}/prerequisites/{prerequisite_id}")
+def remove_topic_prerequisite(subject: str, topic_id: int, prerequisite_id: int, db: Session = Depends(get_db)):
+    """前提関係を1件削除"""
+    try:
+        deleted = remove_prerequisite(db, subject, topic_id, prerequisite_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Prerequisite edge not found")
+    db.commit()
+    dependency_graphs.invalidate(subject)
+    return {"subject": subject.lower(), "topic_id": topic_id, "prerequisite_id": prerequisite_id, "deleted": True}
+
 
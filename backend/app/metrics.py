@@ -0,0 +1,239 @@
+"""アプリケーションメトリクス（Prometheusテキスト形式）
+
+外部サービスやライブラリなしで /metrics から以下を返す。
+- ルート（パステンプレート）別のリクエスト数・レイテンシのヒストグラム、処理中リクエスト数
+- DB接続プール・分析ジョブキュー・キャッシュのヒット率（スクレイプ時に collector で取得）
+- OCRのページ数・処理時間、LLM呼び出しのレイテンシとトークン数
+メトリクスはプロセスごとに保持する（複数ワーカー構成ではワーカーごとの値になる）。
+"""
+import math
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .event_log import log_event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not labelnames:
+            # ラベルなしのメトリクスは最初から0を出力する
+            self._values[()] = 0.0
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [バケットごとの件数, 合計, 件数]
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, collect: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]) -> Callable:
+        """スクレイプ時に値を取得するメトリクスを登録する
+
+        collect() は (名前, 種類, 説明, [(ラベル, 値), ...]) を返す。
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        """テキスト形式（text/plain; version=0.0.4）で出力する"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                log_event("metrics_collect_failed", level="error", collector=getattr(collect, "__name__", repr(collect)),
+                          error=str(e))
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+http_requests_total = metrics.counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+http_request_duration_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+http_requests_in_flight = metrics.gauge(
+    "http_requests_in_flight", "HTTP requests currently being processed", ("method",))
+
+ocr_pages_total = metrics.counter("ocr_pages_total", "PDF pages processed by OCR")
+ocr_seconds_total = metrics.counter("ocr_seconds_total", "Wall-clock seconds spent on PDF OCR")
+ocr_pages_per_second = metrics.gauge("ocr_pages_per_second", "OCR throughput of the most recent PDF")
+
+llm_request_duration_seconds = metrics.histogram(
+    "llm_request_duration_seconds", "LLM API call latency", ("model", "outcome"), LLM_BUCKETS)
+llm_tokens_total = metrics.counter("llm_tokens_total", "LLM tokens reported by response.usage", ("model", "kind"))
+
+analysis_jobs_total = metrics.counter("analysis_jobs_total", "Finished analysis jobs", ("outcome",))
+
+
+def record_ocr(pages: int, elapsed: float) -> None:
+    ocr_pages_total.inc(pages)
+    ocr_seconds_total.inc(elapsed)
+    if elapsed > 0:
+        ocr_pages_per_second.set(pages / elapsed)
+
+
+def record_llm_call(model: str, elapsed: float, usage=None, outcome: str = "ok") -> None:
+    """LLM呼び出しの所要時間と response.usage のトークン数を記録する"""
+    llm_request_duration_seconds.observe(elapsed, model=model, outcome=outcome)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            llm_tokens_total.inc(tokens, model=model, kind=kind.replace("_tokens", ""))
+
+
+class MetricsMiddleware:
+    """リクエストごとのレイテンシをルートのパステンプレート単位で記録する"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method=method)
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started
+            http_requests_in_flight.dec(method=method)
+            # ルーティング後に FastAPI が scope["route"] を設定する（未一致はまとめて集計）
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_request_duration_seconds.observe(elapsed, method=method, route=route_path)
+            http_requests_total.inc(method=method, route=route_path, status=status["code"])
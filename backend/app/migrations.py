@@ -0,0 +1,367 @@
+"""バージョン付きスキーママイグレーション
+
+適用済みのバージョンを schema_version テーブルに記録し、未適用のマイグレーションだけを
+1回ずつ、それぞれ1トランザクションで実行する。複数のレプリカが同時に起動しても
+二重に実行しないよう、実行中はロックを取る（PostgreSQLはアドバイザリロック、
+SQLiteはDBファイル横のロックファイル）。
+
+起動時は check_schema() でバージョンを1回確認するだけにする。
+未適用のものがあれば MIGRATE_ON_BOOT=1（既定）のときだけ起動時に適用し、
+0 の場合はデプロイ手順で `python -m app.migrations` を実行する。
+
+    cd backend
+    python -m app.migrations            # 未適用のマイグレーションを適用
+    python -m app.migrations --status   # 現在のバージョンと未適用の一覧
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import (
+    Column, DateTime, Float, Index, Integer, MetaData, String, Table, Text, func, inspect, insert, select, text,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from .db import Base
+from . import models  # noqa: F401  Base.metadata にテーブルを登録する
+from . import migrations_baseline as baseline
+
+MIGRATE_ON_BOOT = os.getenv("MIGRATE_ON_BOOT", "1") == "1"
+# テーブル再作成時に1回のINSERT ... SELECTでコピーする行数
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+# pg_advisory_lock のキー（このアプリのマイグレーション専用）
+MIGRATION_LOCK_KEY = 0x7A65726F
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False, server_default=func.now()),
+    Column("duration_ms", Integer, nullable=True),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+class SchemaOutdatedError(Exception):
+    pass
+
+
+def rebuild_table(conn: Connection, table: Table, defaults: Optional[Dict[str, object]] = None,
+                  batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """テーブルをモデルの定義で作り直し、既存の行をidの範囲ごとにコピーする（SQLite用）
+
+    SQLiteはALTER TABLEでの列の削除・制約の変更に制限があるため、旧テーブルを退避して
+    新しいテーブルを作成し、INSERT ... SELECT でまとめてコピーする（行をPythonに読み込まない）。
+    旧テーブルにない列は defaults の値で埋める。コピーした行数を返す。
+    """
+    defaults = defaults or {}
+    old_name = f"{table.name}__old"
+    old_columns = {column["name"] for column in inspect(conn).get_columns(table.name)}
+
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+    # インデックスは旧テーブルに付いたまま名前が残るため、新しいテーブルを作る前に削除する
+    for (index_name,) in conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"
+    ), {"table": old_name}):
+        conn.execute(text(f'DROP INDEX "{index_name}"'))
+    table.create(conn)
+
+    target_columns = []
+    source_values = []
+    params = {}
+    for column in table.columns:
+        if column.name in old_columns:
+            target_columns.append(column.name)
+            source_values.append(column.name)
+        elif column.name in defaults:
+            target_columns.append(column.name)
+            source_values.append(f":default_{column.name}")
+            params[f"default_{column.name}"] = defaults[column.name]
+
+    copy = text(
+        f"INSERT INTO {table.name} ({', '.join(target_columns)}) "
+        f"SELECT {', '.join(source_values)} FROM {old_name} WHERE id > :low AND id <= :high"
+    )
+    low, high = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {old_name}")).one()
+    copied = 0
+    if low is not None:
+        for start in range(low - 1, high, batch_size):
+            copied += conn.execute(copy, {**params, "low": start, "high": start + batch_size}).rowcount
+    conn.execute(text(f"DROP TABLE {old_name}"))
+    print(f"✅ Rebuilt {table.name} ({copied} rows)")
+    return copied
+
+
+# --- マイグレーション（追加のみ。適用済みのものは変更しない） ---
+
+def _baseline(conn: Connection) -> None:
+    """バージョン1時点のテーブルを作成し、既存テーブルに後から追加したNULL許容カラムとインデックスを追加する
+
+    テーブル定義は migrations_baseline に固定したもの（現在のモデルではない）を使い、
+    モデルの変更は2以降のマイグレーションで適用する。
+    このランナー導入前に create_all で作られたDBもそのまま取り込めるようにする。
+    """
+    existing_tables = set(inspect(conn).get_table_names())
+    baseline.metadata.create_all(conn)
+    inspector = inspect(conn)
+    for table in baseline.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            print(f"✅ Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _drop_next_topics_columns(conn: Connection) -> None:
+    """依存関係テーブルから next_topic(s) 列を削除する"""
+    tables = {
+        "math_dependencies": "next_topic",
+        "science_dependencies": "next_topics",
+        "social_dependencies": "next_topics",
+    }
+    if conn.dialect.name != "sqlite":
+        for table_name, column_name in tables.items():
+            conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN IF EXISTS {column_name}"))
+        return
+
+    inspector = inspect(conn)
+    for table_name, column_name in tables.items():
+        columns = {column["name"] for column in inspector.get_columns(table_name)}
+        if column_name in columns:
+            # 算数の domain 列は後から追加されたため、古いテーブルでは既定値で埋める
+            rebuild_table(conn, baseline.metadata.tables[table_name], defaults={"domain": "数と計算"})
+
+
+# 2以降のマイグレーションで作成するテーブル（適用時点の定義を固定したもの。モデルを変更しても
+# ここは変更しない）。既存テーブルへのインデックス・列の追加もDDLを固定して書く
+frozen = MetaData()
+
+_topic_edges_table = Table(
+    "topic_edges", frozen,
+    Column("subject", String(16), primary_key=True),
+    Column("from_id", Integer, primary_key=True),
+    Column("to_id", Integer, primary_key=True),
+    Index("ix_topic_edges_subject_to_from", "subject", "to_id", "from_id"),
+)
+
+
+def _topic_edges(conn: Connection) -> None:
+    """前提関係を topic_edges に正規化し、旧列の単元名から辺を作成する"""
+    from .topic_edges import backfill_edges
+
+    _topic_edges_table.create(conn, checkfirst=True)
+    for subject in ("math", "science", "social"):
+        # 前提単元名→idの解決に使う topic_name のインデックス
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{subject}_dependencies_topic_name ON {subject}_dependencies (topic_name)"
+        ))
+        print(f"✅ Backfilled {backfill_edges(conn, subject)} {subject} topic edges")
+
+
+def _mastery_difficulty(conn: Connection) -> None:
+    """FSRSの難易度を保存する mastery.difficulty 列を追加する（既存の行は空のまま）"""
+    columns = {column["name"] for column in inspect(conn).get_columns("mastery")}
+    if "difficulty" not in columns:
+        conn.execute(text("ALTER TABLE mastery ADD COLUMN difficulty FLOAT"))
+
+
+_mastery_versions_table = Table(
+    "mastery_versions", frozen,
+    Column("user_id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def _mastery_versions(conn: Connection) -> None:
+    """復習キューの鮮度確認用の mastery_versions テーブルを作成する"""
+    _mastery_versions_table.create(conn, checkfirst=True)
+
+
+def _questions_topic_index(conn: Connection) -> None:
+    """弱点単元からの出題用の (subject, topic, id) インデックスを作成する"""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_subject_topic_id ON questions (subject, topic, id)"
+    ))
+
+
+_user_topic_stats_table = Table(
+    "user_topic_stats", frozen,
+    Column("user_id", Integer, primary_key=True),
+    Column("subject", String, primary_key=True),
+    Column("topic", String, primary_key=True),
+    Column("attempts", Integer, nullable=False),
+    Column("correct", Integer, nullable=False),
+    Column("seconds_total", Integer, nullable=False),
+    Column("seconds_count", Integer, nullable=False),
+    Column("mastery_count", Integer, nullable=False),
+    Column("mastery_sum", Float, nullable=False),
+    Column("updated_at", DateTime(timezone=True), nullable=True),
+)
+
+
+def _user_topic_stats(conn: Connection) -> None:
+    """単元別の集計テーブル user_topic_stats を作成し、解答履歴とMasteryから作成する"""
+    from .topic_stats import rebuild_topic_stats
+
+    _user_topic_stats_table.create(conn, checkfirst=True)
+    print(f"✅ Backfilled {rebuild_topic_stats(conn)['rows']} user topic stats")
+
+
+_TEST_RESULT_ANALYSIS_COLUMNS = [
+    Column("overall_analysis", Text, nullable=True),
+    Column("analysis_method", String, nullable=True),
+    Column("analysis_error", Text, nullable=True),
+    Column("analysis_updated_at", DateTime(timezone=True), nullable=True),
+]
+
+
+def _test_result_analysis_columns(conn: Connection) -> None:
+    """分析結果の総評・失敗理由・状態の更新時刻を test_results に保存する列を追加する"""
+    columns = {column["name"] for column in inspect(conn).get_columns("test_results")}
+    for column in _TEST_RESULT_ANALYSIS_COLUMNS:
+        if column.name not in columns:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE test_results ADD COLUMN {column.name} {column_type}"))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "drop next_topics columns", _drop_next_topics_columns),
+    Migration(3, "topic_edges", _topic_edges),
+    Migration(4, "mastery difficulty", _mastery_difficulty),
+    Migration(5, "mastery_versions", _mastery_versions),
+    Migration(6, "questions topic index", _questions_topic_index),
+    Migration(7, "user_topic_stats", _user_topic_stats),
+    Migration(8, "test_results analysis columns", _test_result_analysis_columns),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """マイグレーション中のロック（他のレプリカは解放されるまで待つ）"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+    elif engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        import fcntl
+        with open(f"{engine.url.database}.migrate.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+def current_version(engine: Engine) -> int:
+    """適用済みの最新バージョン（schema_version がなければ0）"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+        except DBAPIError:
+            conn.rollback()
+            if inspect(conn).has_table(schema_version.name):
+                raise
+            return 0
+
+
+def applied_versions(engine: Engine) -> List[Dict]:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(schema_version.name):
+            return []
+        rows = conn.execute(select(schema_version).order_by(schema_version.c.version)).mappings()
+        return [dict(row) for row in rows]
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    applied = {row["version"] for row in applied_versions(engine)}
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """未適用のマイグレーションをロックを取って順に適用し、適用したバージョンを返す"""
+    applied = []
+    with migration_lock(engine):
+        schema_version.create(engine, checkfirst=True)
+        # ロック待ちの間に他のレプリカが適用した分は除く
+        for migration in pending_migrations(engine):
+            started = time.perf_counter()
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+                conn.execute(insert(schema_version).values(
+                    version=migration.version,
+                    name=migration.name,
+                    applied_at=datetime.now(),
+                    duration_ms=int((time.perf_counter() - started) * 1000)
+                ))
+            print(f"✅ Applied migration {migration.version}: {migration.name}")
+            applied.append(migration.version)
+    return applied
+
+
+def check_schema(engine: Engine, apply: bool = MIGRATE_ON_BOOT) -> int:
+    """起動時のバージョン確認（最新ならクエリ1回で終わる）
+
+    古い場合は apply=True なら適用し、False なら SchemaOutdatedError を送出する。
+    """
+    version = current_version(engine)
+    if version >= LATEST_VERSION:
+        return version
+    if not apply:
+        raise SchemaOutdatedError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}. Run `python -m app.migrations`."
+        )
+    upgrade(engine)
+    return current_version(engine)
+
+
+def drop_schema(engine: Engine) -> None:
+    """すべてのテーブルと schema_version を削除する（ベンチマーク・検証用DBのリセット用）"""
+    Base.metadata.drop_all(bind=engine)
+    schema_version.drop(engine, checkfirst=True)
+
+
+def main() -> None:
+    from .db import engine
+
+    parser = argparse.ArgumentParser(description="スキーママイグレーションの適用")
+    parser.add_argument("--status", action="store_true", help="適用状況を表示するだけで適用しない")
+    args = parser.parse_args()
+
+    if args.status:
+        for row in applied_versions(engine):
+            print(f"{row['version']:>4}  {row['name']:<40} {row['applied_at']}  {row['duration_ms']}ms")
+        for migration in pending_migrations(engine):
+            print(f"{migration.version:>4}  {migration.name:<40} (pending)")
+        return
+
+    applied = upgrade(engine)
+    print(f"Schema version {current_version(engine)} ({len(applied)} migration(s) applied)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""マイグレーション1（baseline）時点のスキーマ
+
+マイグレーションの導入時（バージョン1）のテーブル定義を固定したもの。models.py を変更しても
+ここは変更しない（変更はマイグレーションを追加して行う）。新しいDBはこの定義で作成してから
+2以降のマイグレーションを順に適用するため、どのDBも同じ手順で最新のスキーマになる。
+"""
+from sqlalchemy import (
+    JSON, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text, func,
+)
+
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("role", String),
+    Column("parent_id", Integer, ForeignKey("users.id"), nullable=True),
+    Column("grade", Integer),
+)
+
+Table(
+    "skills", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, index=True),
+    Column("subject", String),
+    Column("grade", Integer),
+    Column("prerequisites", JSON),
+)
+
+Table(
+    "questions", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("subject", String),
+    Column("topic", String),
+    Column("stem", Text),
+    Column("assets", JSON, nullable=True),
+    Column("choices", JSON, nullable=True),
+    Column("answer", JSON),
+    Column("explanation", Text, nullable=True),
+    Column("difficulty", Float),
+    Column("source", String, nullable=True),
+    Column("school", String, nullable=True),
+    Column("year", Integer, nullable=True),
+    Column("meta", JSON, nullable=True),
+    Index("ix_questions_subject_id", "subject", "id"),
+)
+
+Table(
+    "attempts", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("question_id", Integer, ForeignKey("questions.id")),
+    Column("correct", Boolean),
+    Column("seconds", Integer, nullable=True),
+    Column("cause", String, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "mastery", metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("question_id", Integer, ForeignKey("questions.id"), primary_key=True),
+    Column("value", Float),
+    Column("consecutive_correct", Integer),
+    Column("stability", Float),
+    Column("last_review_at", DateTime(timezone=True), nullable=True),
+    Column("next_review_at", DateTime(timezone=True), nullable=True),
+    Index("ix_mastery_user_next_review", "user_id", "next_review_at"),
+)
+
+Table(
+    "math_topics", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, unique=True, index=True),
+    Column("difficulty", String),
+)
+
+Table(
+    "science_topics", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("domain", String(32), nullable=False),
+    Column("name", String(255), nullable=False),
+    Column("difficulty", String(16), nullable=False),
+)
+
+Table(
+    "social_topics", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("domain", String(32), nullable=False),
+    Column("name", String(255), nullable=False),
+    Column("difficulty", String(16), nullable=False),
+)
+
+Table(
+    "math_dependencies", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("domain", String(32), nullable=False),
+    Column("topic_name", String(255), nullable=False),
+    Column("prerequisite_topic", String(255), nullable=True),
+    Column("topic_id", Integer, ForeignKey("math_topics.id"), nullable=True),
+)
+
+Table(
+    "science_dependencies", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("domain", String(32), nullable=False),
+    Column("topic_name", String(255), nullable=False),
+    Column("prerequisite_topics", Text, nullable=True),
+    Column("topic_id", Integer, ForeignKey("science_topics.id"), nullable=True),
+)
+
+Table(
+    "social_dependencies", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("domain", String(32), nullable=False),
+    Column("topic_name", String(255), nullable=False),
+    Column("prerequisite_topics", Text, nullable=True),
+    Column("topic_id", Integer, ForeignKey("social_topics.id"), nullable=True),
+)
+
+Table(
+    "test_results", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer),
+    Column("subject", String),
+    Column("test_name", String),
+    Column("test_date", DateTime(timezone=True), server_default=func.now()),
+    Column("total_score", Integer),
+    Column("max_score", Integer),
+    Column("score_percentage", Float),
+    Column("file_path", String, nullable=True),
+    Column("analysis_status", String),
+    Column("analysis_cache_id", Integer, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_test_results_user_created", "user_id", "created_at", "id"),
+)
+
+Table(
+    "test_result_details", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("test_result_id", Integer, ForeignKey("test_results.id"), index=True),
+    Column("topic", String),
+    Column("correct_count", Integer),
+    Column("total_count", Integer),
+    Column("score_percentage", Float),
+    Column("weakness_analysis", Text, nullable=True),
+    Column("improvement_advice", Text, nullable=True),
+)
+
+Table(
+    "analysis_cache", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("content_hash", String(64), nullable=False, unique=True, index=True),
+    Column("file_ext", String(16), nullable=False),
+    Column("source_bytes", Integer, nullable=False),
+    Column("blob_bytes", Integer, nullable=False),
+    Column("analysis_method", String, nullable=True),
+    Column("hit_count", Integer),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("last_used_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "domain_master", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("subject", String(32), nullable=False),
+    Column("domain", String(255), nullable=False),
+    Column("display_order", Integer, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
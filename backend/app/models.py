@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, JSON, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship, Mapped
 from typing import Optional
@@ -35,6 +35,13 @@ class Question(Base):
     year: Mapped[Optional[int]] = Column(Integer, nullable=True)
     meta: Mapped[Optional[dict]] = Column(JSON, nullable=True) # For specific question types (e.g., kanji_read, homophone)
 
+    __table_args__ = (
+        # 科目別のランダム抽出（id範囲サンプリング）用
+        Index("ix_questions_subject_id", "subject", "id"),
+        # 弱点単元からのランダム抽出用
+        Index("ix_questions_subject_topic_id", "subject", "topic", "id"),
+    )
+
 class Attempt(Base):
     __tablename__ = "attempts"
     id: Mapped[int] = Column(Integer, primary_key=True, index=True)
@@ -54,13 +61,39 @@ class Mastery(Base):
     question_id: Mapped[int] = Column(Integer, ForeignKey("questions.id"), primary_key=True) # Or skill_id
     value: Mapped[float] = Column(Float, default=0.0) # 0.0 to 1.0
     consecutive_correct: Mapped[int] = Column(Integer, default=0)
-    stability: Mapped[float] = Column(Float, default=1.0) # FSRS-like stability factor
+    stability: Mapped[float] = Column(Float, default=1.0) # FSRS stability（想起率が90%になるまでの日数）
+    difficulty: Mapped[Optional[float]] = Column(Float, nullable=True) # FSRS difficulty（1〜10）
     last_review_at: Mapped[Optional[DateTime]] = Column(DateTime(timezone=True), nullable=True)
     next_review_at: Mapped[Optional[DateTime]] = Column(DateTime(timezone=True), nullable=True)
 
     user = relationship("User")
     question = relationship("Question")
 
+    __table_args__ = (
+        # 復習キュー（user_idごとのnext_review_at順）用
+        Index("ix_mastery_user_next_review", "user_id", "next_review_at"),
+    )
+
+class MasteryVersion(Base):
+    """ユーザーのMasteryが更新されるたびに上がる番号（プロセス内の復習キューの鮮度確認用）"""
+    __tablename__ = "mastery_versions"
+    user_id: Mapped[int] = Column(Integer, primary_key=True)
+    version: Mapped[int] = Column(Integer, nullable=False, default=0)
+
+class UserTopicStat(Base):
+    """ユーザー×単元の集計（採点のたびに加算で更新。python -m app.topic_stats で解答履歴から作り直す）"""
+    __tablename__ = "user_topic_stats"
+    user_id: Mapped[int] = Column(Integer, primary_key=True)
+    subject: Mapped[str] = Column(String, primary_key=True)
+    topic: Mapped[str] = Column(String, primary_key=True)
+    attempts: Mapped[int] = Column(Integer, nullable=False, default=0)
+    correct: Mapped[int] = Column(Integer, nullable=False, default=0)
+    seconds_total: Mapped[int] = Column(Integer, nullable=False, default=0)
+    seconds_count: Mapped[int] = Column(Integer, nullable=False, default=0) # 解答時間が記録された解答数
+    mastery_count: Mapped[int] = Column(Integer, nullable=False, default=0) # Masteryのある問題数
+    mastery_sum: Mapped[float] = Column(Float, nullable=False, default=0.0) # Mastery.value の合計
+    updated_at: Mapped[Optional[DateTime]] = Column(DateTime(timezone=True), nullable=True)
+
 class MathTopic(Base):
     __tablename__ = "math_topics"
     id: Mapped[int] = Column(Integer, primary_key=True, index=True)
@@ -85,7 +118,7 @@ class MathDependency(Base):
     __tablename__ = "math_dependencies"
     id: Mapped[int] = Column(Integer, primary_key=True)
     domain: Mapped[str] = Column(String(32), nullable=False)  # 数と計算/図形/量と測定/数量関係/総合
-    topic_name: Mapped[str] = Column(String(255), nullable=False)  # 単元名
+    topic_name: Mapped[str] = Column(String(255), nullable=False, index=True)  # 単元名
     prerequisite_topic: Mapped[Optional[str]] = Column(String(255), nullable=True)  # 前提単元（NULL=前提なし）
     topic_id: Mapped[Optional[int]] = Column(Integer, ForeignKey("math_topics.id"), nullable=True)  # math_topicsとの紐付け
 
@@ -96,7 +129,7 @@ class ScienceDependency(Base):
     __tablename__ = "science_dependencies"
     id: Mapped[int] = Column(Integer, primary_key=True)
     domain: Mapped[str] = Column(String(32), nullable=False)  # 物理/化学/生物/地学/総合
-    topic_name: Mapped[str] = Column(String(255), nullable=False)  # 単元名
+    topic_name: Mapped[str] = Column(String(255), nullable=False, index=True)  # 単元名
     prerequisite_topics: Mapped[Optional[str]] = Column(Text, nullable=True)  # 前提単元（セミコロン区切り、NULL=前提なし）
     topic_id: Mapped[Optional[int]] = Column(Integer, ForeignKey("science_topics.id"), nullable=True)  # science_topicsとの紐付け
 
@@ -113,13 +146,29 @@ class SocialDependency(Base):
     __tablename__ = "social_dependencies"
     id: Mapped[int] = Column(Integer, primary_key=True)
     domain: Mapped[str] = Column(String(32), nullable=False)  # 地理/歴史/公民/総合
-    topic_name: Mapped[str] = Column(String(255), nullable=False)  # 単元名
+    topic_name: Mapped[str] = Column(String(255), nullable=False, index=True)  # 単元名
     prerequisite_topics: Mapped[Optional[str]] = Column(Text, nullable=True)  # 前提単元（セミコロン区切り、NULL=前提なし）
     topic_id: Mapped[Optional[int]] = Column(Integer, ForeignKey("social_topics.id"), nullable=True)  # social_topicsとの紐付け
 
     # リレーション
     social_topic = relationship("SocialTopic", back_populates="dependencies")
 
+class TopicEdge(Base):
+    """単元の前提関係（from_id の単元が to_id の単元の前提）
+
+    from_id / to_id は科目ごとの依存関係テーブル（math_dependencies 等）のid。
+    主キーが後続単元の検索、ix_topic_edges_subject_to_from が前提単元の検索を
+    それぞれテーブルを読まずにインデックスだけで処理する。
+    """
+    __tablename__ = "topic_edges"
+    subject: Mapped[str] = Column(String(16), primary_key=True)  # math/science/social
+    from_id: Mapped[int] = Column(Integer, primary_key=True)  # 前提単元
+    to_id: Mapped[int] = Column(Integer, primary_key=True)  # 後続単元
+
+    __table_args__ = (
+        Index("ix_topic_edges_subject_to_from", "subject", "to_id", "from_id"),
+    )
+
 class TestResult(Base):
     __tablename__ = "test_results"
     id: Mapped[int] = Column(Integer, primary_key=True, index=True)
@@ -132,15 +181,25 @@ class TestResult(Base):
     score_percentage: Mapped[float] = Column(Float)  # 正答率
     file_path: Mapped[Optional[str]] = Column(String, nullable=True)  # アップロードファイルのパス
     analysis_status: Mapped[str] = Column(String, default="pending")  # pending, processing, completed, failed
+    analysis_cache_id: Mapped[Optional[int]] = Column(Integer, nullable=True)  # 同一ファイルの分析結果を再利用した場合のanalysis_cache.id
+    overall_analysis: Mapped[Optional[str]] = Column(Text, nullable=True)  # AIの総評（どのワーカーからも返せるよう行に保存）
+    analysis_method: Mapped[Optional[str]] = Column(String, nullable=True)
+    analysis_error: Mapped[Optional[str]] = Column(Text, nullable=True)  # failed の理由
+    analysis_updated_at: Mapped[Optional[DateTime]] = Column(DateTime(timezone=True), nullable=True)  # 状態を最後に更新した時刻（中断の検出用）
     created_at: Mapped[DateTime] = Column(DateTime(timezone=True), server_default=func.now())
     
     # リレーション（userリレーションを削除）
-    details = relationship("TestResultDetail", back_populates="test_result")
+    details = relationship("TestResultDetail", back_populates="test_result", order_by="TestResultDetail.id")
+
+    __table_args__ = (
+        # ユーザー別一覧（新しい順）のキーセットページング用
+        Index("ix_test_results_user_created", "user_id", "created_at", "id"),
+    )
 
 class TestResultDetail(Base):
     __tablename__ = "test_result_details"
     id: Mapped[int] = Column(Integer, primary_key=True, index=True)
-    test_result_id: Mapped[int] = Column(Integer, ForeignKey("test_results.id"))
+    test_result_id: Mapped[int] = Column(Integer, ForeignKey("test_results.id"), index=True)
     topic: Mapped[str] = Column(String)  # 単元名
     correct_count: Mapped[int] = Column(Integer)  # 正解数
     total_count: Mapped[int] = Column(Integer)  # 問題数
@@ -154,6 +213,18 @@ class TestResultDetail(Base):
 # SocialTopicにリレーションを追加
 SocialTopic.dependencies = relationship("SocialDependency", back_populates="social_topic")
 
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+    id: Mapped[int] = Column(Integer, primary_key=True, index=True)
+    content_hash: Mapped[str] = Column(String(64), nullable=False, unique=True, index=True)  # アップロードファイルのSHA-256
+    file_ext: Mapped[str] = Column(String(16), nullable=False)
+    source_bytes: Mapped[int] = Column(Integer, nullable=False)  # アップロードファイルのサイズ
+    blob_bytes: Mapped[int] = Column(Integer, nullable=False)  # 保存した分析結果（ディスク上）のサイズ
+    analysis_method: Mapped[Optional[str]] = Column(String, nullable=True)
+    hit_count: Mapped[int] = Column(Integer, default=0)
+    created_at: Mapped[DateTime] = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at: Mapped[DateTime] = Column(DateTime(timezone=True), server_default=func.now())
+
 class DomainMaster(Base):
     __tablename__ = "domain_master"
     id: Mapped[int] = Column(Integer, primary_key=True, index=True)
@@ -0,0 +1,108 @@
+"""リクエストごとのDBクエリ計測
+
+SQLAlchemyの before_cursor_execute / after_cursor_execute でリクエスト単位に
+クエリ数・DB時間・行数を集計し、レスポンスの Server-Timing ヘッダーで返す。
+クエリ数が DB_QUERY_WARN_THRESHOLD を超えたリクエストは警告を出す（N+1の検出用）。
+行数はORMでロードしたインスタンス数と、更新系の影響行数の合計。
+"""
+import os
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from .event_log import log_event
+
+DB_QUERY_WARN_THRESHOLD = int(os.getenv("DB_QUERY_WARN_THRESHOLD", "20"))
+
+
+class QueryStats:
+    __slots__ = ("queries", "db_time", "rows")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries, {self.rows} rows"'
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    """実行中のリクエストの計測値（リクエスト外ではNone）"""
+    return _current_stats.get()
+
+
+def install_query_stats(engine) -> None:
+    """エンジンのクエリを計測対象にする（非同期エンジンは sync_engine を渡す）"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_stats.get() is not None:
+            conn.info.setdefault("query_started_at", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        started = conn.info.get("query_started_at")
+        if stats is None or not started:
+            return
+        stats.db_time += perf_counter() - started.pop()
+        stats.queries += 1
+        # SELECTの行はORMのロード数（install_row_counter）で数える。psycopg2 は SELECT でも
+        # rowcount に返した行数を入れるため、更新系のみ影響行数を加える
+        if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+            stats.rows += max(cursor.rowcount, 0)
+
+    @event.listens_for(engine, "handle_error")
+    def _discard_failed_query(exception_context):
+        # 失敗したクエリは after_cursor_execute が呼ばれないため開始時刻を捨てる
+        connection = exception_context.connection
+        started = connection.info.get("query_started_at") if connection is not None else None
+        if started:
+            started.pop()
+
+
+def install_row_counter(base) -> None:
+    """ORMでロードしたインスタンス数を行数として数える"""
+
+    @event.listens_for(base, "load", propagate=True)
+    def _count_loaded_row(target, context):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.rows += 1
+
+
+class QueryStatsMiddleware:
+    """リクエストごとの計測を開始し、Server-Timing ヘッダーを付ける"""
+
+    def __init__(self, app, warn_threshold: int = DB_QUERY_WARN_THRESHOLD):
+        self.app = app
+        self.warn_threshold = warn_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_stats.reset(token)
+            if stats.queries > self.warn_threshold:
+                # N+1の可能性がある
+                log_event("too_many_queries", level="warning", method=scope["method"], path=scope["path"],
+                          queries=stats.queries, db_ms=round(stats.db_time * 1000, 1))
@@ -0,0 +1,132 @@
+"""解答履歴からのMasteryの一括再計算
+
+重みを変えたとき（fsrs_params.json の更新）などに、Attemptの履歴を最初から再生して
+stability / difficulty / value / next_review_at を求め直す。ユーザーを RESCHEDULE_USER_BATCH 人ずつ
+区切り、解答履歴を1回のクエリで読み込んで Scheduler.replay（NumPy）で全系列をまとめて計算し、
+Masteryを一括upsertし、単元別の集計（user_topic_stats）も作り直してコミットする。
+解答履歴のない Mastery 行は変更しない。
+
+    cd backend
+    python -m app.reschedule --all
+    python -m app.reschedule --users 1,2,3
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .due_queue import bump_mastery_versions, due_queues
+from .fsrs import Scheduler, np, scheduler as default_scheduler
+from .grading import upsert_mastery_rows
+from .models import Attempt
+from .topic_stats import rebuild_topic_stats
+
+# 1回に解答履歴を読み込むユーザー数（IN句の大きさとメモリ使用量の上限）
+RESCHEDULE_USER_BATCH = int(os.getenv("RESCHEDULE_USER_BATCH", "1000"))
+
+
+def load_attempts(db: Session, user_ids: Sequence[int]) -> Dict:
+    """ユーザーの解答履歴を (ユーザー, 問題, 解答時刻, id) 順の配列で返す"""
+    rows = db.execute(
+        select(Attempt.id, Attempt.user_id, Attempt.question_id, Attempt.correct, Attempt.created_at)
+        .where(Attempt.user_id.in_(user_ids), Attempt.correct.isnot(None), Attempt.created_at.isnot(None))
+    ).all()
+    if not rows:
+        return {"user_id": np.zeros(0, dtype=np.int64), "question_id": np.zeros(0, dtype=np.int64),
+                "correct": np.zeros(0, dtype=bool), "timestamp": np.zeros(0)}
+    ids, users, questions, correct, created = zip(*rows)
+    ids = np.array(ids, dtype=np.int64)
+    users = np.array(users, dtype=np.int64)
+    questions = np.array(questions, dtype=np.int64)
+    timestamps = np.fromiter((value.timestamp() for value in created), dtype=np.float64, count=len(created))
+    order = np.lexsort((ids, timestamps, questions, users))
+    return {
+        "user_id": users[order],
+        "question_id": questions[order],
+        "correct": np.array(correct, dtype=bool)[order],
+        "timestamp": timestamps[order],
+    }
+
+
+def mastery_rows(attempts: Dict, scheduler: Scheduler) -> List[Dict]:
+    """並べ替えた解答履歴から (ユーザー, 問題) ごとのMastery行を求める"""
+    users = attempts["user_id"]
+    questions = attempts["question_id"]
+    if len(users) == 0:
+        return []
+    changed = np.r_[True, (users[1:] != users[:-1]) | (questions[1:] != questions[:-1])]
+    state = scheduler.replay(np.cumsum(changed), attempts["correct"], attempts["timestamp"])
+    first = state["first"]
+    return [
+        {
+            "user_id": user_id,
+            "question_id": question_id,
+            "value": value,
+            "consecutive_correct": streak,
+            "stability": stability,
+            "difficulty": difficulty,
+            "last_review_at": datetime.fromtimestamp(last),
+            "next_review_at": datetime.fromtimestamp(next_review),
+        }
+        for user_id, question_id, value, streak, stability, difficulty, last, next_review in zip(
+            users[first].tolist(), questions[first].tolist(), state["value"].tolist(),
+            state["consecutive_correct"].tolist(), state["stability"].tolist(), state["difficulty"].tolist(),
+            state["last_review"].tolist(), state["next_review"].tolist()
+        )
+    ]
+
+
+def recompute_mastery(db: Session, user_ids: Optional[Sequence[int]] = None,
+                      scheduler: Optional[Scheduler] = None) -> Dict:
+    """ユーザー（None なら解答履歴のある全ユーザー）のMasteryを解答履歴から再計算する"""
+    scheduler = scheduler or default_scheduler
+    if user_ids is None:
+        user_ids = db.scalars(select(Attempt.user_id).distinct().order_by(Attempt.user_id)).all()
+    user_ids = list(dict.fromkeys(user_ids))
+
+    started = time.perf_counter()
+    attempts = 0
+    rows_written = 0
+    for start in range(0, len(user_ids), RESCHEDULE_USER_BATCH):
+        batch = user_ids[start:start + RESCHEDULE_USER_BATCH]
+        history = load_attempts(db, batch)
+        rows = mastery_rows(history, scheduler)
+        upsert_mastery_rows(db, rows)
+        rebuild_topic_stats(db, batch)
+        bump_mastery_versions(db, batch)
+        db.commit()
+        for user_id in batch:
+            due_queues.invalidate(user_id)
+        attempts += len(history["user_id"])
+        rows_written += len(rows)
+
+    return {
+        "users": len(user_ids),
+        "attempts": attempts,
+        "mastery_rows": rows_written,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main() -> None:
+    from .db import session_scope
+
+    parser = argparse.ArgumentParser(description="解答履歴からMasteryを再計算する")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--all", action="store_true", help="解答履歴のある全ユーザー")
+    target.add_argument("--users", help="ユーザーID（カンマ区切り）")
+    args = parser.parse_args()
+
+    user_ids = None if args.all else [int(value) for value in args.users.split(",") if value.strip()]
+    with session_scope() as db:
+        result = recompute_mastery(db, user_ids)
+    print(f"✅ Rescheduled {result['mastery_rows']} mastery rows from {result['attempts']} attempts "
+          f"({result['users']} users, {result['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""テスト結果一覧の取得
+
+GET /test-results/{user_id} はユーザーのテスト結果を新しい順に返す。
+- 単元別詳細は selectinload でまとめて1クエリで読み込む（結果ごとの追加クエリはしない）
+- test_results(user_id, created_at, id) の索引に沿ったキーセットページング
+  （before=<created_at,id> より古い結果を limit 件）で、件数が増えても1ページのコストは一定
+- fields=summary の場合は分析文（weakness_analysis / improvement_advice）を読み込まない
+- 一覧では返さない分析結果（overall_analysis / analysis_error）は常に読み込まない
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import String, and_, literal, or_, select
+from sqlalchemy.orm import Session, defer, selectinload
+
+from .models import TestResult, TestResultDetail
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# SQLiteで server_default(CURRENT_TIMESTAMP) により保存される日時の書式
+_SQLITE_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def encode_cursor(test_result: TestResult) -> str:
+    """次のページを取得するための before の値"""
+    return f"{test_result.created_at.isoformat()},{test_result.id}"
+
+
+def parse_cursor(value: str) -> Tuple[datetime, int]:
+    """before=<created_at,id> を解釈する（不正な場合は ValueError）"""
+    created_at, _, result_id = value.rpartition(",")
+    try:
+        parsed = datetime.fromisoformat(created_at)
+    except ValueError:
+        # URLエンコードされずにタイムゾーンの + が空白になった場合
+        parsed = datetime.fromisoformat(created_at.replace(" ", "+"))
+    return parsed, int(result_id)
+
+
+def _created_at_bound(db: Session, created_at: datetime):
+    """created_at との比較に使う値
+
+    SQLiteでは日時が文字列で保存されるため、保存時と同じ書式の文字列で比較する
+    （DateTime型のバインドはマイクロ秒付きになり、同じ秒の行と一致しなくなる）。
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        if created_at.tzinfo is not None:
+            created_at = created_at.replace(tzinfo=None)
+        timestamp = created_at.strftime(_SQLITE_TIMESTAMP_FORMAT)
+        if created_at.microsecond:
+            timestamp += f".{created_at.microsecond:06d}"
+        return literal(timestamp, String)
+    return created_at
+
+
+def serialize_detail(detail: TestResultDetail, summary: bool = False) -> Dict:
+    item = {
+        "topic": detail.topic,
+        "correct_count": detail.correct_count,
+        "total_count": detail.total_count,
+        "score_percentage": detail.score_percentage
+    }
+    if not summary:
+        item["weakness_analysis"] = detail.weakness_analysis
+        item["improvement_advice"] = detail.improvement_advice
+    return item
+
+
+def list_test_results(db: Session, user_id: int, before: Optional[Tuple[datetime, int]] = None,
+                      limit: int = DEFAULT_PAGE_SIZE, summary: bool = False) -> Tuple[List[TestResult], bool]:
+    """テスト結果を新しい順に limit 件取得し、(結果, 続きがあるか) を返す"""
+    if summary:
+        details_loader = selectinload(TestResult.details).load_only(
+            TestResultDetail.topic,
+            TestResultDetail.correct_count,
+            TestResultDetail.total_count,
+            TestResultDetail.score_percentage
+        )
+    else:
+        details_loader = selectinload(TestResult.details)
+
+    stmt = select(TestResult).where(TestResult.user_id == user_id)
+    if before is not None:
+        created_at, result_id = before
+        bound = _created_at_bound(db, created_at)
+        stmt = stmt.where(or_(
+            TestResult.created_at < bound,
+            and_(TestResult.created_at == bound, TestResult.id < result_id)
+        ))
+    stmt = stmt.options(
+        details_loader, defer(TestResult.overall_analysis), defer(TestResult.analysis_error)
+    ).order_by(TestResult.created_at.desc(), TestResult.id.desc()).limit(limit + 1)
+
+    test_results = db.scalars(stmt).all()
+    return test_results[:limit], len(test_results) > limit
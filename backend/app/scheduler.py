@@ -0,0 +1,73 @@
+"""出題スケジューラ
+
+/next-question の問題選択をSQL側の索引付きクエリで完結させる。
+復習期限の問題はプロセス内の復習キュー（due_queue）から選び、Masteryへのクエリを省く。
+復習期限の問題がなければ、前提単元へ伝播させた弱点の優先度（weakness）で単元を選ぶ。
+問題数が増えても1リクエストあたりのコストが一定になるよう、
+全件取得やORMの全件ハイドレーションは行わない。
+"""
+import os
+import random
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .models import Question, Mastery
+from .due_queue import due_queues
+from .weakness import weakness_engine
+
+# 期限切れの復習候補から抽選する件数（古い順に最大この件数だけ読む）
+DUE_WINDOW = int(os.getenv("NEXT_QUESTION_DUE_WINDOW", "20"))
+# 復習期限の問題がないとき弱点単元から出題する割合（残りは未学習の単元も含めてランダム）
+WEAKNESS_RATE = float(os.getenv("NEXT_QUESTION_WEAKNESS_RATE", "0.7"))
+
+
+def pick_due_question(db: Session, user_id: int, subject: Optional[str] = None, now: Optional[datetime] = None) -> Optional[Question]:
+    """復習期限を迎えた問題を1問選ぶ（mastery(user_id, next_review_at) を使用）"""
+    now = now or datetime.now()
+    stmt = select(Mastery.question_id).where(
+        Mastery.user_id == user_id,
+        Mastery.next_review_at <= now
+    )
+    if subject:
+        stmt = stmt.join(Question, Question.id == Mastery.question_id).where(Question.subject == subject)
+    stmt = stmt.order_by(Mastery.next_review_at.asc()).limit(DUE_WINDOW)
+
+    due_ids = db.scalars(stmt).all()
+    if not due_ids:
+        return None
+    return db.get(Question, random.choice(due_ids))
+
+
+def sample_question(db: Session, subject: Optional[str] = None) -> Optional[Question]:
+    """問題をランダムに1問選ぶ
+
+    id の最小値・最大値の間で乱数を引き、それ以上の最初の id を索引で取得する。
+    id に欠番がある場合は欠番直後の問題がやや選ばれやすくなるが、
+    テーブル全体を走査する ORDER BY random() より大幅に安い。
+    """
+    bounds = select(func.min(Question.id), func.max(Question.id))
+    if subject:
+        bounds = bounds.where(Question.subject == subject)
+    low, high = db.execute(bounds).one()
+    if low is None:
+        return None
+
+    pivot = random.randint(low, high)
+    stmt = select(Question).where(Question.id >= pivot)
+    if subject:
+        stmt = stmt.where(Question.subject == subject)
+    stmt = stmt.order_by(Question.id.asc()).limit(1)
+    return db.scalars(stmt).first()
+
+
+def select_next_question(db: Session, user_id: int, subject: Optional[str] = None) -> Optional[Question]:
+    """次の問題を選ぶ（復習期限の問題 → 弱点単元の問題 → ランダムの順）"""
+    question = due_queues.pick(db, user_id, subject, DUE_WINDOW)
+    if question is None and random.random() < WEAKNESS_RATE:
+        question = weakness_engine.pick(db, user_id, subject)
+    if question is None:
+        question = sample_question(db, subject)
+    return question
@@ -1,38 +1,77 @@
+"""初期データの投入
+
+各関数は何度実行してもよい（既にある行はON CONFLICT DO NOTHINGで無視する）。
+単元名→IDの対応は1回のSELECTで読み込み、行はテーブルごとに1回のINSERTでまとめて投入する。
+"""
+from typing import Dict, List
+
+from sqlalchemy import insert, select, text
 from sqlalchemy.orm import Session
+from .topic_edges import backfill_edges
 from .models import Question, MathTopic, ScienceTopic, SocialTopic, MathDependency, ScienceDependency, SocialDependency, TestResult, TestResultDetail, DomainMaster
-import json
 from datetime import datetime, timedelta
 
+def _insert_ignore(db: Session, model, rows: List[Dict]) -> None:
+    """主キーが既にある行を無視して一括INSERT（PostgreSQL/SQLiteはON CONFLICT DO NOTHING）"""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        existing = set(db.scalars(select(model.id).where(model.id.in_([row["id"] for row in rows]))))
+        new_rows = [row for row in rows if row["id"] not in existing]
+        if new_rows:
+            db.execute(insert(model), new_rows)
+        return
+
+    db.execute(dialect_insert(model).values(rows).on_conflict_do_nothing())
+    if dialect == "postgresql":
+        # idを指定して投入したため、以降のINSERTと衝突しないようシーケンスを進める
+        table = model.__tablename__
+        db.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+        ))
+
+def _topic_ids(db: Session, topic_model) -> Dict[str, int]:
+    """単元名→IDの対応を1回のSELECTで読み込む"""
+    return dict(db.execute(select(topic_model.name, topic_model.id)).all())
+
+def _math_domain(topic_name: str) -> str:
+    """算数の依存関係のdomainを単元名から決める"""
+    if any(keyword in topic_name for keyword in ["割合", "速さ", "比", "百分率", "歩合", "旅人算", "通過算", "追いつき算", "時計算", "流水算", "ダイヤグラム"]):
+        return "数量関係"
+    if any(keyword in topic_name for keyword in ["図形", "三角形", "四角形", "多角形", "円", "角度", "垂直", "平行", "作図", "合同", "相似", "面積", "立体", "体積", "表面積", "切断", "回転体", "見取り図", "展開図", "影", "投影図", "断面図"]):
+        return "図形"
+    if any(keyword in topic_name for keyword in ["長さ", "面積", "体積", "重さ", "時間", "角度", "測定"]):
+        return "量と測定"
+    return "数と計算"
+
 def seed_basic(db: Session):
-    # Check if table exists and has data
-    try:
-        # First check if table exists
-        db.execute("SELECT 1 FROM questions LIMIT 1")
-        # If we get here, table exists, so check if it has data
-        if db.query(Question).count() > 0:
-            return
-    except Exception:
-        # Table doesn't exist yet, continue with seeding
-        pass
+    # サンプル問題はidを持たないため、問題が1問でもあれば投入しない
+    if db.scalar(select(Question.id).limit(1)) is not None:
+        return
     questions = [
-        Question(
+        dict(
             subject="算数",
             topic="割合",
             stem="みかんを原価の20%の利益で売ったところ、販売価格は1,200円でした。原価はいくらですか？",
             choices=None,
-            answer=json.dumps({"primary": "1000", "variants": ["1000"]}),
+            answer={"primary": "1000", "variants": ["1000", "1000円"]},
             explanation="原価をXとすると、X * (1 + 20/100) = 1200。X = 1200 / 1.2 = 1000",
             difficulty=1.0,
             source="サンプル",
             school=None,
             year=None,
         ),
-        Question(
+        dict(
             subject="算数", 
             topic="速さ",
             stem="時速60kmで走る車が2時間30分で進む距離は何kmですか？",
             choices=None,
-            answer=json.dumps({"primary": "150", "variants": ["150"]}),
+            answer={"primary": "150", "variants": ["150", "150km"]},
             explanation="距離 = 速さ × 時間 = 60 × 2.5 = 150km",
             difficulty=1.0,
             source="サンプル",
@@ -40,15 +79,10 @@ def seed_basic(db: Session):
             year=None,
         ),
     ]
-    for q in questions:
-        db.add(q)
+    db.execute(insert(Question).values(questions))
     db.commit()
 
 def seed_math_topics(db: Session):
-    # Check if table exists and has data
-    if db.query(MathTopic).count() > 0:
-        print("Math topics already seeded, skipping...")
-        return
     rows = [
         (1, "整数の範囲", "基礎"),
         (2, "小数", "基礎"),
@@ -151,15 +185,10 @@ def seed_math_topics(db: Session):
         (99, "難関校オリジナル問題3", "発展"),
         (100, "難関校オリジナル問題4", "発展"),
     ]
-    for i, name, diff in rows:
-        db.add(MathTopic(id=i, name=name, difficulty=diff))
+    _insert_ignore(db, MathTopic, [{"id": i, "name": name, "difficulty": diff} for i, name, diff in rows])
     db.commit()
 
 def seed_math_dependencies(db: Session):
-    # Check if table exists and has data
-    if db.query(MathDependency).count() > 0:
-        print("Math dependencies already seeded, skipping...")
-        return
     dependencies = [
         (1, "整数の範囲", None),
         (2, "小数", "整数の範囲"),
@@ -262,41 +291,22 @@ def seed_math_dependencies(db: Session):
         (99, "難関校オリジナル問題3", "難関校オリジナル問題2"),
         (100, "難関校オリジナル問題4", "難関校オリジナル問題3"),
     ]
-    for i, topic_name, prerequisite in dependencies:
-        # math_topicsとの紐付けを取得
-        math_topic = db.query(MathTopic).filter(MathTopic.name == topic_name).first()
-        topic_id = math_topic.id if math_topic else None
-        
-        # 算数の依存関係にdomainフィールドを追加
-        # 単元名に基づいてdomainを決定
-        domain = "数と計算"  # デフォルト
-        if any(keyword in topic_name for keyword in ["割合", "速さ", "比", "百分率", "歩合", "旅人算", "通過算", "追いつき算", "時計算", "流水算", "ダイヤグラム"]):
-            domain = "数量関係"
-        elif any(keyword in topic_name for keyword in ["図形", "三角形", "四角形", "多角形", "円", "角度", "垂直", "平行", "作図", "合同", "相似", "面積", "立体", "体積", "表面積", "切断", "回転体", "見取り図", "展開図", "影", "投影図", "断面図"]):
-            domain = "図形"
-        elif any(keyword in topic_name for keyword in ["長さ", "面積", "体積", "重さ", "時間", "角度", "測定"]):
-            domain = "量と測定"
-        
-        db.add(MathDependency(
-            id=i,
-            domain=domain,
-            topic_name=topic_name,
-            prerequisite_topic=prerequisite,
-            topic_id=topic_id
-        ))
+    # math_topicsとの紐付け
+    topic_ids = _topic_ids(db, MathTopic)
+    _insert_ignore(db, MathDependency, [
+        {
+            "id": i,
+            "domain": _math_domain(topic_name),
+            "topic_name": topic_name,
+            "prerequisite_topic": prerequisite,
+            "topic_id": topic_ids.get(topic_name)
+        }
+        for i, topic_name, prerequisite in dependencies
+    ])
+    backfill_edges(db, "math")
     db.commit()
 
 def seed_science_topics(db: Session):
-    # Check if table exists and has data
-    try:
-        # First check if table exists
-        db.execute("SELECT 1 FROM science_topics LIMIT 1")
-        # If we get here, table exists, so check if it has data
-        if db.query(ScienceTopic).count() > 0:
-            return
-    except Exception:
-        # Table doesn't exist yet, continue with seeding
-        pass
     rows = [
         # 物理 1-25
         (1, "物理", "力と運動の基礎", "基礎"),
@@ -404,21 +414,13 @@ def seed_science_topics(db: Session):
         (99, "総合", "科学と文化", "発展"),
         (100, "総合", "科学と持続可能な開発", "発展"),
     ]
-    for i, domain, name, diff in rows:
-        db.add(ScienceTopic(id=i, domain=domain, name=name, difficulty=diff))
+    _insert_ignore(db, ScienceTopic, [
+        {"id": i, "domain": domain, "name": name, "difficulty": diff}
+        for i, domain, name, diff in rows
+    ])
     db.commit()
 
 def seed_science_dependencies(db: Session):
-    # Check if table exists and has data
-    try:
-        # First check if table exists
-        db.execute("SELECT 1 FROM science_dependencies LIMIT 1")
-        # If we get here, table exists, so check if it has data
-        if db.query(ScienceDependency).count() > 0:
-            return
-    except Exception:
-        # Table doesn't exist yet, continue with seeding
-        pass
     dependencies = [
         # 物理 1-20
         (1, "物理", "光の性質（反射・屈折）", "観察記録の取り方; 質量・体積の測定", "光の作図（鏡・レンズ）"),
@@ -526,31 +528,22 @@ def seed_science_dependencies(db: Session):
         (99, "総合", "研究結果の発表方法", "理科自由研究のテーマ設定; データ整理とグラフ化", "理科における論理的思考力問題"),
         (100, "総合", "理科における論理的思考力問題", "仮説検証型実験; 誤差の原因と対策", ""),
     ]
-    for i, domain, topic_name, prerequisites in dependencies:
-        # science_topicsとの紐付けを取得
-        science_topic = db.query(ScienceTopic).filter(ScienceTopic.name == topic_name).first()
-        topic_id = science_topic.id if science_topic else None
-        
-        db.add(ScienceDependency(
-            id=i,
-            domain=domain,
-            topic_name=topic_name,
-            prerequisite_topics=prerequisites if prerequisites else None,
-            topic_id=topic_id
-        ))
+    # science_topicsとの紐付け（5番目の要素は後続単元で、テーブルには保存しない）
+    topic_ids = _topic_ids(db, ScienceTopic)
+    _insert_ignore(db, ScienceDependency, [
+        {
+            "id": i,
+            "domain": domain,
+            "topic_name": topic_name,
+            "prerequisite_topics": prerequisites if prerequisites else None,
+            "topic_id": topic_ids.get(topic_name)
+        }
+        for i, domain, topic_name, prerequisites, _next_topics in dependencies
+    ])
+    backfill_edges(db, "science")
     db.commit()
 
 def seed_social_dependencies(db: Session):
-    # Check if table exists and has data
-    try:
-        # First check if table exists
-        db.execute("SELECT 1 FROM social_dependencies LIMIT 1")
-        # If we get here, table exists, so check if it has data
-        if db.query(SocialDependency).count() > 0:
-            return
-    except Exception:
-        # Table doesn't exist yet, continue with seeding
-        pass
     dependencies = [
         # 地理 1-25
         (1, "地理", "日本の都道府県と県庁所在地", "", "日本の地方区分（8地方区分）"),
@@ -657,31 +650,22 @@ def seed_social_dependencies(db: Session):
         (99, "総合", "科学技術と社会", "働き方改革と雇用制度", "未来の社会像と課題予測"),
         (100, "総合", "未来の社会像と課題予測", "科学技術と社会", ""),
     ]
-    for i, domain, topic_name, prerequisites in dependencies:
-        # social_topicsとの紐付けを取得
-        social_topic = db.query(SocialTopic).filter(SocialTopic.name == topic_name).first()
-        topic_id = social_topic.id if social_topic else None
-        
-        db.add(SocialDependency(
-            id=i,
-            domain=domain,
-            topic_name=topic_name,
-            prerequisite_topics=prerequisites if prerequisites else None,
-            topic_id=topic_id
-        ))
+    # social_topicsとの紐付け（5番目の要素は後続単元で、テーブルには保存しない）
+    topic_ids = _topic_ids(db, SocialTopic)
+    _insert_ignore(db, SocialDependency, [
+        {
+            "id": i,
+            "domain": domain,
+            "topic_name": topic_name,
+            "prerequisite_topics": prerequisites if prerequisites else None,
+            "topic_id": topic_ids.get(topic_name)
+        }
+        for i, domain, topic_name, prerequisites, _next_topics in dependencies
+    ])
+    backfill_edges(db, "social")
     db.commit()
 
 def seed_social_topics(db: Session):
-    # Check if table exists and has data
-    try:
-        # First check if table exists
-        db.execute("SELECT 1 FROM social_topics LIMIT 1")
-        # If we get here, table exists, so check if it has data
-        if db.query(SocialTopic).count() > 0:
-            return
-    except Exception:
-        # Table doesn't exist yet, continue with seeding
-        pass
     rows = [
         # 地理 1-25
         (1, "地理", "日本の都道府県と県庁所在地", "基礎"),
@@ -788,21 +772,14 @@ def seed_social_topics(db: Session):
         (99, "総合", "科学技術と社会", "応用"),
         (100, "総合", "未来の社会像と課題予測", "発展"),
     ]
-    for i, domain, name, diff in rows:
-        db.add(SocialTopic(id=i, domain=domain, name=name, difficulty=diff))
+    _insert_ignore(db, SocialTopic, [
+        {"id": i, "domain": domain, "name": name, "difficulty": diff}
+        for i, domain, name, diff in rows
+    ])
     db.commit()
 
 def seed_domain_master(db: Session):
     """ドメインマスターテーブルにデータをシード"""
-    # Check if table exists and has data
-    try:
-        if db.query(DomainMaster).count() > 0:
-            print("Domain master already seeded, skipping...")
-            return
-    except Exception:
-        # Table doesn't exist yet, continue with seeding
-        pass
-    
     # 算数のドメイン
     math_domains = [
         (1, "math", "数と計算", 1),
@@ -832,15 +809,21 @@ def seed_domain_master(db: Session):
     # すべてのドメインを追加
     all_domains = math_domains + science_domains + social_domains
     
-    for id_val, subject, domain, display_order in all_domains:
-        db.add(DomainMaster(
-            id=id_val,
-            subject=subject,
-            domain=domain,
-            display_order=display_order
-        ))
-    
+    _insert_ignore(db, DomainMaster, [
+        {"id": id_val, "subject": subject, "domain": domain, "display_order": display_order}
+        for id_val, subject, domain, display_order in all_domains
+    ])
     db.commit()
-    print(f"Seeded {len(all_domains)} domain master records")
+
+def seed_all(db: Session):
+    """すべての初期データを投入（単元→依存関係の順）"""
+    seed_basic(db)
+    seed_domain_master(db)
+    seed_math_topics(db)
+    seed_science_topics(db)
+    seed_social_topics(db)
+    seed_math_dependencies(db)
+    seed_science_dependencies(db)
+    seed_social_dependencies(db)
 
 
@@ -6,130 +6,255 @@ from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 import json
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
 
-# 条件付きインポート
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
+from .event_log import log_event
+from .metrics import record_llm_call, record_ocr
+
+from .lazy_imports import LazyModule, is_available
+
+# 重いライブラリは初回使用時に読み込む（出題・解答だけを処理するワーカーの起動を遅くしない）
+Image = LazyModule("PIL.Image")
+PyPDF2 = LazyModule("PyPDF2")
+pdfplumber = LazyModule("pdfplumber")
+pytesseract = LazyModule("pytesseract")
+openai = LazyModule("openai")
+
+PIL_AVAILABLE = is_available("PIL")
+if not PIL_AVAILABLE:
     print("Warning: PIL (Pillow) not available. Image processing will be disabled.")
 
-try:
-    import PyPDF2
-    PDF2_AVAILABLE = True
-except ImportError:
-    PDF2_AVAILABLE = False
+PDF2_AVAILABLE = is_available("PyPDF2")
+if not PDF2_AVAILABLE:
     print("Warning: PyPDF2 not available. PDF processing will be disabled.")
 
-try:
-    import pdfplumber
-    PDFPLUMBER_AVAILABLE = True
-except ImportError:
-    PDFPLUMBER_AVAILABLE = False
+PDFPLUMBER_AVAILABLE = is_available("pdfplumber")
+if not PDFPLUMBER_AVAILABLE:
     print("Warning: pdfplumber not available. Enhanced PDF processing will be disabled.")
 
-try:
-    import pytesseract
-    TESSERACT_AVAILABLE = True
-except ImportError:
-    TESSERACT_AVAILABLE = False
+TESSERACT_AVAILABLE = is_available("pytesseract")
+if not TESSERACT_AVAILABLE:
     print("Warning: pytesseract not available. OCR will be disabled.")
 
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+OPENAI_AVAILABLE = is_available("openai")
+if not OPENAI_AVAILABLE:
     print("Warning: openai not available. AI analysis will be disabled.")
 
+# OCR用プロセスプールのワーカー内かどうか（analysis_jobs._init_ocr_process が設定する）。
+# uvicorn の --workers / --reload のプロセスにも親プロセスがあるため、親の有無では判定しない
+_in_ocr_worker = False
+
+def mark_ocr_worker() -> None:
+    """このプロセスをOCR用プロセスプールのワーカーとして印を付ける（プールを入れ子にしない）"""
+    global _in_ocr_worker
+    _in_ocr_worker = True
+
+def preload_ocr_dependencies() -> None:
+    """OCRで使うライブラリを読み込んでおく（OCR用プロセスの初期化で使用）"""
+    if PIL_AVAILABLE:
+        Image.load()
+    if TESSERACT_AVAILABLE:
+        pytesseract.load()
+    if is_available("pdf2image"):
+        import pdf2image  # noqa: F401
+
+def preload_dependencies() -> None:
+    """分析で使うライブラリをすべて読み込んでおく（分析専用ワーカーの起動時に使用）"""
+    preload_ocr_dependencies()
+    for module, available in ((PyPDF2, PDF2_AVAILABLE), (pdfplumber, PDFPLUMBER_AVAILABLE), (openai, OPENAI_AVAILABLE)):
+        if available:
+            module.load()
+
+# OCRの解像度と、同時に処理するページ数の上限（メモリ使用量の上限になる）
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_MAX_INFLIGHT_PAGES = int(os.getenv("OCR_MAX_INFLIGHT_PAGES", str(os.cpu_count() or 1)))
+
+# 文字化け・制御文字（テキストレイヤーの品質判定とプロンプトの注意書きで使用）
+GARBLED_CHAR_PATTERN = re.compile(r'[\ufffd\u0000-\u001f\u007f-\u009f]')
+# フォントのマッピングがないときにpdfplumberが出力する文字
+CID_PATTERN = re.compile(r'\(cid:\d+\)')
+# テキストレイヤーを採用する最小文字数と文字化けの許容率
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "20"))
+TEXT_LAYER_MAX_GARBLED_RATIO = float(os.getenv("TEXT_LAYER_MAX_GARBLED_RATIO", "0.1"))
+
+def has_usable_text_layer(page_text: Optional[str]) -> bool:
+    """ページのテキストレイヤーがOCRなしで使えるか（十分な文字数があり文字化けが少ない）"""
+    if not page_text:
+        return False
+    compact = re.sub(r'\s+', '', page_text)
+    cid_count = len(CID_PATTERN.findall(compact))
+    compact = CID_PATTERN.sub('', compact)
+    total = len(compact) + cid_count
+    if total < TEXT_LAYER_MIN_CHARS:
+        return False
+    garbled = len(GARBLED_CHAR_PATTERN.findall(compact)) + cid_count
+    return garbled / total <= TEXT_LAYER_MAX_GARBLED_RATIO
+
+def _ocr_pdf_page(file_path: str, page_number: int, dpi: int = OCR_DPI) -> Tuple[int, str, float, float]:
+    """PDFの1ページだけを画像化してOCRする（プロセスプールから呼ばれる）
+
+    戻り値は (ページ番号, テキスト, 画像化の秒数, OCRの秒数)。
+    """
+    from pdf2image import convert_from_path
+
+    started = time.perf_counter()
+    images = convert_from_path(file_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    rasterized = time.perf_counter()
+    page_text = "".join(pytesseract.image_to_string(image, lang='jpn+eng') for image in images)
+    finished = time.perf_counter()
+    for image in images:
+        image.close()
+    return page_number, page_text, rasterized - started, finished - rasterized
+
 class TestResultAnalyzer:
     def __init__(self, openai_api_key: Optional[str] = None):
         """テスト結果分析器の初期化"""
         self.openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
-        if self.openai_api_key:
-            self.client = OpenAI(api_key=self.openai_api_key)
-        else:
-            self.client = None
+        self._client = None
+        # 直近のOCRのページ別処理時間
+        self.ocr_timings: List[Dict] = []
+    
+    @property
+    def client(self):
+        """OpenAIクライアント（初回アクセス時にopenaiを読み込んで作成、APIキーがなければNone）"""
+        if self._client is None and self.openai_api_key and OPENAI_AVAILABLE:
+            self._client = openai.OpenAI(api_key=self.openai_api_key)
+        return self._client
     
     def extract_text_from_pdf(self, file_path: str) -> str:
-        """PDFからテキストを抽出（日本語対応強化版）"""
+        """PDFからテキストを抽出（日本語対応強化版）
+
+        ページごとにテキストレイヤーを確認し、使えるページはそのまま採用して
+        画像のみ・文字化けしたページだけをOCRする。
+        """
         if not PDF2_AVAILABLE and not PDFPLUMBER_AVAILABLE:
             raise Exception("PDF処理が利用できません（PyPDF2またはpdfplumberがインストールされていません）")
         
+        page_texts = self._extract_text_layers(file_path)
+        if page_texts is None:
+            # テキストレイヤーを読めなかった場合は全ページをOCR
+            print("テキスト抽出に失敗したため、OCR処理を試行します...")
+            return self._extract_text_with_ocr(file_path)
+        
+        ocr_pages = [n for n, page_text in enumerate(page_texts, start=1) if not has_usable_text_layer(page_text)]
+        if not ocr_pages:
+            text = "".join(page_text + "\n" for page_text in page_texts)
+            log_event("pdf_text_layer_extracted", pages=len(page_texts), ocr_pages=0, chars=len(text))
+            return text
+        
+        log_event("pdf_text_layer_extracted", pages=len(page_texts), ocr_pages=len(ocr_pages))
+        try:
+            ocr_texts = self._ocr_pdf_pages(file_path, ocr_pages)
+        except Exception as e:
+            # OCRできない場合はテキストレイヤーだけで続行（従来どおり）
+            text = "".join(page_text + "\n" for page_text in page_texts if page_text)
+            if text.strip():
+                log_event("pdf_ocr_skipped", level="warning", ocr_pages=len(ocr_pages), error=str(e))
+                return text
+            raise Exception(f"OCR処理エラー: {str(e)}")
+        
+        return "".join(ocr_texts.get(n, page_text) + "\n" for n, page_text in enumerate(page_texts, start=1))
+    
+    def _extract_text_layers(self, file_path: str) -> Optional[List[str]]:
+        """ページごとのテキストレイヤーを取得（読めない場合はNone）
+
+        pdfplumberの結果を優先し、使えないページはPyPDF2の結果で補う。
+        """
+        page_texts = None
+        
         # まずpdfplumberで試行（日本語に強い）
         if PDFPLUMBER_AVAILABLE:
             try:
-                print("pdfplumberを使用してPDFテキスト抽出を試行...")
-                text = ""
                 with pdfplumber.open(file_path) as pdf:
-                    for page in pdf.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                
-                if text.strip():
-                    print(f"pdfplumberでテキスト抽出成功: {len(text)} 文字")
-                    return text
-                else:
-                    print("pdfplumberでテキストが抽出できませんでした")
+                    page_texts = [page.extract_text() or "" for page in pdf.pages]
             except Exception as e:
                 print(f"pdfplumberでの抽出エラー: {e}")
         
-        # pdfplumberが失敗した場合はPyPDF2で試行
-        if PDF2_AVAILABLE:
+        # 使えないページがあればPyPDF2で補完
+        if PDF2_AVAILABLE and (page_texts is None or not all(has_usable_text_layer(t) for t in page_texts)):
             try:
-                print("PyPDF2を使用してPDFテキスト抽出を試行...")
-                text = ""
                 with open(file_path, 'rb') as file:
                     pdf_reader = PyPDF2.PdfReader(file)
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                
-                if text.strip():
-                    print(f"PyPDF2でテキスト抽出成功: {len(text)} 文字")
-                    return text
+                    fallback_texts = [page.extract_text() or "" for page in pdf_reader.pages]
+                if page_texts is None or len(page_texts) != len(fallback_texts):
+                    page_texts = fallback_texts
                 else:
-                    print("PyPDF2でテキストが抽出できませんでした")
+                    page_texts = [
+                        fallback if not has_usable_text_layer(primary) and has_usable_text_layer(fallback) else primary
+                        for primary, fallback in zip(page_texts, fallback_texts)
+                    ]
             except Exception as e:
                 print(f"PyPDF2での抽出エラー: {e}")
         
-        # 両方とも失敗した場合はOCRを試行
-        print("テキスト抽出に失敗したため、OCR処理を試行します...")
-        return self._extract_text_with_ocr(file_path)
+        return page_texts
     
     def _extract_text_with_ocr(self, file_path: str) -> str:
-        """OCRを使用してPDFからテキストを抽出"""
-        if not PIL_AVAILABLE or not TESSERACT_AVAILABLE:
-            raise Exception("OCR処理が利用できません（Pillowまたはpytesseractがインストールされていません）")
-        
+        """OCRを使用してPDFの全ページからテキストを抽出"""
         try:
-            print("OCR処理開始...")
-            # PDFを画像に変換してOCR処理
-            from pdf2image import convert_from_path
-            
-            # PDFの各ページを画像に変換
-            images = convert_from_path(file_path, dpi=300)
-            
-            text = ""
-            for i, image in enumerate(images):
-                print(f"ページ {i+1} のOCR処理中...")
-                page_text = pytesseract.image_to_string(image, lang='jpn+eng')
-                text += page_text + "\n"
-            
-            print(f"OCR処理完了: {len(text)} 文字")
-            return text
-            
+            import pdf2image  # noqa: F401
         except ImportError:
             print("pdf2imageが利用できません。代替方法を試行します...")
             # pdf2imageが利用できない場合は、PyPDF2で画像として抽出を試行
             return self._extract_text_from_pdf_images(file_path)
+        
+        try:
+            page_texts = self._ocr_pdf_pages(file_path)
+            return "".join(page_texts[n] + "\n" for n in sorted(page_texts))
         except Exception as e:
             print(f"OCR処理エラー: {e}")
             raise Exception(f"OCR処理エラー: {str(e)}")
     
+    def _ocr_pdf_pages(self, file_path: str, page_numbers: Optional[List[int]] = None) -> Dict[int, str]:
+        """指定ページ（省略時は全ページ）をOCRし、ページ番号→テキストを返す
+
+        ページを1枚ずつ画像化してプロセスプールでOCRする。
+        同時に処理するページ数は OCR_MAX_INFLIGHT_PAGES までに抑える。
+        """
+        if not PIL_AVAILABLE or not TESSERACT_AVAILABLE:
+            raise Exception("OCR処理が利用できません（Pillowまたはpytesseractがインストールされていません）")
+        
+        from pdf2image import pdfinfo_from_path
+        
+        if page_numbers is None:
+            page_numbers = list(range(1, pdfinfo_from_path(file_path)["Pages"] + 1))
+        started = time.perf_counter()
+        
+        if not _in_ocr_worker:
+            page_results = self._ocr_pages_in_pool(file_path, page_numbers)
+        else:
+            # すでにワーカープロセス内の場合はプールを入れ子にせず順に処理
+            page_results = [_ocr_pdf_page(file_path, page_number) for page_number in page_numbers]
+        
+        page_results.sort(key=lambda result: result[0])
+        self.ocr_timings = [
+            {"page": page_number, "raster_sec": round(raster_sec, 3), "ocr_sec": round(ocr_sec, 3)}
+            for page_number, _, raster_sec, ocr_sec in page_results
+        ]
+        page_texts = {page_number: page_text for page_number, page_text, _, _ in page_results}
+        
+        elapsed = time.perf_counter() - started
+        record_ocr(len(page_numbers), elapsed)
+        log_event("pdf_ocr_completed", pages=len(page_numbers), chars=sum(len(t) for t in page_texts.values()),
+                  elapsed_sec=round(elapsed, 3))
+        return page_texts
+    
+    def _ocr_pages_in_pool(self, file_path: str, page_numbers: List[int]) -> List[Tuple[int, str, float, float]]:
+        """ページをプロセスプールに投入し、処理中のページ数を上限以下に保つ"""
+        from .analysis_jobs import ocr_pool
+        
+        pool = ocr_pool()
+        pending = list(page_numbers)
+        in_flight = set()
+        results = []
+        while pending or in_flight:
+            while pending and len(in_flight) < OCR_MAX_INFLIGHT_PAGES:
+                in_flight.add(pool.submit(_ocr_pdf_page, file_path, pending.pop(0)))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.append(future.result())
+        return results
+    
     def _extract_text_from_pdf_images(self, file_path: str) -> str:
         """PyPDF2を使用してPDFから画像としてテキストを抽出"""
         try:
@@ -323,6 +448,17 @@ class TestResultAnalyzer:
         
         return topics
     
+    def _chat_completion(self, model: str, **kwargs):
+        """chat.completions.create を呼び出し、所要時間とトークン数をメトリクスに記録する"""
+        started = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(model=model, **kwargs)
+        except Exception:
+            record_llm_call(model, time.perf_counter() - started, outcome="error")
+            raise
+        record_llm_call(model, time.perf_counter() - started, getattr(response, "usage", None))
+        return response
+    
     def analyze_weaknesses_with_ai(self, test_result: Dict) -> Dict:
         """AIを使用して弱点分析と改善アドバイスを生成"""
         if not OPENAI_AVAILABLE:
@@ -337,7 +473,7 @@ class TestResultAnalyzer:
             # AI分析用のプロンプトを作成
             prompt = self._create_analysis_prompt(test_result)
             
-            response = self.client.chat.completions.create(
+            response = self._chat_completion(
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "あなたは教育心理学と学習科学に精通した教育コンサルタントです。テスト結果を詳細に分析し、個別化された学習戦略を提案します。具体的で実行可能なアドバイスを提供してください。"},
@@ -369,28 +505,19 @@ class TestResultAnalyzer:
         try:
             # PDFファイルを直接アップロードして分析（テキスト抽出なし）
             try:
-                print(f"PDFファイル直接アップロード開始: {pdf_file_path}")
-                print(f"ファイル存在確認: {os.path.exists(pdf_file_path)}")
-                print(f"ファイルサイズ確認: {os.path.getsize(pdf_file_path)} bytes")
-                
                 with open(pdf_file_path, 'rb') as pdf_file:
                     pdf_content = pdf_file.read()
-                    print(f"PDFファイル読み込み完了: {len(pdf_content)} bytes")
-                    print(f"PDFファイルの最初の100バイト: {pdf_content[:100]}")
                     
                     # PDFヘッダーの確認
-                    if pdf_content.startswith(b'%PDF'):
-                        print("有効なPDFファイルです")
-                    else:
-                        print("警告: PDFヘッダーが見つかりません")
+                    if not pdf_content.startswith(b'%PDF'):
+                        log_event("pdf_header_missing", level="warning", source_bytes=len(pdf_content))
                     
                     # Base64エンコード
                     base64_content = base64.b64encode(pdf_content).decode('utf-8')
-                    print(f"Base64エンコード完了: {len(base64_content)} 文字")
+                    log_event("pdf_direct_analysis_started", source_bytes=len(pdf_content))
                     
                     # ChatGPTへの送信
-                    print("ChatGPTへの送信開始...")
-                    response = self.client.chat.completions.create(
+                    response = self._chat_completion(
                         model="gpt-4o",
                         messages=[
                             {
@@ -416,16 +543,13 @@ class TestResultAnalyzer:
                         max_tokens=4000,
                         temperature=0.7
                     )
-                    print("ChatGPTからの応答受信完了")
                 
                 analysis_text = response.choices[0].message.content
-                print(f"AI分析結果: {analysis_text[:200]}...")
-                print(f"分析結果の長さ: {len(analysis_text)} 文字")
                 
                 # 分析結果を構造化
                 result = self._parse_pdf_analysis(analysis_text, pdf_file_path, "")
-                print(f"構造化された結果の分析手法: {result.get('analysis_method', 'unknown')}")
-                print(f"構造化された結果のソースファイル: {result.get('source_file', 'unknown')}")
+                log_event("pdf_direct_analysis_completed", response_chars=len(analysis_text),
+                          analysis_method=result.get('analysis_method'))
                 return result
                 
             except Exception as file_upload_error:
@@ -434,14 +558,13 @@ class TestResultAnalyzer:
                 
                 # フォールバック: テキスト抽出ベースの分析
                 try:
-                    print(f"PDFテキスト抽出開始: {pdf_file_path}")
                     text_content = self.extract_text_from_pdf(pdf_file_path)
                     text_content = self._clean_extracted_text(text_content)
-                    print(f"PDFから抽出されたテキスト: {text_content[:200]}...")
+                    log_event("pdf_text_extracted", chars=len(text_content))
                     
                     prompt = self._create_pdf_analysis_prompt_with_content(text_content)
                     
-                    response = self.client.chat.completions.create(
+                    response = self._chat_completion(
                         model="gpt-4o",
                         messages=[
                             {"role": "system", "content": "あなたは教育心理学と学習科学に精通した教育コンサルタントです。PDFファイルのテスト結果を詳細に分析し、個別化された学習戦略を提案します。具体的で実行可能なアドバイスを提供してください。"},
@@ -639,7 +762,7 @@ class TestResultAnalyzer:
         """PDF内容を含む分析用のプロンプトを作成"""
         
         # 文字化けの検出
-        garbled_chars = re.findall(r'[\ufffd\u0000-\u001f\u007f-\u009f]', text_content)
+        garbled_chars = GARBLED_CHAR_PATTERN.findall(text_content)
         text_quality_note = ""
         if garbled_chars:
             text_quality_note = f"""
@@ -0,0 +1,178 @@
+"""単元の前提関係（topic_edges）の読み書き
+
+前提単元はもともと依存関係テーブルの列に単元名で保存していた（算数は prerequisite_topic、
+理科・社会はセミコロン区切りの prerequisite_topics）。topic_edges はそれを
+(subject, from_id, to_id) の辺に正規化したもので、グラフの読み込みはこちらを使う。
+旧列は互換のため、辺を更新したときに辺から書き戻す。
+db には Session と Connection のどちらも渡せる（マイグレーションからも使うため）。
+"""
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Integer, and_, delete, func, insert, literal, literal_column, select, update
+
+from .models import MathDependency, ScienceDependency, SocialDependency, TopicEdge
+
+DEPENDENCY_MODELS = {"math": MathDependency, "science": ScienceDependency, "social": SocialDependency}
+
+
+def split_prerequisites(value: Optional[str]) -> List[str]:
+    """セミコロン区切りの前提単元を分割"""
+    if not value:
+        return []
+    return [t.strip() for t in value.split(";") if t.strip()]
+
+
+def dependency_model(subject: str):
+    model = DEPENDENCY_MODELS.get(subject.lower())
+    if model is None:
+        raise ValueError(f"Invalid subject: {subject}")
+    return model
+
+
+def _legacy_column(model):
+    return model.prerequisite_topic if model is MathDependency else model.prerequisite_topics
+
+
+def edges_from_columns(db, subject: str) -> Set[Tuple[int, int]]:
+    """旧列の前提単元名から (from_id, to_id) の辺を求める（同名の単元は最初の行を採用）"""
+    model = dependency_model(subject)
+    rows = db.execute(select(model.id, model.topic_name, _legacy_column(model)).order_by(model.id)).all()
+    ids: Dict[str, int] = {}
+    for dep_id, topic_name, _ in rows:
+        ids.setdefault(topic_name, dep_id)
+
+    edges = set()
+    for to_id, _, value in rows:
+        names = ([value] if value else []) if model is MathDependency else split_prerequisites(value)
+        for name in names:
+            from_id = ids.get(name)
+            if from_id is not None and from_id != to_id:
+                edges.add((from_id, to_id))
+    return edges
+
+
+def backfill_edges(db, subject: str) -> int:
+    """旧列にあってtopic_edgesにない辺を追加し、追加した件数を返す（何度実行してもよい）"""
+    subject = subject.lower()
+    existing = {
+        (from_id, to_id)
+        for from_id, to_id in db.execute(select(TopicEdge.from_id, TopicEdge.to_id).where(TopicEdge.subject == subject))
+    }
+    rows = [
+        {"subject": subject, "from_id": from_id, "to_id": to_id}
+        for from_id, to_id in sorted(edges_from_columns(db, subject) - existing)
+    ]
+    if rows:
+        db.execute(insert(TopicEdge), rows)
+    return len(rows)
+
+
+def _mirror_legacy_column(db, subject: str, topic_id: int) -> None:
+    """単元の前提単元名を旧列に書き戻す（算数の列は1件のみ保持できるため先頭の1件）"""
+    model = dependency_model(subject)
+    names = list(db.execute(
+        select(model.topic_name)
+        .join(TopicEdge, and_(TopicEdge.subject == subject, TopicEdge.from_id == model.id))
+        .where(TopicEdge.to_id == topic_id)
+        .order_by(model.id)
+    ).scalars())
+    value = (names[0] if names else None) if model is MathDependency else (";".join(names) or None)
+    db.execute(update(model).where(model.id == topic_id).values({_legacy_column(model).key: value}))
+
+
+def _require_topics(db, model, topic_ids: List[int]) -> None:
+    found = set(db.execute(select(model.id).where(model.id.in_(topic_ids))).scalars())
+    missing = [topic_id for topic_id in topic_ids if topic_id not in found]
+    if missing:
+        raise LookupError(f"Topic not found: {missing}")
+
+
+def set_prerequisites(db, subject: str, topic_id: int, prerequisite_names: List[str]) -> List[int]:
+    """単元の前提単元を単元名のリストで置き換え、前提単元のidを返す"""
+    subject = subject.lower()
+    model = dependency_model(subject)
+    _require_topics(db, model, [topic_id])
+
+    ids: Dict[str, int] = {}
+    if prerequisite_names:
+        for dep_id, topic_name in db.execute(
+            select(model.id, model.topic_name).where(model.topic_name.in_(prerequisite_names)).order_by(model.id)
+        ):
+            ids.setdefault(topic_name, dep_id)
+    missing = [name for name in prerequisite_names if name not in ids]
+    if missing:
+        raise LookupError(f"Topic not found: {missing}")
+
+    from_ids = list(dict.fromkeys(ids[name] for name in prerequisite_names if ids[name] != topic_id))
+    db.execute(delete(TopicEdge).where(TopicEdge.subject == subject, TopicEdge.to_id == topic_id))
+    if from_ids:
+        db.execute(insert(TopicEdge), [{"subject": subject, "from_id": from_id, "to_id": topic_id} for from_id in from_ids])
+    _mirror_legacy_column(db, subject, topic_id)
+    return from_ids
+
+
+def add_prerequisite(db, subject: str, topic_id: int, prerequisite_id: int) -> bool:
+    """前提関係の辺を1本追加する（既にあればFalse）"""
+    subject = subject.lower()
+    model = dependency_model(subject)
+    if topic_id == prerequisite_id:
+        raise ValueError("A topic cannot be its own prerequisite")
+    _require_topics(db, model, [topic_id, prerequisite_id])
+
+    exists = db.execute(select(TopicEdge.to_id).where(
+        TopicEdge.subject == subject, TopicEdge.from_id == prerequisite_id, TopicEdge.to_id == topic_id
+    )).first()
+    if exists:
+        return False
+    db.execute(insert(TopicEdge).values(subject=subject, from_id=prerequisite_id, to_id=topic_id))
+    _mirror_legacy_column(db, subject, topic_id)
+    return True
+
+
+def remove_prerequisite(db, subject: str, topic_id: int, prerequisite_id: int) -> bool:
+    """前提関係の辺を1本削除する（なければFalse）"""
+    subject = subject.lower()
+    dependency_model(subject)
+    deleted = db.execute(delete(TopicEdge).where(
+        TopicEdge.subject == subject, TopicEdge.from_id == prerequisite_id, TopicEdge.to_id == topic_id
+    )).rowcount
+    if deleted:
+        _mirror_legacy_column(db, subject, topic_id)
+    return bool(deleted)
+
+
+def prerequisite_closure(db, subject: str, topic_name: str, max_depth: Optional[int] = None) -> Optional[List[Dict]]:
+    """単元の前提単元を max_depth 段（None は全段）まで1回の WITH RECURSIVE で取得する
+
+    戻り値は近い順（depth, id）の {id, topic_name, topic_id, domain, depth} のリスト。
+    単元が存在しなければ None。(単元, 深さ) の UNION で重複を除き、深さを辺の数
+    （単純な経路の最大長）で打ち切るため、循環があっても停止する。
+    """
+    subject = subject.lower()
+    model = dependency_model(subject)
+    edges = TopicEdge.__table__
+
+    target = select(func.min(model.id)).where(model.topic_name == topic_name).scalar_subquery()
+    edge_count = select(func.count()).select_from(edges).where(edges.c.subject == subject).scalar_subquery()
+    limit = edge_count if max_depth is None else literal(max_depth)
+
+    # 深さの初期値はPostgreSQLで型が決まるようバインド変数ではなくリテラルで書く
+    closure = select(target.label("node"), literal_column("0", Integer).label("depth")).cte("closure", recursive=True)
+    closure = closure.union(
+        select(edges.c.from_id, closure.c.depth + 1)
+        .join(closure, edges.c.to_id == closure.c.node)
+        .where(edges.c.subject == subject, closure.c.depth < limit)
+    )
+    reached = select(closure.c.node, func.min(closure.c.depth).label("depth")).group_by(closure.c.node).subquery()
+    rows = db.execute(
+        select(model.id, model.topic_name, model.topic_id, model.domain, reached.c.depth)
+        .join(reached, reached.c.node == model.id)
+        .order_by(reached.c.depth, model.id)
+    ).all()
+    if not rows:
+        return None
+    return [
+        {"id": dep_id, "topic_name": name, "topic_id": topic_id, "domain": domain, "depth": depth}
+        for dep_id, name, topic_id, domain, depth in rows
+        if depth > 0
+    ]
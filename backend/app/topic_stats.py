@@ -0,0 +1,185 @@
+"""ユーザー×単元の集計（user_topic_stats）
+
+弱点マップや出題の優先度に使う単元別の正答率・平均解答時間・習熟度を、解答履歴を走査せずに
+読めるよう user_topic_stats に保持する。採点（grade_answer / grade_batch）は Attempt・Mastery を
+書くのと同じトランザクションで、解答数・正答数・解答時間の合計・Mastery.value の合計などの
+カウンタに差分を加算する（集計し直しはしない）。
+
+問題の科目・単元を変更した場合や、Masteryを再計算した場合は rebuild_topic_stats() で
+解答履歴とMasteryから作り直す（INSERT ... SELECT の一括集計）。
+
+    cd backend
+    python -m app.topic_stats --all
+    python -m app.topic_stats --users 1,2,3
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, case, delete, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from .models import Attempt, Mastery, Question, UserTopicStat
+
+COUNTER_COLUMNS = ["attempts", "correct", "seconds_total", "seconds_count", "mastery_count", "mastery_sum"]
+
+
+class TopicStatsDelta:
+    """1トランザクション分の単元別の差分（(科目, 単元) → カウンタの増分）"""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, str], List[float]] = {}
+
+    def _counter(self, subject: Optional[str], topic: Optional[str]) -> Optional[List[float]]:
+        if not subject or not topic:
+            return None
+        return self.counters.setdefault((subject, topic), [0, 0, 0, 0, 0, 0.0])
+
+    def add_attempt(self, subject: Optional[str], topic: Optional[str], is_correct: bool,
+                    seconds: Optional[int]) -> None:
+        counter = self._counter(subject, topic)
+        if counter is None:
+            return
+        counter[0] += 1
+        counter[1] += 1 if is_correct else 0
+        if seconds is not None:
+            counter[2] += seconds
+            counter[3] += 1
+
+    def add_mastery(self, subject: Optional[str], topic: Optional[str], old_value: Optional[float],
+                    new_value: float) -> None:
+        """Mastery.value の変化を加える（old_value が None なら新しい行）"""
+        counter = self._counter(subject, topic)
+        if counter is None:
+            return
+        if old_value is None:
+            counter[4] += 1
+            counter[5] += new_value
+        else:
+            counter[5] += new_value - old_value
+
+    def rows(self, user_id: int, now: datetime) -> List[Dict]:
+        return [
+            {"user_id": user_id, "subject": subject, "topic": topic, "updated_at": now,
+             **dict(zip(COUNTER_COLUMNS, counter))}
+            for (subject, topic), counter in self.counters.items()
+        ]
+
+
+def apply_topic_stats(db: Session, user_id: int, delta: TopicStatsDelta, now: Optional[datetime] = None) -> None:
+    """差分を加算する（採点と同じトランザクション内で呼ぶ。コミットは呼び出し側）"""
+    rows = delta.rows(user_id, now or datetime.now())
+    if not rows:
+        return
+    table = UserTopicStat.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        for row in rows:
+            stat = db.get(UserTopicStat, (user_id, row["subject"], row["topic"]), with_for_update=True)
+            if stat is None:
+                db.add(UserTopicStat(**row))
+                continue
+            for name in COUNTER_COLUMNS:
+                setattr(stat, name, getattr(stat, name) + row[name])
+            stat.updated_at = row["updated_at"]
+        db.flush()
+        return
+
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.subject, table.c.topic],
+        set_={
+            **{name: table.c[name] + stmt.excluded[name] for name in COUNTER_COLUMNS},
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt, rows)
+
+
+def rebuild_topic_stats(db, user_ids: Optional[Sequence[int]] = None) -> Dict:
+    """解答履歴とMasteryから集計を作り直す（user_ids が None なら全ユーザー。コミットは呼び出し側）
+
+    db は Session でも Connection でもよい（マイグレーションからも呼ぶ）。
+    """
+    started = time.perf_counter()
+    table = UserTopicStat.__table__
+    zero = literal(0, Integer)
+
+    attempts = (
+        select(
+            Attempt.user_id.label("user_id"), Question.subject.label("subject"), Question.topic.label("topic"),
+            func.count().label("attempts"),
+            func.coalesce(func.sum(case((Attempt.correct.is_(True), 1), else_=0)), 0).label("correct"),
+            func.coalesce(func.sum(Attempt.seconds), 0).label("seconds_total"),
+            func.count(Attempt.seconds).label("seconds_count"),
+            zero.label("mastery_count"), literal(0.0, Float).label("mastery_sum"),
+        )
+        .join(Question, Question.id == Attempt.question_id)
+        .where(Question.subject.isnot(None), Question.topic.isnot(None))
+        .group_by(Attempt.user_id, Question.subject, Question.topic)
+    )
+    mastery = (
+        select(
+            Mastery.user_id, Question.subject, Question.topic, zero, zero, zero, zero,
+            func.count(Mastery.value), func.coalesce(func.sum(Mastery.value), 0.0),
+        )
+        .join(Question, Question.id == Mastery.question_id)
+        .where(Question.subject.isnot(None), Question.topic.isnot(None))
+        .group_by(Mastery.user_id, Question.subject, Question.topic)
+    )
+    clear = delete(table)
+    if user_ids is not None:
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {"rows": 0, "seconds": 0.0}
+        attempts = attempts.where(Attempt.user_id.in_(user_ids))
+        mastery = mastery.where(Mastery.user_id.in_(user_ids))
+        clear = clear.where(table.c.user_id.in_(user_ids))
+
+    combined = union_all(attempts, mastery).subquery()
+    totals = select(
+        combined.c.user_id, combined.c.subject, combined.c.topic,
+        *[func.sum(combined.c[name]) for name in COUNTER_COLUMNS],
+        literal(datetime.now(), DateTime),
+    ).group_by(combined.c.user_id, combined.c.subject, combined.c.topic)
+
+    if isinstance(db, Session):
+        db.flush()  # Core の INSERT ... SELECT では未反映のORMの変更が自動でflushされない
+    db.execute(clear)
+    result = db.execute(insert(table).from_select(
+        ["user_id", "subject", "topic", *COUNTER_COLUMNS, "updated_at"], totals
+    ))
+    return {"rows": result.rowcount, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def topic_stats(db: Session, user_id: int, subject: Optional[str] = None) -> List[UserTopicStat]:
+    """ユーザーの単元別の集計を返す（user_topic_stats のみを読む）"""
+    stmt = select(UserTopicStat).where(UserTopicStat.user_id == user_id)
+    if subject:
+        stmt = stmt.where(UserTopicStat.subject == subject)
+    return list(db.scalars(stmt.order_by(UserTopicStat.subject, UserTopicStat.topic)))
+
+
+def main() -> None:
+    from .db import session_scope
+
+    parser = argparse.ArgumentParser(description="単元別の集計（user_topic_stats）を解答履歴から作り直す")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--all", action="store_true", help="全ユーザー")
+    target.add_argument("--users", help="ユーザーID（カンマ区切り）")
+    args = parser.parse_args()
+
+    user_ids = None if args.all else [int(value) for value in args.users.split(",") if value.strip()]
+    with session_scope() as db:
+        result = rebuild_topic_stats(db, user_ids)
+        db.commit()
+    print(f"✅ Rebuilt {result['rows']} user topic stats ({result['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""前提単元をたどる弱点の伝播と優先出題
+
+弱点検出 → 優先出題 の出題部分。単元別の集計（user_topic_stats）の Mastery.value の合計から
+単元ごとの弱点度 w を求め、前提関係のグラフを後続単元から前提単元の向きにたどって伝播させる。
+
+    p = w + PROPAGATION_DECAY * Aᵀ p    （A[i, j] = 1 / 単元 i の前提単元数、j が i の前提単元のとき）
+
+を WEAKNESS_STEPS 回の疎行列ベクトル積（辺の配列に対する np.bincount）で近似する。
+旅人算ができていなければ、その前提単元の速さの基礎の優先度も上がる。
+1回の計算は O(単元数 + WEAKNESS_STEPS × 辺の数) で、結果はユーザーごとに mastery_versions の番号と
+一緒にキャッシュする（番号が変わるまでは集計も伝播もやり直さない）。
+
+弱点度は (1 - value) の合計を (問題数 + WEAKNESS_PRIOR) で割った値で、解いた問題が少ない
+単元ほど控えめに見積もる。グラフにない単元は伝播せず自身の弱点度だけを使う。
+"""
+import os
+import random
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .dependency_graph import DependencyGraph, dependency_graphs
+from .due_queue import mastery_version
+from .lazy_imports import LazyModule
+from .models import Question, UserTopicStat
+
+np = LazyModule("numpy")
+
+WEAKNESS_STEPS = int(os.getenv("WEAKNESS_STEPS", "8"))
+PROPAGATION_DECAY = float(os.getenv("WEAKNESS_PROPAGATION_DECAY", "0.6"))
+WEAKNESS_PRIOR = float(os.getenv("WEAKNESS_PRIOR", "2"))
+# 優先度の高い順にこの数の単元から、優先度に比例した確率で出題する単元を選ぶ
+WEAKNESS_TOP_K = int(os.getenv("WEAKNESS_TOP_K", "5"))
+WEAKNESS_CACHE_SIZE = int(os.getenv("WEAKNESS_CACHE_SIZE", "4096"))
+# 問題のある単元の一覧を読み直す間隔（秒）
+WEAKNESS_TOPICS_TTL = float(os.getenv("WEAKNESS_TOPICS_TTL", "300"))
+
+# Question.subject の表記 → 依存関係グラフの科目
+GRAPH_SUBJECTS = {"算数": "math", "理科": "science", "社会": "social"}
+
+
+class TopicPriority(NamedTuple):
+    subject: str
+    topic: str
+    weakness: float
+    priority: float
+
+
+class _Propagation(NamedTuple):
+    """グラフごとの伝播用の辺の配列（後続単元 → 前提単元）"""
+    graph: DependencyGraph
+    source: "np.ndarray"
+    target: "np.ndarray"
+    weight: "np.ndarray"
+
+
+class _UserPriorities(NamedTuple):
+    version: int
+    graphs: Tuple[Optional[DependencyGraph], ...]
+    ranked: List[TopicPriority]
+
+
+def propagate(weakness, propagation: _Propagation, steps: int = WEAKNESS_STEPS, decay: float = PROPAGATION_DECAY):
+    """弱点度を前提単元の向きに伝播させた優先度"""
+    priority = weakness
+    for _ in range(steps):
+        spread = np.bincount(propagation.target, weights=propagation.weight * priority[propagation.source],
+                             minlength=len(weakness))
+        priority = weakness + decay * spread
+    return priority
+
+
+class WeaknessEngine:
+    def __init__(self, cache_size: int = WEAKNESS_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._propagations: Dict[str, _Propagation] = {}
+        self._users: "OrderedDict[int, _UserPriorities]" = OrderedDict()
+        self._topics: Optional[Tuple[float, Dict[str, Set[str]]]] = None
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _propagation(self, db: Session, graph_subject: str) -> _Propagation:
+        graph = dependency_graphs.get(db, graph_subject)
+        cached = self._propagations.get(graph_subject)
+        if cached is not None and cached.graph is graph:
+            return cached
+        source, target, weight = [], [], []
+        for node, prerequisites in enumerate(graph.prerequisites):
+            for prerequisite in prerequisites:
+                source.append(node)
+                target.append(prerequisite)
+                weight.append(1.0 / len(prerequisites))
+        propagation = self._propagations[graph_subject] = _Propagation(
+            graph, np.array(source, dtype=np.int64), np.array(target, dtype=np.int64), np.array(weight)
+        )
+        return propagation
+
+    def available_topics(self, db: Session) -> Dict[str, Set[str]]:
+        """科目ごとの問題のある単元（WEAKNESS_TOPICS_TTL 秒ごとに読み直す）"""
+        cached = self._topics
+        if cached is not None and time.monotonic() - cached[0] < WEAKNESS_TOPICS_TTL:
+            return cached[1]
+        topics: Dict[str, Set[str]] = {}
+        for subject, topic in db.execute(select(Question.subject, Question.topic).distinct()):
+            if subject and topic:
+                topics.setdefault(subject, set()).add(topic)
+        self._topics = (time.monotonic(), topics)
+        return topics
+
+    def topic_weakness(self, db: Session, user_id: int) -> Dict[Tuple[str, str], float]:
+        """単元ごとの弱点度（Masteryのある単元のみ）"""
+        rows = db.execute(
+            select(UserTopicStat.subject, UserTopicStat.topic, UserTopicStat.mastery_count, UserTopicStat.mastery_sum)
+            .where(UserTopicStat.user_id == user_id, UserTopicStat.mastery_count > 0)
+        ).all()
+        return {
+            (subject, topic): max(count - total, 0.0) / (count + WEAKNESS_PRIOR)
+            for subject, topic, count, total in rows
+        }
+
+    def _rank(self, db: Session, user_id: int) -> _UserPriorities:
+        version = mastery_version(db, user_id)
+        graphs = tuple(dependency_graphs.get(db, name) for name in GRAPH_SUBJECTS.values())
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached.version == version and all(
+                a is b for a, b in zip(cached.graphs, graphs)
+            ):
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        weakness = self.topic_weakness(db, user_id)
+        ranked = []
+        seen = set()
+        for subject, graph_subject in GRAPH_SUBJECTS.items():
+            propagation = self._propagation(db, graph_subject)
+            graph = propagation.graph
+            vector = np.zeros(len(graph.names))
+            for node, name in enumerate(graph.names):
+                vector[node] = weakness.get((subject, name), 0.0)
+            if not vector.any():
+                continue
+            priority = propagate(vector, propagation)
+            for node in np.flatnonzero(priority > 0).tolist():
+                name = graph.names[node]
+                ranked.append(TopicPriority(subject, name, float(vector[node]), float(priority[node])))
+                seen.add((subject, name))
+        # グラフにない単元は自身の弱点度のみ
+        ranked.extend(
+            TopicPriority(subject, topic, value, value)
+            for (subject, topic), value in weakness.items()
+            if (subject, topic) not in seen and value > 0
+        )
+        ranked.sort(key=lambda item: -item.priority)
+
+        result = _UserPriorities(version, graphs, ranked)
+        with self._lock:
+            self._users[user_id] = result
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.cache_size:
+                self._users.popitem(last=False)
+        return result
+
+    def priorities(self, db: Session, user_id: int, subject: Optional[str] = None,
+                   available_only: bool = False) -> List[TopicPriority]:
+        """単元を優先度の高い順に返す"""
+        ranked = self._rank(db, user_id).ranked
+        if subject:
+            ranked = [item for item in ranked if item.subject == subject]
+        if available_only:
+            topics = self.available_topics(db)
+            ranked = [item for item in ranked if item.topic in topics.get(item.subject, ())]
+        return ranked
+
+    def pick(self, db: Session, user_id: int, subject: Optional[str] = None) -> Optional[Question]:
+        """優先度の高い単元から1問選ぶ（弱点がなければNone）"""
+        candidates = self.priorities(db, user_id, subject, available_only=True)[:WEAKNESS_TOP_K]
+        if not candidates:
+            return None
+        chosen = random.choices(candidates, weights=[item.priority for item in candidates])[0]
+        return sample_topic_question(db, chosen.subject, chosen.topic)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+                self._topics = None
+            else:
+                self._users.pop(user_id, None)
+
+
+def sample_topic_question(db: Session, subject: str, topic: str) -> Optional[Question]:
+    """単元の問題をランダムに1問選ぶ（ix_questions_subject_topic_id の範囲で id を引く）"""
+    low, high = db.execute(
+        select(func.min(Question.id), func.max(Question.id)).where(Question.subject == subject, Question.topic == topic)
+    ).one()
+    if low is None:
+        return None
+    return db.scalars(
+        select(Question)
+        .where(Question.subject == subject, Question.topic == topic, Question.id >= random.randint(low, high))
+        .order_by(Question.id.asc())
+        .limit(1)
+    ).first()
+
+
+weakness_engine = WeaknessEngine()
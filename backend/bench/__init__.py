@@ -0,0 +1,12 @@
+"""ローカル実行用のベンチマーク
+
+    cd backend
+    python -m bench.hotpath --users 200 --questions 5000 --concurrency 50
+    python -m bench.async_vs_threadpool --clients 500
+    python -m bench.startup --profile-startup
+    python -m bench.prerequisites --depths 4,16,64,256
+    python -m bench.reschedule --sizes 100000,1000000 --end-to-end
+    python -m bench.fsrs_fit --sizes 1000000,10000000
+
+DATABASE_URL（または --database-url）でSQLite・ローカルのPostgreSQLを切り替える。
+"""
@@ -0,0 +1,147 @@
+"""非同期エンドポイントとスレッドプール版（同期ハンドラ）の比較ベンチマーク
+
+同じ出題・採点ロジックを
+- async: app.main の AsyncSession（aiosqlite / asyncpg）版エンドポイント
+- threadpool: 同期 Session のハンドラ（Starlette のスレッドプール、既定40スレッドで実行）
+で呼び出し、多数の同時クライアントでの p50 / p99 レイテンシを比較する。
+アプリはプロセス内で httpx の ASGITransport 経由で呼び出す（ネットワークは含まない）。
+
+    cd backend
+    python -m bench.async_vs_threadpool --clients 500 --rounds 3
+    DATABASE_URL=postgresql://... python -m bench.async_vs_threadpool
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from bench.common import summarize, use_database
+
+
+def build_threadpool_app():
+    """app.main の出題・採点エンドポイントと同じ処理を同期ハンドラで実装したアプリ"""
+    from fastapi import Depends, FastAPI, HTTPException
+    from sqlalchemy.orm import Session
+
+    from app.answer_keys import answer_keys
+    from app.db import get_db
+    from app.grading import update_mastery
+    from app.main import AnswerIn, NextQuestionReq
+    from app.models import Attempt, Mastery, Question
+    from app.scheduler import select_next_question
+
+    threadpool_app = FastAPI()
+
+    @threadpool_app.post("/next-question")
+    def next_question(req: NextQuestionReq, db: Session = Depends(get_db)):
+        return {"question": select_next_question(db, req.user_id, req.subject)}
+
+    @threadpool_app.get("/questions/{question_id}")
+    def get_question(question_id: int, db: Session = Depends(get_db)):
+        question = db.get(Question, question_id)
+        if not question:
+            raise HTTPException(status_code=404, detail="Question not found")
+        return question
+
+    @threadpool_app.post("/questions/{question_id}/answer")
+    def grade_answer(question_id: int, answer_in: AnswerIn, db: Session = Depends(get_db)):
+        answer_key = answer_keys.get(db, question_id)
+        if not answer_key:
+            raise HTTPException(status_code=404, detail="Question not found")
+        is_correct = answer_key.check(answer_in.user_answer)
+        db.add(Attempt(user_id=1, question_id=question_id, correct=is_correct, seconds=answer_in.time_sec,
+                       cause=answer_in.mistake_type, created_at=datetime.now()))
+        mastery = db.get(Mastery, (1, question_id))
+        if not mastery:
+            mastery = Mastery(user_id=1, question_id=question_id, value=0.5, consecutive_correct=0, stability=1.0, next_review_at=datetime.now())
+            db.add(mastery)
+        update_mastery(mastery, is_correct, datetime.now())
+        db.commit()
+        return {"is_correct": is_correct, "correct_answer": answer_key.primary, "ai_explain": None}
+
+    return threadpool_app
+
+
+async def run_clients(app, clients: int, rounds: int) -> Dict:
+    """各クライアントが 出題→問題取得→解答 を rounds 回繰り返し、リクエストごとの所要時間を集計する"""
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+
+    async def request(client, method: str, url: str, **kwargs):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                errors += 1
+                return None
+            return response.json()
+        except Exception:
+            errors += 1
+            return None
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    async def session(client):
+        for _ in range(rounds):
+            picked = await request(client, "POST", "/next-question", json={"user_id": 1, "subject": "算数"})
+            question = (picked or {}).get("question")
+            if not question:
+                continue
+            await request(client, "GET", f"/questions/{question['id']}")
+            await request(client, "POST", f"/questions/{question['id']}/answer", json={"user_answer": "0", "time_sec": 10})
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(session(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    return {"elapsed_sec": round(elapsed, 3), **summarize(latencies, elapsed, errors)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500, help="同時クライアント数")
+    parser.add_argument("--rounds", type=int, default=3, help="クライアントごとの 出題→解答 の回数")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    use_database(None, os.path.join(tempfile.mkdtemp(prefix="zerobasics_bench_"), "bench.db"))
+
+    from app.db import engine, session_scope
+    from app.main import app
+    from app.migrations import upgrade
+    from app.seed import seed_basic, seed_math_topics
+
+    upgrade(engine)
+    with session_scope() as db:
+        seed_basic(db)
+        seed_math_topics(db)
+
+    results = {
+        "clients": args.clients,
+        "rounds": args.rounds,
+        "database": engine.dialect.name,
+        "threadpool": asyncio.run(run_clients(build_threadpool_app(), args.clients, args.rounds)),
+        "async": asyncio.run(run_clients(app, args.clients, args.rounds))
+    }
+
+    print(f"{'mode':<12}{'requests':>10}{'errors':>8}{'rps':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for mode in ("threadpool", "async"):
+        row = results[mode]
+        print(f"{mode:<12}{row['requests']:>10}{row['errors']:>8}{row['throughput_rps']:>10}{row['p50_ms']:>10}{row['p99_ms']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""ベンチマーク共通の集計処理"""
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_database(database_url: Optional[str], default_path: str) -> str:
+    """app.db を読み込む前に接続先を決める（未指定ならSQLiteの一時ファイル）"""
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    elif "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = "sqlite:///" + default_path
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return os.environ["DATABASE_URL"]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict:
+    """レイテンシ（秒）の一覧をスループットとパーセンタイル（ミリ秒）にまとめる"""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0
+    }
+
+
+def git_revision() -> Optional[str]:
+    """結果を比較するためのコミットID（gitがなければNone）"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,92 @@
+"""ベンチマーク用の合成データ
+
+既存のモデル（User / Question / Attempt / Mastery）に、指定した規模のデータを
+まとめて INSERT する。乱数のシードを固定すれば同じデータセットが再現できる。
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.models import Attempt, Mastery, Question, User
+
+SUBJECTS = ("算数", "理科", "社会")
+CHUNK_SIZE = 5000
+
+
+def _insert_chunks(db: Session, model, rows: List[Dict]) -> None:
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.execute(insert(model), rows[start:start + CHUNK_SIZE])
+
+
+def seed_dataset(db: Session, users: int, questions: int, attempts_per_user: int,
+                 mastery_per_user: int, due_fraction: float = 0.3, seed: int = 0) -> Dict:
+    """ユーザー・問題・解答履歴・習熟度を作成し、作成した件数とIDを返す"""
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    user_ids = list(db.scalars(
+        insert(User).returning(User.id),
+        [{"role": "child", "grade": rng.randint(4, 6)} for _ in range(users)]
+    ))
+
+    question_rows = []
+    for index in range(questions):
+        value = rng.randint(1, 9999)
+        question_rows.append({
+            "subject": SUBJECTS[index % len(SUBJECTS)],
+            "topic": f"bench-topic-{index % 50}",
+            "stem": f"ベンチマーク用の問題 {index}: {value} の答えは？",
+            "answer": {"primary": str(value), "variants": [str(value)]},
+            "difficulty": rng.choice((1.0, 2.0, 3.0)),
+            "source": "bench"
+        })
+    question_ids = list(db.scalars(insert(Question).returning(Question.id), question_rows))
+
+    attempt_rows = []
+    mastery_rows = []
+    per_user = min(mastery_per_user, len(question_ids))
+    for user_id in user_ids:
+        for _ in range(attempts_per_user):
+            attempt_rows.append({
+                "user_id": user_id,
+                "question_id": rng.choice(question_ids),
+                "correct": rng.random() < 0.6,
+                "seconds": rng.randint(10, 300),
+                "created_at": now - timedelta(minutes=rng.randint(1, 60 * 24 * 180))
+            })
+        for question_id in rng.sample(question_ids, per_user):
+            due = rng.random() < due_fraction
+            mastery_rows.append({
+                "user_id": user_id,
+                "question_id": question_id,
+                "value": round(rng.random(), 3),
+                "consecutive_correct": rng.randint(0, 4),
+                "stability": round(rng.uniform(0.7, 6.0), 3),
+                "last_review_at": now - timedelta(days=rng.randint(1, 30)),
+                "next_review_at": now - timedelta(hours=rng.randint(1, 240)) if due else now + timedelta(hours=rng.randint(1, 240))
+            })
+    _insert_chunks(db, Attempt, attempt_rows)
+    _insert_chunks(db, Mastery, mastery_rows)
+    db.commit()
+
+    return {
+        "users": len(user_ids),
+        "questions": len(question_ids),
+        "attempts": len(attempt_rows),
+        "mastery": len(mastery_rows),
+        "user_ids": user_ids
+    }
+
+
+def existing_dataset(db: Session) -> Dict:
+    """既存のデータをそのまま使う場合の件数とユーザーID"""
+    return {
+        "users": db.scalar(select(func.count()).select_from(User)),
+        "questions": db.scalar(select(func.count()).select_from(Question)),
+        "attempts": db.scalar(select(func.count()).select_from(Attempt)),
+        "mastery": db.scalar(select(func.count()).select_from(Mastery)),
+        "user_ids": list(db.scalars(select(User.id).order_by(User.id)))
+    }
@@ -0,0 +1,177 @@
+"""FSRSの重みの最適化（app.fsrs_optimizer）のスケーリング計測
+
+既定の重みを揺らした「真の重み」で学習者の解答を模擬し（復習は予定日の前後にばらつかせ、
+正誤は真の想起率で決める）、attempts に指定件数を書き込む。そのうえで別プロセスで
+optimize() を実行し、最適化（エポックごとにサーバーサイドカーソルから読み直す）の時間、最大メモリ使用量（RSS）、
+既定の重み・最適化後の重み・真の重みでの対数損失を表示する。
+
+    cd backend
+    python -m bench.fsrs_fit --sizes 1000000,10000000
+    python -m bench.fsrs_fit --sizes 1000000 --database-url postgresql://localhost/zerobasics_bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from bench.common import BACKEND_DIR, use_database
+
+# 1系列（ユーザー×問題）あたりの平均解答回数と、1ユーザーあたりの問題数
+ATTEMPTS_PER_SERIES = 8
+QUESTIONS = 100
+INSERT_CHUNK = 100000
+
+# 子プロセス: 最適化（書き込みなし）を実行して結果と最大RSSをJSONで出力
+_OPTIMIZE_SCRIPT = """
+import json, resource, sys
+from app.db import session_scope
+from app.fsrs_optimizer import optimize
+with session_scope() as db:
+    result = optimize(db, epochs=int(sys.argv[1]), path=None)
+result["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print("RESULT " + json.dumps(result))
+"""
+
+
+def true_weights(seed: int) -> List[float]:
+    import numpy as np
+    from app.fsrs import DEFAULT_WEIGHTS
+    from app.fsrs_optimizer import WEIGHT_BOUNDS
+
+    rng = np.random.default_rng(seed)
+    lower, upper = np.array(WEIGHT_BOUNDS).T
+    return np.clip(np.array(DEFAULT_WEIGHTS) * np.exp(rng.normal(0, 0.25, len(DEFAULT_WEIGHTS))), lower, upper).tolist()
+
+
+def simulate(size: int, weights: List[float], seed: int) -> Dict:
+    """系列順に並んだ解答履歴を模擬する（series / correct / timestamp）"""
+    import numpy as np
+    from app import fsrs
+
+    rng = np.random.default_rng(seed)
+    series = np.sort(rng.integers(0, max(1, size // ATTEMPTS_PER_SERIES), size))
+    starts = np.flatnonzero(np.r_[True, series[1:] != series[:-1]])
+    counts = np.diff(np.r_[starts, size])
+    position = np.arange(size) - np.repeat(starts, counts)
+    slot = np.repeat(np.arange(len(starts)), counts)
+    by_position = np.argsort(position, kind="stable")
+    bounds = np.searchsorted(position[by_position], np.arange(counts.max() + 1))
+
+    correct = np.zeros(size, dtype=bool)
+    timestamp = np.zeros(size)
+    stability = np.zeros(len(starts))
+    difficulty = np.zeros(len(starts))
+    last = datetime.now().timestamp() - rng.uniform(200, 400, len(starts)) * fsrs.SECONDS_PER_DAY
+    for k in range(counts.max()):
+        index = by_position[bounds[k]:bounds[k + 1]]
+        s = slot[index]
+        if k == 0:
+            c = rng.random(len(index)) < 0.7
+            stability[s] = np.where(c, weights[fsrs.GOOD - 1], weights[fsrs.AGAIN - 1])
+            difficulty[s] = np.clip(fsrs.init_difficulty(weights, np.where(c, fsrs.GOOD, fsrs.AGAIN), np.exp), 1, 10)
+            t = last[s]
+        else:
+            # 予定日（想起率90%）の前後に復習する（間隔は最大60日）
+            elapsed = np.minimum(stability[s] * np.exp(rng.normal(0, 0.7, len(index))), 60.0)
+            r = fsrs.retrievability(elapsed, stability[s])
+            c = rng.random(len(index)) < r
+            recall = fsrs.recall_stability(weights, difficulty[s], stability[s], r, np.exp)
+            forget = np.minimum(fsrs.forget_stability(weights, difficulty[s], stability[s], r, np.exp), stability[s])
+            stability[s] = np.maximum(np.where(c, recall, forget), fsrs.MIN_STABILITY)
+            difficulty[s] = np.clip(fsrs.next_difficulty(weights, difficulty[s], np.where(c, fsrs.GOOD, fsrs.AGAIN), np.exp), 1, 10)
+            t = last[s] + elapsed * fsrs.SECONDS_PER_DAY
+        correct[index] = c
+        timestamp[index] = t
+        last[s] = t
+    return {"series": series, "correct": correct, "timestamp": timestamp}
+
+
+def write_attempts(db, history: Dict, user_ids: List[int], question_ids: List[int]) -> None:
+    from sqlalchemy import insert
+    from app.models import Attempt
+
+    size = len(history["series"])
+    for start in range(0, size, INSERT_CHUNK):
+        series = history["series"][start:start + INSERT_CHUNK].tolist()
+        correct = history["correct"][start:start + INSERT_CHUNK].tolist()
+        timestamps = history["timestamp"][start:start + INSERT_CHUNK].tolist()
+        db.execute(insert(Attempt.__table__), [
+            {
+                "user_id": user_ids[value // QUESTIONS],
+                "question_id": question_ids[value % QUESTIONS],
+                "correct": is_correct,
+                "created_at": datetime.fromtimestamp(timestamp),
+            }
+            for value, is_correct, timestamp in zip(series, correct, timestamps)
+        ])
+        db.commit()
+
+
+def run_optimizer(epochs: int) -> Dict:
+    result = subprocess.run([sys.executable, "-c", _OPTIMIZE_SCRIPT, str(epochs)],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ.copy())
+    lines = [line for line in result.stdout.splitlines() if line.startswith("RESULT ")]
+    if result.returncode != 0 or not lines:
+        raise SystemExit(f"最適化に失敗しました:\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1][len("RESULT "):])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FSRSの重みの最適化のスケーリング計測")
+    parser.add_argument("--database-url", help="接続先（未指定ならDATABASE_URL、なければSQLiteの一時ファイル）")
+    parser.add_argument("--sizes", default="1000000,10000000", help="解答履歴の件数（カンマ区切り）")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    use_database(args.database_url, os.path.join(tempfile.mkdtemp(prefix="zerobasics_bench_"), "bench.db"))
+
+    from app.db import engine, session_scope
+    from app.fsrs import DEFAULT_WEIGHTS
+    from app.fsrs_optimizer import evaluate, iter_review_batches
+    from app.migrations import drop_schema, upgrade
+    from app.models import Question
+    from bench.dataset import seed_dataset
+    from sqlalchemy import select
+
+    weights = true_weights(args.seed)
+    rows = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        drop_schema(engine)
+        upgrade(engine)
+        history = simulate(size, weights, args.seed)
+        started = time.perf_counter()
+        with session_scope() as db:
+            series_count = int(history["series"][-1]) + 1
+            dataset = seed_dataset(db, -(-series_count // QUESTIONS), QUESTIONS, 0, 0, seed=args.seed)
+            question_ids = db.scalars(select(Question.id).order_by(Question.id)).all()
+            write_attempts(db, history, dataset["user_ids"], question_ids)
+        print(f"{size} attempts を作成（{time.perf_counter() - started:.0f}s）", flush=True)
+
+        result = run_optimizer(args.epochs)
+        with session_scope() as db:
+            true_loss = evaluate(weights, iter_review_batches(db))
+        rows.append((size, result, true_loss))
+        del history
+
+    print(f"\nepochs={args.epochs}")
+    header = (f"{'attempts':>10}{'reviews':>10}{'passes':>8}{'fit s':>9}{'max RSS MB':>12}"
+              f"{'loss default':>14}{'loss fitted':>13}{'loss true':>11}")
+    print(header)
+    print("-" * len(header))
+    for size, result, true_loss in rows:
+        print(f"{result['attempts']:>10}{result['reviews']:>10}{result['passes']:>8}{result['fit_seconds']:>9.1f}"
+              f"{result['max_rss_mb']:>12.0f}{result['initial_log_loss']:>14.4f}{result['fitted_log_loss']:>13.4f}"
+              f"{true_loss:>11.4f}")
+    print("\n既定の重み: " + ", ".join(f"{value:.3f}" for value in DEFAULT_WEIGHTS))
+    print("真の重み:   " + ", ".join(f"{value:.3f}" for value in weights))
+    print("最適化後:   " + ", ".join(f"{value:.3f}" for value in rows[-1][1]["weights"]))
+
+
+if __name__ == "__main__":
+    main()
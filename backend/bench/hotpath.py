@@ -0,0 +1,184 @@
+"""学習者のホットパス（出題→解答）の負荷ベンチマーク
+
+合成データを投入したうえで、各仮想クライアントが
+/next-question → /questions/{id}/answer を繰り返し、エンドポイント別の
+スループットとレイテンシのパーセンタイルを表示する。アプリはプロセス内で
+httpx の ASGITransport 経由で呼び出すため、サーバーの起動は不要。
+結果はJSONに保存し、--baseline で以前の結果（別コミット）と比較できる。
+
+    cd backend
+    python -m bench.hotpath --users 200 --questions 5000 --attempts-per-user 200 --concurrency 50
+    python -m bench.hotpath --database-url postgresql://localhost/zerobasics_bench --reset
+    python -m bench.hotpath --baseline bench/results/<前回>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+from bench.common import BACKEND_DIR, git_revision, summarize, use_database
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+
+
+async def drive(app, user_ids: List[int], concurrency: int, iterations: int,
+                correct_rate: float, subjects: List[str], seed: int) -> Dict:
+    """concurrency 個のクライアントで 出題→解答 を iterations 回ずつ実行する"""
+    import httpx
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    async def call(client, name: str, method: str, url: str, payload: Dict):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=payload)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        latencies[name].append(time.perf_counter() - started)
+        if not ok:
+            errors[name] += 1
+            return None
+        return response.json()
+
+    async def learner(client, index: int):
+        rng = random.Random(seed + index)
+        user_id = user_ids[index % len(user_ids)]
+        for _ in range(iterations):
+            subject = rng.choice(subjects) if subjects else None
+            picked = await call(client, "POST /next-question", "POST", "/next-question",
+                                {"user_id": user_id, "subject": subject})
+            question = (picked or {}).get("question")
+            if not question:
+                continue
+            answer = question.get("answer") or {}
+            user_answer = answer.get("primary", "") if rng.random() < correct_rate else "0"
+            await call(client, "POST /questions/{id}/answer", "POST", f"/questions/{question['id']}/answer",
+                       {"user_answer": user_answer, "time_sec": rng.randint(5, 120)})
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(learner(client, index) for index in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "elapsed_sec": round(elapsed, 3),
+        "overall": summarize(all_latencies, elapsed, sum(errors.values())),
+        "endpoints": {name: summarize(values, elapsed, errors[name]) for name, values in latencies.items()}
+    }
+
+
+def print_report(results: Dict, baseline: Dict = None) -> None:
+    header = f"{'endpoint':<34}{'requests':>9}{'errors':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = [("overall", results["overall"])] + sorted(results["endpoints"].items())
+    for name, row in rows:
+        print(f"{name:<34}{row['requests']:>9}{row['errors']:>7}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+    if not baseline:
+        return
+
+    print(f"\n比較対象: {baseline['meta'].get('git_revision')} ({baseline['meta'].get('timestamp')})")
+    for name, row in rows:
+        before = baseline["results"]["overall"] if name == "overall" else baseline["results"]["endpoints"].get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ("throughput_rps", "p50_ms", "p99_ms"):
+            if before[key]:
+                deltas.append(f"{key} {(row[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"{name:<34}{'  '.join(deltas)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="出題→解答ループの負荷ベンチマーク")
+    parser.add_argument("--database-url", help="接続先（未指定ならDATABASE_URL、なければSQLiteの一時ファイル）")
+    parser.add_argument("--reset", action="store_true", help="テーブルを削除して作り直す（ベンチマーク専用DBで使用）")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--attempts-per-user", type=int, default=100)
+    parser.add_argument("--mastery-per-user", type=int, default=200)
+    parser.add_argument("--due-fraction", type=float, default=0.3, help="復習期限を迎えている習熟度の割合")
+    parser.add_argument("--concurrency", type=int, default=50, help="同時クライアント数")
+    parser.add_argument("--iterations", type=int, default=20, help="クライアントごとの 出題→解答 の回数")
+    parser.add_argument("--correct-rate", type=float, default=0.6)
+    parser.add_argument("--subjects", default="算数,理科,社会,", help="出題科目（カンマ区切り、空要素は科目指定なし）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果のJSON（既定: bench/results/<日時>-<コミット>.json）")
+    parser.add_argument("--baseline", help="比較する以前の結果JSON")
+    args = parser.parse_args()
+
+    use_database(args.database_url, os.path.join(tempfile.mkdtemp(prefix="zerobasics_bench_"), "bench.db"))
+
+    from app.db import engine, session_scope
+    from app.main import app
+    from app.migrations import drop_schema, upgrade
+    from bench.dataset import existing_dataset, seed_dataset
+
+    if args.reset:
+        drop_schema(engine)
+    upgrade(engine)
+
+    with session_scope() as db:
+        dataset = existing_dataset(db)
+        if dataset["users"] == 0:
+            started = time.perf_counter()
+            dataset = seed_dataset(db, args.users, args.questions, args.attempts_per_user,
+                                   args.mastery_per_user, args.due_fraction, args.seed)
+            print(f"データ投入: users={dataset['users']} questions={dataset['questions']} "
+                  f"attempts={dataset['attempts']} mastery={dataset['mastery']} ({time.perf_counter() - started:.1f}秒)")
+        else:
+            print(f"既存データを使用: users={dataset['users']} questions={dataset['questions']}")
+    user_ids = dataset.pop("user_ids")
+
+    subjects = [subject or None for subject in args.subjects.split(",")]
+    results = asyncio.run(drive(app, user_ids, args.concurrency, args.iterations,
+                                args.correct_rate, subjects, args.seed))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "database": engine.dialect.name,
+            "python": platform.python_version()
+        },
+        "params": {
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "correct_rate": args.correct_rate,
+            "subjects": subjects,
+            "seed": args.seed
+        },
+        "dataset": dataset,
+        "results": results
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['meta']['git_revision'] or 'nogit'}-{engine.dialect.name}.json")
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""推移的な前提単元の取得（WITH RECURSIVE）のベンチマーク
+
+深さの異なる層状のグラフ（各層 --width 単元、各単元が前の層の --fan-in 単元を前提にもつ）を
+作成し、最下層の単元について全段の前提単元を取得する。
+prerequisite_closure（1回の再帰クエリ）と、単元ごとに前提単元を問い合わせる幅優先探索の
+クエリ数・レイテンシを比較する。再帰クエリは深さによらず1往復になる。
+
+    cd backend
+    python -m bench.prerequisites --depths 4,16,64,256
+    python -m bench.prerequisites --database-url postgresql://localhost/zerobasics_bench
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.common import use_database
+
+SUBJECT = "science"
+# ベンチマーク用の単元のid（既存の単元と重ならないよう大きな値から始める）
+ID_OFFSET = 1_000_000
+
+
+def remove_graph(db) -> None:
+    """ベンチマーク用の単元と辺を削除する"""
+    from sqlalchemy import delete
+    from app.models import ScienceDependency, TopicEdge
+
+    db.execute(delete(TopicEdge).where(TopicEdge.subject == SUBJECT, TopicEdge.to_id >= ID_OFFSET))
+    db.execute(delete(ScienceDependency).where(ScienceDependency.id >= ID_OFFSET))
+    db.commit()
+
+
+def build_graph(db, depth: int, width: int, fan_in: int, rng: random.Random) -> str:
+    """depth+1 層のグラフを作成し、最下層の単元名を返す"""
+    from sqlalchemy import insert
+    from app.models import ScienceDependency, TopicEdge
+
+    remove_graph(db)
+
+    layers: List[List[int]] = []
+    nodes = []
+    for level in range(depth + 1):
+        layer = [ID_OFFSET + level * width + position for position in range(width)]
+        layers.append(layer)
+        nodes.extend({"id": node, "domain": "総合", "topic_name": f"bench-prereq-{node}"} for node in layer)
+    edges = [
+        {"subject": SUBJECT, "from_id": prerequisite, "to_id": node}
+        for lower, upper in zip(layers, layers[1:])
+        for node in upper
+        for prerequisite in rng.sample(lower, min(fan_in, len(lower)))
+    ]
+    db.execute(insert(ScienceDependency), nodes)
+    db.execute(insert(TopicEdge), edges)
+    db.commit()
+    return f"bench-prereq-{layers[-1][0]}"
+
+
+def closure_per_node(db, topic_name: str) -> List[int]:
+    """比較用: 単元ごとに直接の前提単元を問い合わせる幅優先探索"""
+    from sqlalchemy import select
+    from app.models import ScienceDependency, TopicEdge
+
+    start = db.execute(select(ScienceDependency.id).where(ScienceDependency.topic_name == topic_name)).scalar()
+    seen = {start}
+    order = []
+    frontier = [start]
+    while frontier:
+        node = frontier.pop(0)
+        for (prerequisite,) in db.execute(
+            select(TopicEdge.from_id).where(TopicEdge.subject == SUBJECT, TopicEdge.to_id == node)
+        ):
+            if prerequisite not in seen:
+                seen.add(prerequisite)
+                order.append(prerequisite)
+                frontier.append(prerequisite)
+    return order
+
+
+def measure(engine, func, repeat: int) -> Dict:
+    from sqlalchemy import event
+
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        timings = []
+        result = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return {
+        "nodes": len(result),
+        "queries": len(statements) // repeat,
+        "median_ms": round(statistics.median(timings) * 1000, 2)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="推移的な前提単元の取得のベンチマーク")
+    parser.add_argument("--database-url", help="接続先（未指定ならDATABASE_URL、なければSQLiteの一時ファイル）")
+    parser.add_argument("--depths", default="4,16,64,256", help="グラフの深さ（カンマ区切り）")
+    parser.add_argument("--width", type=int, default=4, help="各層の単元数")
+    parser.add_argument("--fan-in", type=int, default=2, help="各単元の前提単元数")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    use_database(args.database_url, os.path.join(tempfile.mkdtemp(prefix="zerobasics_bench_"), "bench.db"))
+
+    from app.db import engine, session_scope
+    from app.migrations import upgrade
+    from app.topic_edges import prerequisite_closure
+
+    upgrade(engine)
+    rng = random.Random(args.seed)
+
+    header = f"{'depth':>6}{'nodes':>8}{'cte queries':>13}{'cte ms':>10}{'per-node queries':>18}{'per-node ms':>13}"
+    print(header)
+    print("-" * len(header))
+    with session_scope() as db:
+        for depth in (int(value) for value in args.depths.split(",")):
+            target = build_graph(db, depth, args.width, args.fan_in, rng)
+            cte = measure(engine, lambda: prerequisite_closure(db, SUBJECT, target), args.repeat)
+            naive = measure(engine, lambda: closure_per_node(db, target), args.repeat)
+            if cte["nodes"] != naive["nodes"]:
+                raise SystemExit(f"結果が一致しません（depth={depth}: {cte['nodes']} != {naive['nodes']}）")
+            print(f"{depth:>6}{cte['nodes']:>8}{cte['queries']:>13}{cte['median_ms']:>10}"
+                  f"{naive['queries']:>18}{naive['median_ms']:>13}")
+        remove_graph(db)
+
+
+if __name__ == "__main__":
+    main()
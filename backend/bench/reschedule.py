@@ -0,0 +1,114 @@
+"""Masteryの一括再計算（FSRS）のベンチマーク
+
+解答履歴を合成して、Scheduler.replay（NumPyで全系列を一括計算）と、1解答ずつ
+Scheduler.review を呼ぶ再生の処理時間を比較する。1解答ずつの再生は --scalar-limit 件まで
+実行し、それ以上は処理速度から推定する（表の ~ 付きの値）。--end-to-end ではDBに解答履歴を作成し、
+recompute_mastery（読み込み・計算・upsert）全体の時間も計測する。
+
+    cd backend
+    python -m bench.reschedule --sizes 100000,1000000,5000000
+    python -m bench.reschedule --sizes 1000000 --end-to-end --users 2000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict
+
+from bench.common import use_database
+
+# 1系列（ユーザー×問題）あたりの平均解答回数
+ATTEMPTS_PER_SERIES = 8
+
+
+def synthetic_history(size: int, seed: int) -> Dict:
+    """系列順・時刻順に並んだ解答履歴の配列を作る（約180日間）"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    group = np.sort(rng.integers(0, max(1, size // ATTEMPTS_PER_SERIES), size))
+    timestamps = datetime.now().timestamp() - rng.uniform(0, 180 * 86400, size)
+    order = np.lexsort((timestamps, group))
+    return {"group": group, "correct": rng.random(size) < 0.7, "timestamp": timestamps[order]}
+
+
+def replay_scalar(scheduler, history: Dict, limit: int) -> int:
+    """比較用: 1解答ずつ Scheduler.review で再生する（limit件まで）"""
+    states = {}
+    group = history["group"][:limit].tolist()
+    correct = history["correct"][:limit].tolist()
+    timestamps = history["timestamp"][:limit].tolist()
+    for series, is_correct, timestamp in zip(group, correct, timestamps):
+        state = states.get(series)
+        if state is None:
+            state = states[series] = SimpleNamespace(last_review_at=None, stability=1.0, difficulty=None,
+                                                     consecutive_correct=0, value=0.5, next_review_at=None)
+        scheduler.review(state, is_correct, datetime.fromtimestamp(timestamp))
+    return len(group)
+
+
+def compare_compute(sizes, scalar_limit: int, repeat: int, seed: int) -> None:
+    from app.fsrs import scheduler
+
+    header = f"{'attempts':>12}{'series':>10}{'replay ms':>12}{'scalar ms':>14}{'speedup':>10}"
+    print(header)
+    print("-" * len(header))
+    for size in sizes:
+        history = synthetic_history(size, seed)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            state = scheduler.replay(history["group"], history["correct"], history["timestamp"])
+            timings.append(time.perf_counter() - started)
+        vectorized = statistics.median(timings)
+
+        started = time.perf_counter()
+        replayed = replay_scalar(scheduler, history, scalar_limit)
+        scalar = (time.perf_counter() - started) * size / replayed
+        estimated = "~" if replayed < size else ""
+        print(f"{size:>12}{len(state['first']):>10}{vectorized * 1000:>12.0f}"
+              f"{estimated + format(scalar * 1000, '.0f'):>14}{scalar / vectorized:>9.0f}x")
+
+
+def end_to_end(users: int, questions: int, attempts_per_user: int, seed: int) -> None:
+    from app.db import engine, session_scope
+    from app.migrations import drop_schema, upgrade
+    from app.reschedule import recompute_mastery
+    from bench.dataset import seed_dataset
+
+    drop_schema(engine)
+    upgrade(engine)
+    with session_scope() as db:
+        started = time.perf_counter()
+        dataset = seed_dataset(db, users, questions, attempts_per_user, mastery_per_user=0, seed=seed)
+        print(f"\n{dataset['attempts']} attempts を作成（{time.perf_counter() - started:.1f}s）")
+        result = recompute_mastery(db)
+    print(f"recompute_mastery: {result['users']} users / {result['attempts']} attempts → "
+          f"{result['mastery_rows']} mastery rows in {result['seconds']}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Masteryの一括再計算のベンチマーク")
+    parser.add_argument("--database-url", help="接続先（未指定ならDATABASE_URL、なければSQLiteの一時ファイル）")
+    parser.add_argument("--sizes", default="100000,1000000", help="解答履歴の件数（カンマ区切り）")
+    parser.add_argument("--scalar-limit", type=int, default=200000, help="1解答ずつの再生を実際に行う件数")
+    parser.add_argument("--repeat", type=int, default=3, help="一括計算の計測回数（中央値を表示）")
+    parser.add_argument("--end-to-end", action="store_true", help="DBの読み込み・upsertを含めて計測する")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=500)
+    parser.add_argument("--attempts-per-user", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    use_database(args.database_url, os.path.join(tempfile.mkdtemp(prefix="zerobasics_bench_"), "bench.db"))
+
+    compare_compute([int(value) for value in args.sizes.split(",")], args.scalar_limit, args.repeat, args.seed)
+    if args.end_to_end:
+        end_to_end(args.users, args.questions, args.attempts_per_user, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""起動コストの計測
+
+既定では `python -X importtime` で app.main を読み込み、モジュール（パッケージ）別の
+読み込み時間を表示する。OCR・PDF・LLMのライブラリが起動時に読み込まれていないかも確認する。
+--profile-startup では新しいプロセスを起動してから最初のリクエストに応答するまでの時間
+（time-to-first-request）を計測する。
+
+    cd backend
+    python -m bench.startup --top 25
+    python -m bench.startup --profile-startup --runs 5
+    python -m bench.startup --profile-startup --server uvicorn --path /health
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from bench.common import BACKEND_DIR, use_database
+
+HEAVY_MODULES = ("PIL", "PyPDF2", "pdfplumber", "pytesseract", "pdf2image", "openai")
+
+# --server asgi の子プロセス: 読み込み→startupイベント→最初のリクエストを計測してJSONを出力
+_ASGI_PROFILE_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main as main
+imported = time.perf_counter()
+import httpx
+
+async def run():
+    await main.app.router.startup()
+    ready = time.perf_counter()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://profile") as client:
+        response = await client.request(sys.argv[1], sys.argv[2], json=json.loads(sys.argv[3]) if sys.argv[3] else None)
+    answered = time.perf_counter()
+    await main.app.router.shutdown()
+    return ready, answered, response.status_code
+
+ready, answered, status = asyncio.run(run())
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print("PROFILE " + json.dumps({{
+    "import_sec": imported - started,
+    "startup_sec": ready - imported,
+    "first_request_sec": answered - ready,
+    "status": status,
+    "heavy_modules_loaded": heavy
+}}))
+""".format(heavy=HEAVY_MODULES)
+
+
+def import_costs() -> List[Tuple[str, int, int, int]]:
+    """app.main を新しいプロセスで読み込み、(モジュール, 自身のμs, 累計μs, 深さ) の一覧を返す"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ.copy())
+    if result.returncode != 0:
+        raise SystemExit(f"app.main の読み込みに失敗しました:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def print_import_report(rows: List[Tuple[str, int, int, int]], top: int) -> None:
+    # 自身の時間をトップレベルのパッケージ単位で合計する（アプリのモジュールは個別に表示）
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        key = name if name.startswith("app.") else name.split(".")[0]
+        by_package[key] += self_us
+    total_us = sum(by_package.values())
+
+    print(f"app.main の読み込み: {total_us / 1000:.1f}ms（{len(rows)}モジュール）\n")
+    header = f"{'module / package':<40}{'self ms':>10}{'share':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{name:<40}{self_us / 1000:>10.1f}{self_us / total_us * 100:>7.1f}%")
+
+    loaded = sorted({name.split(".")[0] for name, _, _, _ in rows} & set(HEAVY_MODULES))
+    if loaded:
+        print(f"\n警告: 起動時に重いライブラリが読み込まれています: {', '.join(loaded)}")
+    else:
+        print(f"\n起動時に読み込まれていない重いライブラリ: {', '.join(HEAVY_MODULES)}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def profile_asgi(method: str, path: str, payload: str) -> Dict:
+    """新しいプロセスでアプリを読み込み、ASGIで最初のリクエストに応答するまでを計測する"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", _ASGI_PROFILE_SCRIPT, method, path, payload],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ.copy())
+    total = time.perf_counter() - started
+    lines = [line for line in result.stdout.splitlines() if line.startswith("PROFILE ")]
+    if result.returncode != 0 or not lines:
+        raise SystemExit(f"計測に失敗しました:\n{result.stderr[-2000:]}")
+    profile = json.loads(lines[-1][len("PROFILE "):])
+    profile["time_to_first_request_sec"] = total
+    return profile
+
+
+def profile_uvicorn(method: str, path: str, payload: str, timeout: float) -> Dict:
+    """uvicorn を起動し、最初のリクエストが成功するまでの時間を計測する"""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"],
+                              cwd=BACKEND_DIR, env=os.environ.copy(),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        data = payload.encode() if payload else None
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise SystemExit(f"uvicorn が終了しました（終了コード {server.returncode}）")
+            request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data, method=method,
+                                             headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                time.sleep(0.01)
+                continue
+            return {"time_to_first_request_sec": time.perf_counter() - started, "status": status}
+        raise SystemExit(f"{timeout}秒以内に応答がありませんでした")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="起動時の読み込みコストと time-to-first-request の計測")
+    parser.add_argument("--database-url", help="接続先（未指定ならDATABASE_URL、なければSQLiteの一時ファイル）")
+    parser.add_argument("--top", type=int, default=20, help="表示するモジュール数")
+    parser.add_argument("--profile-startup", action="store_true", help="プロセス起動から最初の応答までを計測する")
+    parser.add_argument("--server", choices=("asgi", "uvicorn"), default="asgi",
+                        help="asgi: プロセス内でASGI呼び出し、uvicorn: 実際にサーバーを起動してHTTPで呼び出す")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/health", help="最初に呼び出すエンドポイント")
+    parser.add_argument("--payload", default="", help="リクエストボディ（JSON）")
+    parser.add_argument("--runs", type=int, default=3, help="--profile-startup の計測回数")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    use_database(args.database_url, os.path.join(tempfile.mkdtemp(prefix="zerobasics_startup_"), "startup.db"))
+
+    if not args.profile_startup:
+        print_import_report(import_costs(), args.top)
+        return
+
+    runs = []
+    for run in range(args.runs):
+        if args.server == "uvicorn":
+            profile = profile_uvicorn(args.method, args.path, args.payload, args.timeout)
+        else:
+            profile = profile_asgi(args.method, args.path, args.payload)
+        runs.append(profile)
+        phases = "  ".join(f"{key[:-4]}={profile[key] * 1000:.0f}ms" for key in ("import_sec", "startup_sec", "first_request_sec") if key in profile)
+        print(f"run {run + 1}: time_to_first_request={profile['time_to_first_request_sec'] * 1000:.0f}ms "
+              f"status={profile['status']}  {phases}")
+        if profile.get("heavy_modules_loaded"):
+            print(f"  警告: 重いライブラリが読み込まれています: {', '.join(profile['heavy_modules_loaded'])}")
+
+    values = [profile["time_to_first_request_sec"] * 1000 for profile in runs]
+    print(f"\n{args.method} {args.path}: time-to-first-request 中央値 {statistics.median(values):.0f}ms "
+          f"（最小 {min(values):.0f}ms / 最大 {max(values):.0f}ms, {len(values)}回）")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,10 @@ Database migration script for PostgreSQL
 """
 import os
 import sys
-from sqlalchemy import create_engine, text
-from app.db import Base, engine, SessionLocal
-from app.seed import (
-    seed_basic, seed_math_topics, seed_science_topics, seed_social_topics,
-    seed_math_dependencies, seed_science_dependencies, seed_social_dependencies
-)
+from sqlalchemy import text
+from app.db import engine, SessionLocal
+from app.migrations import upgrade
+from app.seed import seed_all
 
 def check_database_connection():
     """データベース接続を確認"""
@@ -23,70 +21,15 @@ def check_database_connection():
         print(f"❌ Database connection failed: {e}")
         return False
 
-def create_tables():
-    """テーブルを作成"""
+def apply_migrations():
+    """未適用のスキーママイグレーションを適用（app/migrations.py）"""
     try:
-        print("Creating tables...")
-        Base.metadata.create_all(bind=engine)
-        print("✅ Tables created successfully")
+        print("Applying schema migrations...")
+        applied = upgrade(engine)
+        print(f"✅ Schema is up to date ({len(applied)} migration(s) applied)")
         return True
     except Exception as e:
-        print(f"❌ Failed to create tables: {e}")
-        return False
-
-def remove_next_topics_columns():
-    """next_topics列を削除するマイグレーション"""
-    try:
-        print("Removing next_topics columns...")
-        with engine.connect() as conn:
-            # SQLiteの場合
-            if "sqlite" in str(engine.url).lower():
-                # SQLiteではALTER TABLE DROP COLUMNを直接サポートしていないため、
-                # テーブルを再作成する必要があります
-                print("⚠️  SQLite detected. Recreating tables to remove next_topics columns...")
-                
-                # 既存のデータをバックアップ
-                math_deps = conn.execute(text("SELECT id, topic_name, prerequisite_topic, topic_id FROM math_dependencies")).fetchall()
-                science_deps = conn.execute(text("SELECT id, domain, topic_name, prerequisite_topics, topic_id FROM science_dependencies")).fetchall()
-                social_deps = conn.execute(text("SELECT id, domain, topic_name, prerequisite_topics, topic_id FROM social_dependencies")).fetchall()
-                
-                # 古いテーブルを削除
-                conn.execute(text("DROP TABLE IF EXISTS math_dependencies"))
-                conn.execute(text("DROP TABLE IF EXISTS science_dependencies"))
-                conn.execute(text("DROP TABLE IF EXISTS social_dependencies"))
-                
-                # 新しいテーブルを作成
-                Base.metadata.create_all(bind=engine)
-                
-                # データを復元
-                for dep in math_deps:
-                    # 算数の依存関係にdomainフィールドを追加（デフォルトは"数と計算"）
-                    conn.execute(text(
-                        "INSERT INTO math_dependencies (id, domain, topic_name, prerequisite_topic, topic_id) VALUES (:id, :domain, :topic_name, :prerequisite_topic, :topic_id)"
-                    ), {"id": dep[0], "domain": "数と計算", "topic_name": dep[1], "prerequisite_topic": dep[2], "topic_id": dep[3]})
-                
-                for dep in science_deps:
-                    conn.execute(text(
-                        "INSERT INTO science_dependencies (id, domain, topic_name, prerequisite_topics, topic_id) VALUES (:id, :domain, :topic_name, :prerequisite_topics, :topic_id)"
-                    ), {"id": dep[0], "domain": dep[1], "topic_name": dep[2], "prerequisite_topics": dep[3], "topic_id": dep[4]})
-                
-                for dep in social_deps:
-                    conn.execute(text(
-                        "INSERT INTO social_dependencies (id, domain, topic_name, prerequisite_topics, topic_id) VALUES (:id, :domain, :topic_name, :prerequisite_topics, :topic_id)"
-                    ), {"id": dep[0], "domain": dep[1], "topic_name": dep[2], "prerequisite_topics": dep[3], "topic_id": dep[4]})
-                
-            else:
-                # PostgreSQLの場合
-                conn.execute(text("ALTER TABLE math_dependencies DROP COLUMN IF EXISTS next_topic"))
-                conn.execute(text("ALTER TABLE science_dependencies DROP COLUMN IF EXISTS next_topics"))
-                conn.execute(text("ALTER TABLE social_dependencies DROP COLUMN IF EXISTS next_topics"))
-            
-            conn.commit()
-            print("✅ next_topics columns removed successfully")
-            return True
-            
-    except Exception as e:
-        print(f"❌ Failed to remove next_topics columns: {e}")
+        print(f"❌ Failed to apply migrations: {e}")
         return False
 
 def verify_tables():
@@ -114,26 +57,7 @@ def seed_database():
     try:
         print("Seeding database...")
         
-        seed_basic(db)
-        print("✅ Basic data seeded")
-        
-        seed_math_topics(db)
-        print("✅ Math topics seeded")
-        
-        seed_science_topics(db)
-        print("✅ Science topics seeded")
-        
-        seed_social_topics(db)
-        print("✅ Social topics seeded")
-        
-        seed_math_dependencies(db)
-        print("✅ Math dependencies seeded")
-        
-        seed_science_dependencies(db)
-        print("✅ Science dependencies seeded")
-        
-        seed_social_dependencies(db)
-        print("✅ Social dependencies seeded")
+        seed_all(db)
         
         print("✅ All seeding completed successfully")
         return True
@@ -153,19 +77,15 @@ def main():
     if not check_database_connection():
         sys.exit(1)
     
-    # Step 2: Remove next_topics columns
-    if not remove_next_topics_columns():
-        print("⚠️  Failed to remove next_topics columns, but continuing...")
-    
-    # Step 3: Create tables (if they don't exist)
-    if not create_tables():
+    # Step 2: Apply schema migrations (tables, columns, next_topics removal)
+    if not apply_migrations():
         sys.exit(1)
     
-    # Step 4: Verify tables
+    # Step 3: Verify tables
     if not verify_tables():
         print("⚠️  Some tables are missing, but continuing...")
     
-    # Step 5: Seed database
+    # Step 4: Seed database
     if not seed_database():
         sys.exit(1)
     
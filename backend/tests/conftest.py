@@ -0,0 +1,30 @@
+"""テスト用の設定（一時ファイルのSQLiteを使い、テストごとにスキーマを作り直す）"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="zerobasics_test_"), "test.db"))
+os.environ.setdefault("MIGRATE_ON_BOOT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from app.answer_keys import answer_keys  # noqa: E402
+from app.db import Base, SessionLocal, engine  # noqa: E402
+from app.due_queue import due_queues  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    answer_keys.clear()
+    due_queues.clear()
+    session = SessionLocal()
+    session.add(User(id=1, role="child"))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,51 @@
+"""解答キーの正規化（単位の扱い）と、読めない解答キーの扱い"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.answer_keys import AnswerKey
+from app.grading import grade_batch
+from app.models import Question
+
+
+@pytest.mark.parametrize("primary, user_answer, expected", [
+    ("2分", "2分", True),
+    ("2分", "２ 分", True),
+    ("2分", "2", True),
+    ("2分", "2時間", False),
+    ("3km", "3m", False),
+    ("3km", "3KM", True),
+    ("12cm2", "12cm", False),
+    ("1,200円", "1200", True),
+    ("5", "5個", False),
+])
+def test_units_must_match_the_key(primary, user_answer, expected):
+    assert AnswerKey.compile({"primary": primary}).check(user_answer) is expected
+
+
+def test_variants_keep_their_own_units():
+    answer_key = AnswerKey.compile({"primary": "120分", "variants": ["2時間"]})
+    assert answer_key.check("2時間")
+    assert answer_key.check("2")
+    assert not answer_key.check("2分")
+
+
+@pytest.mark.parametrize("raw", ["{not json", '{"variants": ["1"]}', "[1, 2]", '"1"', {"primary": "1", "variants": 3}])
+def test_malformed_answer_is_reported_not_raised(raw):
+    answer_key = AnswerKey.compile(raw)
+    assert answer_key.error is not None
+    assert not answer_key.check("1")
+
+
+def test_grade_batch_reports_malformed_answer_on_that_item_only(db):
+    good = Question(subject="算数", topic="速さの基礎", stem="ok", answer={"primary": "1"}, difficulty=1, source="test")
+    bad = Question(subject="算数", topic="速さの基礎", stem="bad", answer='{"variants": ["1"]}', difficulty=1,
+                   source="test")
+    db.add_all([good, bad])
+    db.commit()
+
+    items = [SimpleNamespace(question_id=question_id, user_answer="1", time_sec=None, mistake_type=None,
+                             answered_at=None) for question_id in (bad.id, good.id)]
+    results = grade_batch(db, 1, items)
+    assert results[0] == {"question_id": bad.id, "error": "Invalid answer key"}
+    assert results[1]["is_correct"] is True
@@ -0,0 +1,56 @@
+"""FSRSの重みの最適化で解答履歴をチャンク・ミニバッチに分けて読む処理"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.fsrs import DEFAULT_WEIGHTS
+from app.fsrs_optimizer import evaluate, fit, iter_review_batches
+from app.models import Attempt, Question
+
+
+def add_history(db):
+    questions = [Question(subject="算数", topic="速さの基礎", stem=f"q{i}", answer={"primary": "1"}, difficulty=1,
+                          source="test") for i in range(4)]
+    db.add_all(questions)
+    db.flush()
+    rng = np.random.default_rng(0)
+    base = datetime(2026, 1, 1, 9, 0, 0)
+    # 系列の長さがばらばらで、1系列がミニバッチより長いものを含む
+    for question, count in zip(questions, (3, 1, 40, 9)):
+        days = np.cumsum(rng.uniform(0.01, 10, count))
+        db.add_all(Attempt(user_id=1, question_id=question.id, correct=bool(rng.random() < 0.7),
+                           created_at=base + timedelta(days=float(day))) for day in days)
+    db.commit()
+
+
+def whole_log(db):
+    batches = list(iter_review_batches(db, chunk_size=10 ** 6, batch_size=10 ** 6))
+    assert len(batches) == 1
+    return batches[0]
+
+
+@pytest.mark.parametrize("chunk_size, batch_size", [(1, 1), (2, 5), (7, 4), (5, 13), (53, 8), (100, 30)])
+def test_streamed_batches_cover_the_log_without_splitting_series(db, chunk_size, batch_size):
+    add_history(db)
+    expected = whole_log(db)
+    batches = list(iter_review_batches(db, chunk_size, batch_size))
+
+    assert all(log.first[0] for log in batches)
+    for field in ("first", "correct", "elapsed"):
+        assert np.array_equal(np.concatenate([getattr(log, field) for log in batches]), getattr(expected, field))
+    assert evaluate(DEFAULT_WEIGHTS, batches) == pytest.approx(evaluate(DEFAULT_WEIGHTS, [expected]))
+
+
+def test_fit_reads_batches_each_epoch(db):
+    add_history(db)
+    opened = []
+
+    def open_batches():
+        opened.append(True)
+        return iter_review_batches(db, chunk_size=6, batch_size=10)
+
+    weights, history = fit(open_batches, DEFAULT_WEIGHTS, epochs=3, shuffle=2)
+    assert len(opened) == 3
+    assert len(history) == 3 and all(np.isfinite(history))
+    assert len(weights) == len(DEFAULT_WEIGHTS)
@@ -0,0 +1,126 @@
+"""一括採点（grade_batch）と履歴からの再計算・単元別の集計の作り直しの整合性"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from app import grading
+from app.grading import grade_batch
+from app.models import Mastery, Question, User, UserTopicStat
+from app.reschedule import recompute_mastery
+from app.topic_stats import rebuild_topic_stats
+
+BASE = datetime(2026, 1, 1, 9, 0, 0)
+
+
+def add_questions(db):
+    questions = [
+        Question(subject="算数", topic=topic, stem=f"{topic}{i}", answer={"primary": "1"}, difficulty=1, source="test")
+        for topic in ("旅人算", "速さの基礎")
+        for i in range(2)
+    ]
+    db.add_all(questions)
+    db.commit()
+    return [question.id for question in questions]
+
+
+def answer(question_id, days, correct, seconds=None):
+    return SimpleNamespace(question_id=question_id, user_answer="1" if correct else "2", time_sec=seconds,
+                           mistake_type=None, answered_at=BASE + timedelta(days=days))
+
+
+def grade_unordered(db, question_ids):
+    """順不同の一括採点と、保存済みの最終解答より前の解答を含む一括採点"""
+    a, b, c, d = question_ids
+    first = [answer(a, 5, True, 20), answer(b, 1, False), answer(a, 0, False, 35), answer(c, 3, True, 12),
+             answer(a, 2, True), answer(b, 6, True, 18), answer(d, 4, False, 40)]
+    results = grade_batch(db, 1, first)
+    assert [result["question_id"] for result in results] == [item.question_id for item in first]
+    assert [result["is_correct"] for result in results] == [item.user_answer == "1" for item in first]
+    grade_batch(db, 1, [answer(a, 1, True), answer(c, 9, False, 25), answer(b, 3, True), answer(d, 4, True)])
+
+
+def mastery_snapshot(db, user_id=1):
+    db.expire_all()
+    return {
+        row.question_id: (row.value, row.stability, row.difficulty, row.consecutive_correct,
+                          row.last_review_at.timestamp(), row.next_review_at.timestamp())
+        for row in db.scalars(select(Mastery).where(Mastery.user_id == user_id))
+    }
+
+
+def stats_snapshot(db, user_id=1):
+    db.expire_all()
+    return {
+        (row.subject, row.topic): (row.attempts, row.correct, row.seconds_total, row.seconds_count,
+                                   row.mastery_count, row.mastery_sum)
+        for row in db.scalars(select(UserTopicStat).where(UserTopicStat.user_id == user_id))
+    }
+
+
+def assert_same_mastery(actual, expected):
+    assert actual.keys() == expected.keys()
+    for question_id, state in actual.items():
+        assert state == pytest.approx(expected[question_id], rel=1e-9, abs=1e-3), question_id
+
+
+def assert_same_stats(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, counters in actual.items():
+        assert counters == pytest.approx(expected[key], rel=1e-9), key
+
+
+def test_grade_batch_matches_recompute_on_unordered_batch(db):
+    grade_unordered(db, add_questions(db))
+    graded = mastery_snapshot(db)
+
+    recompute_mastery(db, [1])
+    recomputed = mastery_snapshot(db)
+
+    assert_same_mastery(graded, recomputed)
+
+
+def test_out_of_order_batches_match_in_order_submission(db, monkeypatch):
+    db.add(User(id=2, role="child"))
+    db.commit()
+    a, b, c, d = add_questions(db)
+    items = [answer(a, 0, False, 35), answer(b, 1, False), answer(a, 2, True), answer(c, 3, True, 12),
+             answer(d, 4, False, 40), answer(a, 5, True, 20), answer(b, 6, True, 18), answer(c, 9, False, 25)]
+
+    replayed = []
+    replay_history = grading.replay_history
+
+    def recording_replay(db, user_id, question_id, *args):
+        replayed.append((user_id, question_id))
+        return replay_history(db, user_id, question_id, *args)
+
+    monkeypatch.setattr(grading, "replay_history", recording_replay)
+
+    # ユーザー1: 1問ずつ解答順に送信（2回目以降は既存のMasteryへのupsert）
+    for item in items:
+        grade_batch(db, 1, [item])
+    assert replayed == []
+
+    # ユーザー2: 後の解答を先に、前の解答を順不同で後から送信（a・b・c は履歴から再生し直す）
+    grade_batch(db, 2, [items[i] for i in (7, 5, 6, 4)])
+    grade_batch(db, 2, [items[i] for i in (2, 0, 3, 1)])
+    assert sorted(replayed) == [(2, a), (2, b), (2, c)]
+
+    assert_same_mastery(mastery_snapshot(db, 2), mastery_snapshot(db, 1))
+    assert_same_stats(stats_snapshot(db, 2), stats_snapshot(db, 1))
+
+
+
+def test_incremental_topic_stats_match_rebuild(db):
+    grade_unordered(db, add_questions(db))
+    incremental = stats_snapshot(db)
+    assert set(incremental) == {("算数", "旅人算"), ("算数", "速さの基礎")}
+
+    rebuild_topic_stats(db, [1])
+    db.commit()
+    assert_same_stats(incremental, stats_snapshot(db))
+
+    # 解答履歴から再計算したMasteryで作り直した集計とも一致する
+    recompute_mastery(db, [1])
+    assert_same_stats(incremental, stats_snapshot(db))
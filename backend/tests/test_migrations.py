@@ -0,0 +1,33 @@
+"""マイグレーションを空のDBから順に適用したスキーマが、現在のモデルと一致すること"""
+from sqlalchemy import create_engine, inspect
+
+from app.db import Base
+from app.migrations import LATEST_VERSION, current_version, upgrade
+
+
+def describe(engine):
+    inspector = inspect(engine)
+    return {
+        table: {
+            "columns": sorted((c["name"], str(c["type"]), c["nullable"]) for c in inspector.get_columns(table)),
+            "indexes": sorted((i["name"], tuple(i["column_names"]), bool(i["unique"]))
+                              for i in inspector.get_indexes(table)),
+            "primary_key": inspector.get_pk_constraint(table)["constrained_columns"],
+        }
+        for table in inspector.get_table_names()
+        if table != "schema_version"
+    }
+
+
+def test_upgrade_from_empty_matches_models(tmp_path):
+    migrated = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    created = create_engine(f"sqlite:///{tmp_path / 'created.db'}")
+    try:
+        upgrade(migrated)
+        Base.metadata.create_all(created)
+        assert current_version(migrated) == LATEST_VERSION
+        assert describe(migrated) == describe(created)
+        assert upgrade(migrated) == []
+    finally:
+        migrated.dispose()
+        created.dispose()
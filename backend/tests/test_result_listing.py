@@ -0,0 +1,68 @@
+"""テスト結果一覧のキーセットページング（before=<created_at,id>）"""
+from datetime import datetime, timedelta
+
+from app import models
+from app.result_listing import encode_cursor, list_test_results, parse_cursor
+
+
+def add_results(db):
+    # 同じ秒に作られた結果（server_default）と、時刻を指定した結果を混ぜる
+    results = [models.TestResult(user_id=1, subject="算数", test_name=f"same-second-{i}") for i in range(5)]
+    base = datetime(2026, 1, 1, 9, 0, 0, 250000)
+    results += [
+        models.TestResult(user_id=1, subject="算数", test_name=f"dated-{i}", created_at=base + timedelta(minutes=i % 3))
+        for i in range(6)
+    ]
+    results.append(models.TestResult(user_id=2, subject="算数", test_name="other-user"))
+    db.add_all(results)
+    db.flush()
+    db.add_all(models.TestResultDetail(test_result_id=result.id, topic="速さの基礎", correct_count=1, total_count=2)
+               for result in results)
+    db.commit()
+
+
+def page_through(db, limit, summary=False):
+    pages = []
+    cursor = None
+    while True:
+        results, has_more = list_test_results(db, 1, cursor, limit, summary)
+        pages.append([result.id for result in results])
+        if not has_more:
+            return pages
+        cursor = parse_cursor(encode_cursor(results[-1]))
+
+
+def test_pages_cover_every_result_once_in_order(db):
+    add_results(db)
+    everything, has_more = list_test_results(db, 1, limit=100)
+    assert not has_more
+    expected = [result.id for result in everything]
+    keys = [(result.created_at, result.id) for result in everything]
+    assert keys == sorted(keys, reverse=True)
+    assert len(expected) == 11
+
+    for limit in (1, 2, 3, 4, 11):
+        pages = page_through(db, limit)
+        assert all(len(page) == limit for page in pages[:-1])
+        assert [result_id for page in pages for result_id in page] == expected
+
+
+def test_cursor_is_stable(db):
+    add_results(db)
+    first, _ = list_test_results(db, 1, limit=3)
+    cursor = encode_cursor(first[-1])
+    second_page = [result.id for result in list_test_results(db, 1, parse_cursor(cursor), 3)[0]]
+
+    # 新しい結果が増えても、同じ cursor の次のページは変わらない
+    db.add(models.TestResult(user_id=1, subject="算数", test_name="newer", created_at=datetime(2030, 1, 1)))
+    db.commit()
+    db.expire_all()
+    again, _ = list_test_results(db, 1, limit=3)
+    assert encode_cursor(list_test_results(db, 1, limit=4)[0][-1]) == cursor
+    assert [result.id for result in list_test_results(db, 1, parse_cursor(cursor), 3)[0]] == second_page
+    assert again[0].test_name == "newer"
+
+
+def test_summary_pages_match_full_pages(db):
+    add_results(db)
+    assert page_through(db, 4, summary=True) == page_through(db, 4)
@@ -0,0 +1,68 @@
+"""前提単元の推移閉包（prerequisite_closure の WITH RECURSIVE）"""
+from sqlalchemy import insert
+
+from app.models import ScienceDependency, TopicEdge
+from app.topic_edges import add_prerequisite, prerequisite_closure
+
+
+def add_graph(db, edges):
+    """単元名の (前提単元, 後続単元) の辺からグラフを作り、単元名→id を返す"""
+    names = sorted({name for edge in edges for name in edge})
+    topics = [ScienceDependency(domain="物理", topic_name=name) for name in names]
+    db.add_all(topics)
+    db.flush()
+    ids = {topic.topic_name: topic.id for topic in topics}
+    db.execute(insert(TopicEdge), [
+        {"subject": "science", "from_id": ids[before], "to_id": ids[after]} for before, after in edges
+    ])
+    db.commit()
+    return ids
+
+
+def closure(db, topic_name, max_depth=None):
+    return [(row["topic_name"], row["depth"]) for row in prerequisite_closure(db, "science", topic_name, max_depth)]
+
+
+def test_chain(db):
+    add_graph(db, [("A", "B"), ("B", "C"), ("C", "D")])
+    assert closure(db, "D") == [("C", 1), ("B", 2), ("A", 3)]
+    assert closure(db, "D", max_depth=2) == [("C", 1), ("B", 2)]
+    assert closure(db, "A") == []
+    assert prerequisite_closure(db, "science", "missing") is None
+
+
+def test_diamond_lists_shared_prerequisite_once_at_shortest_depth(db):
+    add_graph(db, [("A", "B"), ("A", "C"), ("B", "D"), ("C", "D"), ("A", "D")])
+    # A は B・C 経由（深さ2）でも直接（深さ1）でも届くが、近いほうの1行だけ返す
+    assert closure(db, "D") == [("A", 1), ("B", 1), ("C", 1)]
+    assert closure(db, "D", max_depth=1) == [("A", 1), ("B", 1), ("C", 1)]
+
+
+def test_diamond_without_shortcut(db):
+    add_graph(db, [("A", "B"), ("A", "C"), ("B", "D"), ("C", "D")])
+    result = closure(db, "D")
+    assert result == [("B", 1), ("C", 1), ("A", 2)]
+    assert len({name for name, _ in result}) == len(result)
+
+
+def test_cycle_terminates_without_duplicates(db):
+    ids = add_graph(db, [("A", "B"), ("B", "C"), ("C", "A"), ("C", "D")])
+    assert closure(db, "D") == [("C", 1), ("B", 2), ("A", 3)]
+    # 循環上の単元は自分自身を前提単元に含めない
+    assert closure(db, "A") == [("C", 1), ("B", 2)]
+
+    # 自己ループも停止する（辺の数で深さを打ち切る）
+    db.execute(insert(TopicEdge), [{"subject": "science", "from_id": ids["D"], "to_id": ids["D"]}])
+    db.commit()
+    assert closure(db, "D") == [("C", 1), ("B", 2), ("A", 3)]
+
+
+def test_edges_of_other_subjects_are_ignored(db):
+    ids = add_graph(db, [("A", "B")])
+    db.execute(insert(TopicEdge), [{"subject": "social", "from_id": ids["B"], "to_id": ids["A"]}])
+    db.commit()
+    assert closure(db, "B") == [("A", 1)]
+    assert closure(db, "A") == []
+    assert add_prerequisite(db, "science", ids["A"], ids["B"])
+    db.commit()
+    assert closure(db, "A") == [("B", 1)]
@@ -13,6 +13,7 @@ interface TestResult {
   created_at: string;
   overall_analysis?: string;
   topics?: TopicDetail[];
+  error?: string;
 }
 
 interface TopicDetail {
@@ -24,6 +25,10 @@ interface TopicDetail {
   improvement_advice?: string;
 }
 
+// 分析ジョブのポーリング間隔と最大待ち時間
+const ANALYSIS_POLL_INTERVAL_MS = 2000;
+const ANALYSIS_MAX_WAIT_MS = 5 * 60 * 1000;
+
 export default function TestUpload() {
   const [file, setFile] = useState<File | null>(null);
   const [subject, setSubject] = useState('');
@@ -60,9 +65,15 @@ export default function TestUpload() {
       });
 
       if (response.ok) {
-        const result = await response.json();
+        const accepted = await response.json();
+        // 分析はバックグラウンドで実行されるため完了までポーリング
+        const result = await waitForAnalysis(accepted.test_result_id);
         setUploadResult(result);
-        alert('テスト結果のアップロードと分析が完了しました！');
+        if (result.analysis_status === 'completed') {
+          alert('テスト結果のアップロードと分析が完了しました！');
+        } else {
+          alert(`分析に失敗しました: ${result.error || '不明なエラー'}`);
+        }
         // 履歴を更新
         loadTestHistory();
       } else {
@@ -87,6 +98,22 @@ export default function TestUpload() {
     }
   };
 
+  const waitForAnalysis = async (testResultId: number): Promise<TestResult> => {
+    const deadline = Date.now() + ANALYSIS_MAX_WAIT_MS;
+    while (Date.now() < deadline) {
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_BASE}/test-results/jobs/${testResultId}`);
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+      }
+      const job = await response.json();
+      if (job.analysis_status === 'completed' || job.analysis_status === 'failed') {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, ANALYSIS_POLL_INTERVAL_MS));
+    }
+    throw new Error('分析に時間がかかっています。しばらくしてから履歴で結果を確認してください');
+  };
+
   const loadTestHistory = async () => {
     try {
       const response = await fetch(`${process.env.NEXT_PUBLIC_API_BASE}/test-results/1`);
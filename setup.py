@@ -10,6 +10,8 @@ setup(
         "sqlalchemy==2.0.30",
         "pydantic==2.7.1",
         "aiosqlite==0.20.0",
+        "numpy>=1.26",
+        "asyncpg==0.29.0",
         "psycopg2-binary==2.9.9",
     ],
     python_requires=">=3.11",